@@ -2,9 +2,10 @@
 """Record last seen value of specific Control Change events.
 
 The main loop prints out last seen value of specific Control Change events
-every second. The control change events are received by a MIDI input
-callback, which gets called on every MIDI event received and runs
-independently from the main loop.
+every second. The control change values are recorded by the native MIDI
+state tracker of the ``MidiIn`` instance, which is updated with every MIDI
+message received, independently from the main loop and without calling any
+Python code.
 
 """
 
@@ -12,7 +13,6 @@ import time
 
 from rtmidi.midiutil import open_midiinput
 from rtmidi.midiconstants import (
-    CONTROL_CHANGE,
     MODULATION,
     CHANNEL_VOLUME,
     EXPRESSION_CONTROLLER,
@@ -22,36 +22,17 @@ from rtmidi.midiconstants import (
 CONTROLLERS = (MODULATION, CHANNEL_VOLUME, EXPRESSION_CONTROLLER)
 
 
-class MidiInHandler:
-    def __init__(self, channel=1, controllers=None):
-        self.ch = channel
-        self.ccs = controllers or ()
-        self._cur_value = {}
-
-    def __call__(self, event, *args):
-        event, delta = event
-        status = event[0] & 0xF0
-        ch = event[0] & 0xF
-
-        if status == CONTROL_CHANGE and ch == self.ch - 1 and event[1] in self.ccs:
-            self._cur_value[event[1]] = event[2]
-
-    def get(self, cc, default=None):
-        return self._cur_value.get(cc, default)
-
-
 def main(args):
     midiin, _ = open_midiinput(args[0] if args else None)
 
-    # record Modulation, Volume and Expression CC events
-    handler = MidiInHandler(channel=1, controllers=CONTROLLERS)
-    midiin.set_callback(handler)
+    # record Modulation, Volume and Expression CC events on channel 1
+    tracker = midiin.track_state()
 
     try:
         with midiin:
             while True:
                 for cc in CONTROLLERS:
-                    print("CC #%i: %s" % (cc, handler.get(cc)))
+                    print("CC #%i: %s" % (cc, tracker.cc(0, cc)))
 
                 print("--- ")
                 time.sleep(1)
@@ -11,73 +11,41 @@ MIDI clock (status 0xF8) is sent 24 times per quarter note by clock generators.
 
 import argparse
 import time
-from collections import deque
 
-from rtmidi.midiconstants import (TIMING_CLOCK, SONG_CONTINUE, SONG_START, SONG_STOP)
 from rtmidi.midiutil import open_midiinput
 
 
-class MIDIClockReceiver:
-    def __init__(self, bpm=None):
-        self.bpm = bpm if bpm is not None else 120.0
-        self.sync = False
-        self.running = True
-        self._samples = deque()
-        self._last_clock = None
-
-    def __call__(self, event, data=None):
-        msg, _ = event
-
-        if msg[0] == TIMING_CLOCK:
-            now = time.time()
-
-            if self._last_clock is not None:
-                self._samples.append(now - self._last_clock)
-
-            self._last_clock = now
-
-            if len(self._samples) > 24:
-                self._samples.popleft()
-
-            if len(self._samples) >= 2:
-                self.bpm = 2.5 / (sum(self._samples) / len(self._samples))
-                self.sync = True
-
-        elif msg[0] in (SONG_CONTINUE, SONG_START):
-            self.running = True
-            print("START/CONTINUE received.")
-        elif msg[0] == SONG_STOP:
-            self.running = False
-            print("STOP received.")
-
-
 def main(args=None):
     ap = argparse.ArgumentParser(usage=__doc__.splitlines()[0])
     ap.add_argument('-p', '--port', help="MIDI input port index / name.")
     ap.add_argument('bpm', type=int, default=120, help="Starting BPM.")
     args = ap.parse_args(args)
 
-    clock = MIDIClockReceiver(args.bpm)
-
     try:
         m_in, port_name = open_midiinput(args.port)
     except (EOFError, KeyboardInterrupt):
         return 1
 
-    m_in.set_callback(clock)
-    # Important: enable reception of MIDI Clock messages (status 0xF8)
-    m_in.ignore_types(timing=False)
+    # The clock tracker is updated natively with every clock tick, so the
+    # clock messages don't need to be received by Python code at all.
+    clock = m_in.track_clock()
+    running = False
 
     try:
         print("Waiting for clock sync...")
         while True:
             time.sleep(1)
 
-            if clock.running:
+            if clock.running != running:
+                running = clock.running
+                print("START/CONTINUE received." if running else "STOP received.")
+
+            if running:
                 if clock.sync:
-                    print("%.2f bpm" % clock.bpm)
+                    print("%.2f bpm (bar %i, beat %i)" % (
+                          clock.bpm, clock.bar + 1, clock.beat % clock.beats_per_bar + 1))
                 else:
-                    print("%.2f bpm (no sync)" % clock.bpm)
+                    print("%.2f bpm (no sync)" % (clock.bpm or args.bpm))
 
     except KeyboardInterrupt:
         pass
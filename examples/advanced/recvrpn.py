@@ -15,63 +15,21 @@ See also: http://www.somascape.org/midi/tech/spec.html#rpns
 
 """
 
-import time
-from collections import defaultdict
-
-from rtmidi.midiconstants import (CONTROL_CHANGE, DATA_DECREMENT,
-                                  DATA_ENTRY_LSB, DATA_ENTRY_MSB,
-                                  DATA_INCREMENT, RPN_LSB, RPN_MSB)
+from rtmidi import PARAM_RPN
 from rtmidi.midiutil import open_midiinput
 
 
-class RPNDecoder:
-    def __init__(self, channel=1):
-        self.channel = (channel - 1) & 0xF
-        self.rpn = 0
-        self.values = defaultdict(int)
-        self.last_changed = None
-
-    def __call__(self, event, data=None):
-        msg, deltatime = event
-
-        # event type = upper four bits of first byte
-        if msg[0] == (CONTROL_CHANGE | self.channel):
-            cc, value = msg[1], msg[2]
-
-            if cc == RPN_LSB:
-                self.rpn = (self.rpn >> 7) * 128 + value
-            elif cc == RPN_MSB:
-                self.rpn = value * 128 + (self.rpn & 0x7F)
-            elif cc == DATA_INCREMENT:
-                self.set_rpn(self.rpn, min(2 ** 14, self.values[self.rpn] + 1))
-            elif cc == DATA_DECREMENT:
-                self.set_rpn(self.rpn, max(0, self.values[self.rpn] - 1))
-            elif cc == DATA_ENTRY_LSB:
-                self.set_rpn(self.rpn,
-                             (self.values[self.rpn] >> 7) * 128 + value)
-            elif cc == DATA_ENTRY_MSB:
-                self.set_rpn(self.rpn,
-                             value * 128 + (self.values[self.rpn] & 0x7F))
-
-    def set_rpn(self, rpn, value):
-        self.values[rpn] = value
-        self.last_changed = rpn
-
-
 def main(args=None):
-    decoder = RPNDecoder()
     m_in, port_name = open_midiinput(args[0] if args else None)
-    m_in.set_callback(decoder)
+    # Let MidiIn decode the RPN messages natively, so we only get one
+    # ParamChange event for each value change. All other messages are ignored.
+    m_in.set_filter(types=[0xB0], channels=[0])
+    m_in.set_param_decoding(nrpn=False)
 
     try:
-        while True:
-            rpn = decoder.last_changed
-
-            if rpn:
-                print("RPN %i: %i" % (rpn, decoder.values[rpn]))
-                decoder.last_changed = None
-
-            time.sleep(0.1)
+        for message, deltatime in m_in:
+            if getattr(message, 'type', None) == PARAM_RPN:
+                print("RPN %i: %i" % (message.param, message.value))
     except KeyboardInterrupt:
         pass
     finally:
@@ -30,14 +30,13 @@ print("Entering main loop. Press Control-C to exit.")
 try:
     timer = time.time()
     while True:
-        msg = midiin.get_message()
+        # Wait for up to half a second for a message with the GIL released
+        msg = midiin.get_message(timeout=0.5)
 
         if msg:
             message, deltatime = msg
             timer += deltatime
             print("[%s] @%0.6f %r" % (port_name, timer, message))
-
-        time.sleep(0.01)
 except KeyboardInterrupt:
     print('')
 finally:
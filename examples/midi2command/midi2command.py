@@ -86,13 +86,11 @@ class Command(object):
 class MidiInputHandler(object):
     def __init__(self, port, config):
         self.port = port
-        self._wallclock = time.time()
         self.commands = dict()
         self.load_config(config)
 
     def __call__(self, event, data=None):
-        event, deltatime = event
-        self._wallclock += deltatime
+        event, deltatime, timestamp = event
 
         if event[0] < 0xF0:
             channel = (event[0] & 0xF) + 1
@@ -109,7 +107,7 @@ class MidiInputHandler(object):
         if num_bytes >= 3:
             data2 = event[2]
 
-        log.debug("[%s] @%i CH:%2s %02X %s %s", self.port, self._wallclock,
+        log.debug("[%s] @%0.6f CH:%2s %02X %s %s", self.port, timestamp * 1e-9,
                   channel or '-', status, data1, data2 or '')
 
         # Look for matching command definitions
@@ -212,7 +210,14 @@ def main(args=None):
         return
 
     log.debug("Attaching MIDI input callback handler.")
-    midiin.set_callback(MidiInputHandler(port_name, args.config))
+    midiin.set_timestamps()
+    handler = MidiInputHandler(port_name, args.config)
+
+    # only call the handler for message types we have commands for
+    for status in handler.commands:
+        # commands with unknown status are ignored
+        if status is not None:
+            midiin.set_callback_for(status, handler)
 
     log.info("Entering main loop. Press Control-C to exit.")
     try:
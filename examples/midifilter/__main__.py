@@ -32,17 +32,18 @@ class MidiDispatcher(threading.Thread):
         self.midiin = midiin
         self.midiout = midiout
         self.filters = filters
-        self._wallclock = time.time()
         self.queue = queue.Queue()
 
     def __call__(self, event, data=None):
-        message, deltatime = event
-        self._wallclock += deltatime
-        log.debug("IN: @%0.6f %r", self._wallclock, message)
-        self.queue.put((message, self._wallclock))
+        message, deltatime, timestamp = event
+        # monotonic receive time in seconds
+        timestamp *= 1e-9
+        log.debug("IN: @%0.6f %r", timestamp, message)
+        self.queue.put((message, timestamp))
 
     def run(self):
         log.debug("Attaching MIDI input callback handler.")
+        self.midiin.set_timestamps()
         self.midiin.set_callback(self)
 
         while True:
@@ -114,7 +114,7 @@ class SysexSaver(object):
     def __call__(self, event, data=None):
         try:
             message, deltatime = event
-            if message[:1] != [SYSTEM_EXCLUSIVE]:
+            if not message or message[0] != SYSTEM_EXCLUSIVE:
                 return
 
             dt = datetime.now()
@@ -202,6 +202,7 @@ def main(args=None):
     ss = SysexSaver(port, args.outdir, args.verbose)
 
     log.debug("Attaching MIDI input callback handler.")
+    midiin.set_bytes_messages()
     midiin.set_callback(ss)
     log.debug("Enabling reception of sysex messages.")
     midiin.ignore_types(sysex=False)
@@ -1,6 +1,8 @@
 # cython: embedsignature = True
 # cython: language_level = 3
 # cython: show_performance_hints = False
+# cython: freethreading_compatible = True
+# cython: subinterpreters_compatible = own_gil
 # distutils: language = c++
 #
 # rtmidi.pyx
@@ -106,9 +108,23 @@ the `RtMidi API reference`_.
 
 """
 
+import atexit
 import sys
 import warnings
-
+import weakref
+from collections import deque, namedtuple
+
+cimport cython
+from cpython.exc cimport PyErr_CheckSignals
+from cpython.number cimport PyNumber_Index
+from cpython.pystate cimport PyInterpreterState, PyThreadState
+from cpython.bytes cimport PyBytes_FromStringAndSize
+from cpython.ref cimport PyObject, Py_INCREF, Py_XDECREF
+from cpython.buffer cimport (PyBUF_C_CONTIGUOUS, PyBUF_FORMAT, PyBUF_WRITABLE,
+                             PyBuffer_Release, PyObject_CheckBuffer, PyObject_GetBuffer)
+from cython.operator cimport dereference as deref
+from libc.stdint cimport int64_t, uint8_t, uint16_t, uint32_t, uint64_t
+from libc.string cimport memcpy, memset, strcmp
 from libcpp cimport bool
 from libcpp.string cimport string
 from libcpp.vector cimport vector
@@ -116,13 +132,16 @@ from libcpp.vector cimport vector
 
 __all__ = (
     'API_UNSPECIFIED', 'API_MACOSX_CORE', 'API_LINUX_ALSA', 'API_UNIX_JACK',
-    'API_WINDOWS_MM', 'API_RTMIDI_DUMMY', 'API_WEB_MIDI', 'ERRORTYPE_DEBUG_WARNING',
-    'ERRORTYPE_DRIVER_ERROR', 'ERRORTYPE_INVALID_DEVICE',
+    'API_WINDOWS_MM', 'API_RTMIDI_DUMMY', 'API_WEB_MIDI', 'DIN_MIDI_BYTE_RATE',
+    'ERRORTYPE_DEBUG_WARNING', 'ERRORTYPE_DRIVER_ERROR', 'ERRORTYPE_INVALID_DEVICE',
     'ERRORTYPE_INVALID_PARAMETER', 'ERRORTYPE_INVALID_USE',
     'ERRORTYPE_MEMORY_ERROR', 'ERRORTYPE_NO_DEVICES_FOUND',
     'ERRORTYPE_SYSTEM_ERROR', 'ERRORTYPE_THREAD_ERROR',
     'ERRORTYPE_UNSPECIFIED', 'ERRORTYPE_WARNING', 'InvalidPortError',
-    'InvalidUseError', 'MemoryAllocationError', 'MidiIn', 'MidiOut',
+    'InvalidUseError', 'MIDI_RECORD_DTYPE', 'MIDI_RECORD_FORMAT', 'MIDI_RECORD_SIZE',
+    'MIDI_STATE_DTYPE', 'MIDI_STATE_SIZE', 'MemoryAllocationError',
+    'MidiClockTracker', 'MidiIn', 'MidiInGroup', 'MidiOut', 'MidiStateTracker',
+    'PARAM_CONTROLLER', 'PARAM_NRPN', 'PARAM_RPN', 'ParamChange',
     'NoDevicesError', 'RtMidiError', 'SystemError',
     'UnsupportedOperationError', 'get_api_display_name', 'get_api_name',
     'get_compiled_api', 'get_compiled_api_by_name', 'get_rtmidi_version'
@@ -170,7 +189,7 @@ cdef extern from "RtMidi.h":
 
     ctypedef void (*RtMidiCallback)(double timeStamp,
                                     vector[unsigned char] *message,
-                                    void *userData) except * with gil
+                                    void *userData) noexcept nogil
 
     ctypedef void (*RtMidiErrorCallback)(ErrorType errorType,
                                          const string errorText,
@@ -200,23 +219,832 @@ cdef extern from "RtMidi.h":
         Api RtMidiOut(Api rtapi, string clientName) except +
         Api getCurrentApi()
         void sendMessage(vector[unsigned char] *message) except *
+        # Without the check for an exception raised by the error callback,
+        # which needs the GIL, for sending with the GIL released, see
+        # _ErrorContext.raised, and for the scheduler thread
+        void sendMessageNoexcept "sendMessage"(const unsigned char *message,
+                                               size_t size) noexcept nogil
+
+
+# Cython warns that ``with gil`` is unlikely to work with sub-interpreters, since
+# it attaches native threads to the main interpreter. The backend and dispatcher
+# threads attach to the interpreter owning the object first, see interpreter.h.
+
+cdef extern from "interpreter.h":
+    PyInterpreterState *current_interpreter()
+    PyThreadState *interpreter_attach(PyInterpreterState *interp) nogil
+    void interpreter_detach(PyThreadState *tstate) nogil
+
+# Declarations for the native MIDI input queue
+
+cdef extern from "monotonic_clock.h" nogil:
+    int64_t monotonic_ns()
+
+
+cdef extern from "input_queue.h" nogil:
+    cdef cppclass MidiEvent:
+        double delta_time
+        int64_t timestamp
+        int source
+        vector[unsigned char] message
+
+    cdef cppclass MidiInQueue:
+        MidiInQueue(size_t size_limit) except +
+        bint push(double delta_time, int64_t timestamp,
+                  const vector[unsigned char] &message)
+        size_t pop(vector[MidiEvent] &out, size_t max_count)
+        void unpop(vector[MidiEvent] &events, size_t start)
+        size_t size()
+        size_t max_size()
+        uint64_t dropped()
+        void reset_stats()
+        void set_coalescing(bint enable)
+        unsigned long interrupt_token()
+        int wait_for(double timeout, unsigned long token)
+        void interrupt()
+        int notify_fd()
+
+    cdef cppclass InputRoute:
+        InputRoute(MidiInQueue *queue) except +
+        bint push(double delta_time, int64_t timestamp,
+                  const vector[unsigned char] &message)
+        void set(MidiInQueue *queue, int source)
+        void interrupt()
+
+    cdef cppclass InputStats:
+        void add_received(size_t size)
+        void add_filtered()
+        void add_callback(int64_t duration, int64_t gil_wait)
+        void reset()
+        uint64_t received()
+        uint64_t filtered()
+        uint64_t bytes()
+        uint64_t callbacks()
+        int64_t callback_time()
+        int64_t max_callback_time()
+        int64_t gil_wait_time()
+
+    ctypedef void (*DeliverFunc)(vector[MidiEvent] &events, void *data) noexcept
+
+    bint dispatcher_released()
+
+    cdef cppclass BatchDispatcher:
+        BatchDispatcher(MidiInQueue *queue, double max_latency,
+                        DeliverFunc deliver, void *data) except +
+        bint in_thread()
+        void release()
+
+
+cdef extern from "output_scheduler.h" nogil:
+    bint in_output_scheduler()
+
+    ctypedef void (*SendFunc)(const unsigned char *message, size_t size,
+                              void *data) noexcept
+
+    cdef cppclass OutputScheduler:
+        OutputScheduler(SendFunc send, void *data,
+                        PyInterpreterState *interp) except +
+        void push(int64_t time, const unsigned char *message, size_t size) except +
+        uint64_t push_next(const unsigned char *message, size_t size) except +
+        void set_rate(double bytes_per_second, int64_t sysex_gap)
+        uint64_t next_position()
+        unsigned long clear_token()
+        void add_waiter()
+        int wait_sent(uint64_t position, double timeout, unsigned long token)
+        size_t clear()
+        size_t size()
+
+
+cdef extern from "midi_state.h" nogil:
+    cdef struct MidiStateData:
+        unsigned char cc[16][128]
+        unsigned char notes[16][128]
+        uint16_t pitch_bend[16]
+        uint16_t bank[16]
+        unsigned char channel_pressure[16]
+        unsigned char program[16]
+
+    cdef cppclass MidiState:
+        MidiState() except +
+        void update(const unsigned char *message, size_t size)
+        void snapshot(MidiStateData &out)
+        const MidiStateData &data()
+        void reset()
+
+
+cdef extern from "midi_clock.h" nogil:
+    int64_t MIDI_CLOCK_TIMEOUT
+
+    cdef struct MidiClockState:
+        int64_t position
+        int64_t last_tick
+        int64_t interval
+        bint running
+
+    cdef cppclass MidiClock:
+        MidiClock() except +
+        bint update(const unsigned char *message, size_t size, int64_t timestamp)
+        void snapshot(MidiClockState &out)
+        void reset()
+
+
+# Per-instance state of the MidiIn input callback
+
+cdef struct _InputFilter:
+    # accepted status bytes / controller numbers (non-zero if accepted)
+    unsigned char status[256]
+    unsigned char controllers[128]
+
+cdef enum:
+    # Pseudo status byte (undefined in MIDI) of decoded parameter changes
+    _PARAM_CHANGE = 0xF5
+    _PARAM_CONTROLLER = 1
+    _PARAM_RPN = 2
+    _PARAM_NRPN = 3
+
+cdef struct _ParamDecoder:
+    bint enabled
+    bint rpn
+    bint nrpn
+    # 14-bit controllers to decode by MSB controller number
+    unsigned char controllers[32]
+    # last MSB value of 14-bit controllers
+    unsigned char msb[16][32]
+    # selected parameter type (_PARAM_RPN, _PARAM_NRPN or 0)
+    unsigned char selected[16]
+    unsigned char param_msb[16]
+    unsigned char param_lsb[16]
+    # value of the selected parameter
+    unsigned short value[16]
+
+cdef struct _InputContext:
+    # interpreter owning the MidiIn instance, in which callbacks are called
+    PyInterpreterState *interp
+    InputRoute *route
+    InputStats *stats
+    # state updated with all received messages or NULL, changed under the lock
+    MidiState *state
+    # clock updated with all received clock messages or NULL, changed under
+    # the lock
+    MidiClock *clock
+    # whether to discard timing messages, which are only received for clock
+    bint drop_timing
+    # guards callback, batch and handlers, which are changed by other threads
+    # while the backend thread reads them (the GIL does not serialize this on
+    # free-threaded builds)
+    cython.pymutex *lock
+    # Borrowed reference to the Python callback info of the owning MidiIn
+    # instance or NULL, if no callback is registered. The owner keeps the
+    # reference in an attribute, which is only replaced under the lock.
+    void *callback
+    # whether the callback is called with batches by the dispatcher thread
+    bint batch
+    # Borrowed references to the Python callback info registered for each
+    # status byte or NULL. Kept alive by the owner like the callback.
+    void *handlers[256]
+    # whether events include the monotonic timestamp
+    bint timestamps
+    # whether messages are returned as bytes instead of lists
+    bint as_bytes
+    # changed under the lock, like state and clock
+    _InputFilter filter
+    _ParamDecoder decoder
+
+
+# Receiver of batches of MIDI input from a BatchDispatcher thread
+
+cdef struct _DispatchTarget:
+    # Borrowed reference to the receiving _SharedDispatch
+    void *owner
+    # interpreter owning the receiver
+    PyInterpreterState *interp
+
+
+# State of a MidiInGroup used by its dispatcher thread, which never touches
+# the MidiInGroup instance itself, since it may be deleted while the thread
+# waits for the GIL
+
+cdef struct _GroupContext:
+    # interpreter owning the MidiInGroup instance
+    PyInterpreterState *interp
+    # guards callback
+    cython.pymutex *lock
+    # Borrowed reference to the Python callback info of the owning group or
+    # NULL, if no callback is registered. The owner keeps the reference in an
+    # attribute, which is only replaced under the lock.
+    void *callback
+    # Borrowed reference to the tuple of inputs of the group, which is not
+    # changed after initialization
+    void *inputs
+
+
+# State of the error callback passed to RtMidi
+
+cdef struct _ErrorContext:
+    # Borrowed reference to the (func, data) tuple of the error callback,
+    # kept alive by the owner like _InputContext.callback, or NULL while the
+    # owner is being deleted
+    void *callback
+    # backend API of the owner, for decoding error messages without it
+    Api api
+    # guards callback
+    cython.pymutex *lock
+    # whether the error callback raised an exception, which is still set in
+    # the calling thread, so loops sending with the GIL released can check it
+    # without acquiring the GIL
+    bint raised
+
+cdef struct _OutputContext:
+    RtMidiOut *out
+    # the lock of the owning MidiOut instance serializing all sends
+    cython.pymutex *lock
+
+
+# Record written for each MIDI event by MidiIn.readinto
+
+cdef struct _MidiRecord:
+    int64_t timestamp
+    uint32_t length
+    uint32_t offset
+    uint8_t status
+    uint8_t data1
+    uint8_t data2
+    uint8_t reserved[5]
 
 
 # internal functions
 
 cdef void _cb_func(double delta_time, vector[unsigned char] *msg_v,
-                   void *cb_info) except * with gil:
-    """Wrapper for a Python callback function for MIDI input."""
-    func, data = (<object> cb_info)
-    message = [msg_v.at(i) for i in range(msg_v.size())]
-    func((message, delta_time), data)
+                   void *cb_info) noexcept nogil:
+    """Receive MIDI input from the RtMidi backend thread.
+
+    Messages are added to the native input queue without acquiring the GIL,
+    unless a Python callback function is registered.
+
+    """
+    cdef _InputContext *ctx = <_InputContext *> cb_info
+    cdef int64_t timestamp = monotonic_ns()
+
+    if msg_v.empty():
+        return
+
+    cdef vector[unsigned char] param_v
+    cdef int decoded = 0
+
+    # The trackers, filter and decoder are changed by other threads
+    with ctx.lock[0]:
+        if ctx.clock != NULL:
+            ctx.clock.update(msg_v.data(), msg_v.size(), timestamp)
+
+            if ctx.drop_timing and _is_timing(deref(msg_v)[0]):
+                return
+
+        ctx.stats.add_received(msg_v.size())
+
+        if ctx.state != NULL:
+            ctx.state.update(msg_v.data(), msg_v.size())
+
+        if not _filter_accepts(&ctx.filter, msg_v):
+            ctx.stats.add_filtered()
+            return
+
+        if ctx.decoder.enabled:
+            decoded = _decode_param(&ctx.decoder, msg_v, param_v)
+
+            if decoded == 1:
+                return
+            elif decoded == 2:
+                msg_v = &param_v
+
+    cdef PyThreadState *tstate
+    cdef int64_t waiting
+    cdef bint handled = False
+
+    # The callback wrappers check the callback info again under the lock
+    if ctx.handlers[deref(msg_v)[0]] != NULL or ctx.callback != NULL and not ctx.batch:
+        waiting = monotonic_ns()
+        tstate = interpreter_attach(ctx.interp)
+        handled = (ctx.handlers[deref(msg_v)[0]] != NULL and
+                   _call_handler(ctx, delta_time, timestamp, msg_v, waiting) or
+                   ctx.callback != NULL and not ctx.batch and
+                   _call_callback(ctx, delta_time, timestamp, msg_v, waiting))
+        interpreter_detach(tstate)
+
+    if not handled:
+        ctx.route.push(delta_time, timestamp, deref(msg_v))
+
+
+cdef inline bint _is_timing(unsigned char status) noexcept nogil:
+    """Check whether a message is ignored by RtMidi with ignoreTypes(midiTime)."""
+    # MIDI time code quarter frame, timing clock, tick
+    return status == 0xF1 or status == 0xF8 or status == 0xF9
+
+
+cdef inline bint _filter_accepts(_InputFilter *filter,
+                                 vector[unsigned char] *msg_v) noexcept nogil:
+    """Check whether a message passes the filter set with MidiIn.set_filter."""
+    cdef unsigned char status = deref(msg_v)[0]
+
+    if not filter.status[status]:
+        return False
+
+    if status & 0xF0 == 0xB0 and msg_v.size() > 1:
+        return filter.controllers[deref(msg_v)[1] & 0x7F]
+
+    return True
+
+
+cdef int _decode_param(_ParamDecoder *dec, vector[unsigned char] *msg_v,
+                       vector[unsigned char] &param_v) noexcept nogil:
+    """Decode 14-bit controller, RPN and NRPN messages.
+
+    Returns 0 if the message is passed on unchanged, 1 if it was consumed and
+    2 if it completed a parameter change, which was encoded in ``param_v``.
+
+    """
+    cdef unsigned char ch, cc, value, type
+    cdef unsigned short param_value
+
+    if msg_v.size() != 3 or deref(msg_v)[0] & 0xF0 != 0xB0:
+        return 0
+
+    ch = deref(msg_v)[0] & 0x0F
+    cc = deref(msg_v)[1] & 0x7F
+    value = deref(msg_v)[2] & 0x7F
+
+    if (cc == 101 or cc == 100) and dec.rpn or (cc == 99 or cc == 98) and dec.nrpn:
+        type = _PARAM_RPN if cc >= 100 else _PARAM_NRPN
+
+        if dec.selected[ch] != type:
+            dec.param_msb[ch] = dec.param_lsb[ch] = 0
+
+        if cc & 1:
+            dec.param_msb[ch] = value
+        else:
+            dec.param_lsb[ch] = value
+
+        # parameter number 127/127 is the "null" parameter, i.e. deselects
+        if dec.param_msb[ch] == 127 and dec.param_lsb[ch] == 127:
+            dec.selected[ch] = 0
+        else:
+            dec.selected[ch] = type
+
+        dec.value[ch] = 0
+        return 1
+
+    if dec.selected[ch] and (cc == 6 or cc == 38 or cc == 96 or cc == 97):
+        if cc == 6:  # Data Entry MSB, resets the LSB
+            dec.value[ch] = value << 7
+        elif cc == 38:  # Data Entry LSB
+            dec.value[ch] = (dec.value[ch] & 0x3F80) | value
+        elif cc == 96:  # Data Increment
+            dec.value[ch] = min(dec.value[ch] + 1, 0x3FFF)
+        elif dec.value[ch] > 0:  # Data Decrement
+            dec.value[ch] -= 1
+
+        _encode_param(param_v, dec.selected[ch], ch,
+                      dec.param_msb[ch] << 7 | dec.param_lsb[ch], dec.value[ch])
+        return 2
+
+    if cc < 32 and dec.controllers[cc]:  # MSB, resets the LSB
+        dec.msb[ch][cc] = value
+        _encode_param(param_v, _PARAM_CONTROLLER, ch, cc, value << 7)
+        return 2
+
+    if 32 <= cc < 64 and dec.controllers[cc - 32]:
+        _encode_param(param_v, _PARAM_CONTROLLER, ch, cc - 32,
+                      dec.msb[ch][cc - 32] << 7 | value)
+        return 2
+
+    return 0
+
+
+cdef inline void _encode_param(vector[unsigned char] &param_v, unsigned char type,
+                               unsigned char channel, unsigned short param,
+                               unsigned short value) noexcept nogil:
+    """Encode a decoded parameter change as a message for the input queue."""
+    param_v.resize(7)
+    param_v[0] = _PARAM_CHANGE
+    param_v[1] = type
+    param_v[2] = channel
+    param_v[3] = param >> 7
+    param_v[4] = param & 0x7F
+    param_v[5] = value >> 7
+    param_v[6] = value & 0x7F
+
+
+cdef bint _call_callback(_InputContext *ctx, double delta_time, int64_t timestamp,
+                         vector[unsigned char] *msg_v,
+                         int64_t waiting) noexcept with gil:
+    """Wrapper for a Python callback function for MIDI input.
+
+    ``waiting`` is the time when the GIL was requested. Returns ``False`` if
+    the callback was cancelled in the meantime.
+
+    """
+    cdef int64_t start = monotonic_ns()
+    callback = _get_callback(ctx, &ctx.callback)
+
+    if callback is None or ctx.batch:
+        return False
+
+    func, data, raw = callback
+
+    if raw:
+        _call_raw(ctx, func, deref(msg_v), delta_time, timestamp)
+    else:
+        _call_event(ctx, func, data, deref(msg_v), delta_time, timestamp)
+
+    ctx.stats.add_callback(monotonic_ns() - start, start - waiting)
+    return True
+
+
+cdef void _call_event(_InputContext *ctx, func, data, vector[unsigned char] &msg_v,
+                      double delta_time, int64_t timestamp) noexcept:
+    """Call a callback function with the event tuple for one MIDI message.
+
+    An exception raised by the callback is reported as unraisable, so the
+    message still counts as handled and is not queued as well.
+
+    """
+    func(_make_event(ctx, msg_v, delta_time, timestamp), data)
+
+
+cdef inline void _call_raw(_InputContext *ctx, func, vector[unsigned char] &msg_v,
+                           double delta_time, int64_t timestamp) noexcept:
+    """Call a callback registered with ``raw=True`` for one MIDI message.
+
+    Messages of up to three bytes are passed as ``func(status, data1, data2,
+    delta_time)`` with missing data bytes as 0, so no message object or event
+    tuple has to be created. ``ParamChange`` events are passed as the first
+    argument and other messages as ``bytes``, with both data bytes as 0.
+
+    An exception raised by the callback is reported as unraisable, so the
+    remaining messages of a batch are still passed to the callback.
+
+    """
+    cdef size_t size = msg_v.size()
+
+    if size <= 3 and msg_v[0] != 0xF0:
+        status = msg_v[0]
+        data1 = msg_v[1] if size > 1 else 0
+        data2 = msg_v[2] if size > 2 else 0
+    else:
+        if ctx.decoder.enabled and size == 7 and msg_v[0] == _PARAM_CHANGE:
+            status = _make_event(ctx, msg_v, delta_time, timestamp)[0]
+        else:
+            status = PyBytes_FromStringAndSize(<char *>msg_v.data(), size)
+
+        data1 = data2 = 0
+
+    if ctx.timestamps:
+        func(status, data1, data2, delta_time, timestamp)
+    else:
+        func(status, data1, data2, delta_time)
+
+
+cdef bint _call_handler(_InputContext *ctx, double delta_time, int64_t timestamp,
+                        vector[unsigned char] *msg_v,
+                        int64_t waiting) noexcept with gil:
+    """Wrapper for a Python callback function for one MIDI message type.
+
+    Returns ``False`` if the callback was removed in the meantime.
+
+    """
+    cdef int64_t start = monotonic_ns()
+    handler = _get_callback(ctx, &ctx.handlers[deref(msg_v)[0]])
+
+    if handler is None:
+        return False
+
+    func, data = handler
+    _call_event(ctx, func, data, deref(msg_v), delta_time, timestamp)
+    ctx.stats.add_callback(monotonic_ns() - start, start - waiting)
+    return True
 
 
 cdef void _cb_error_func(ErrorType errorType, const string &errorText,
                          void *cb_info) except * with gil:
-    """Wrapper for a Python callback function for errors."""
-    func, data, decoder = (<object> cb_info)
-    func(errorType, decoder(errorText), data)
+    """Wrapper for a Python callback function for errors.
+
+    RtMidi reports errors from calls of its API, i.e. in Python threads, so
+    ``with gil`` uses the thread state of the calling interpreter. The only
+    exception is scheduled output, which is sent by the thread of an
+    ``OutputScheduler``. It is attached to the interpreter of the ``MidiOut``
+    instance, but exceptions raised by the callback can only be reported as
+    unraisable there.
+
+    """
+    cdef _ErrorContext *ctx = <_ErrorContext *> cb_info
+
+    if in_output_scheduler():
+        _report_error(ctx, errorType, errorText)
+    else:
+        # stays set, if the callback raises an exception
+        ctx.raised = True
+        _call_error_callback(ctx, errorType, errorText)
+        ctx.raised = False
+
+
+cdef inline int _check_raised(_ErrorContext *ctx) except -1:
+    """Propagate an exception raised by the error callback with the GIL released.
+
+    The exception is still set in the calling thread, since the error callback
+    is called in the thread calling RtMidi.
+
+    """
+    if ctx.raised:
+        ctx.raised = False
+        return -1
+
+    return 0
+
+
+cdef _call_error_callback(_ErrorContext *ctx, ErrorType errorType,
+                          const string &errorText):
+    # The owning instance is not used, since the scheduler thread may call
+    # this while the instance is being deleted, see MidiOut.__dealloc__
+    with ctx.lock[0]:
+        if ctx.callback == NULL:
+            return
+
+        func, data = (<object> ctx.callback)
+
+    func(errorType, errorText.decode(_auto_encoding(ctx.api), "ignore"), data)
+
+
+cdef str _auto_encoding(Api api):
+    """Return the encoding of strings returned by the backend ``api``."""
+    if sys.platform.startswith('win'):
+        return 'latin1'
+    elif api == MACOSX_CORE and sys.platform == 'darwin':
+        return 'macroman'
+
+    return 'utf-8'
+
+
+cdef void _report_error(_ErrorContext *ctx, ErrorType errorType,
+                        const string &errorText) noexcept:
+    _call_error_callback(ctx, errorType, errorText)
+
+
+cdef void _send_scheduled(const unsigned char *message, size_t size,
+                          void *data) noexcept nogil:
+    """Send a message, which is due, from the thread of an OutputScheduler."""
+    cdef _OutputContext *ctx = <_OutputContext *> data
+
+    with ctx.lock[0]:
+        ctx.out.sendMessageNoexcept(message, size)
+
+
+cdef void _delete_scheduler(OutputScheduler *scheduler) noexcept:
+    """Stop and delete a scheduler thread (NULL is ignored)."""
+    if scheduler != NULL:
+        # The thread may be waiting for the GIL in the error callback
+        with nogil:
+            del scheduler
+
+
+cdef inline object _get_callback(_InputContext *ctx, void **slot):
+    """Return the callback info in ``slot`` of ``ctx`` or None.
+
+    The lock ensures the reference is taken before the callback info can be
+    released by another thread replacing it.
+
+    """
+    with ctx.lock[0]:
+        if slot[0] != NULL:
+            return <object> slot[0]
+
+    return None
+
+
+cdef void _deliver_batch(vector[MidiEvent] &events, void *cb_info) noexcept nogil:
+    """Pass a batch of MIDI input from the dispatcher thread to Python."""
+    cdef _InputContext *ctx = <_InputContext *> cb_info
+    cdef int64_t waiting = monotonic_ns()
+    cdef PyThreadState *tstate = interpreter_attach(ctx.interp)
+    _call_batch_callback(ctx, events, waiting)
+    interpreter_detach(tstate)
+
+
+cdef void _call_batch_callback(_InputContext *ctx, vector[MidiEvent] &events,
+                               int64_t waiting) noexcept with gil:
+    """Wrapper for a Python callback function for batches of MIDI input."""
+    cdef int64_t start = monotonic_ns()
+    cdef size_t i
+    callback = _get_callback(ctx, &ctx.callback)
+
+    if callback is None:
+        return
+
+    func, data, raw = callback
+
+    # The callback may cancel itself or delete the MidiIn instance, after
+    # which ctx must not be used anymore, see _delete_dispatcher.
+    if raw:
+        # called once per message, but with a single GIL acquisition
+        for i in range(events.size()):
+            _call_raw(ctx, func, events[i].message, events[i].delta_time,
+                      events[i].timestamp)
+
+            if dispatcher_released():
+                return
+
+            ctx.stats.add_callback(monotonic_ns() - start, start - waiting)
+            start = monotonic_ns()
+    else:
+        func([_event_to_tuple(ctx, events[i]) for i in range(events.size())], data)
+
+        if not dispatcher_released():
+            ctx.stats.add_callback(monotonic_ns() - start, start - waiting)
+
+
+cdef void _delete_dispatcher(BatchDispatcher *dispatcher) noexcept:
+    """Stop and delete a dispatcher thread (NULL is ignored).
+
+    If called by a callback running in the thread itself, the thread can not be
+    joined, so it is released and deletes itself when the callback returns.
+
+    """
+    if dispatcher == NULL:
+        return
+
+    if dispatcher.in_thread():
+        dispatcher.release()
+    else:
+        # The thread may be waiting for the GIL in the callback wrapper
+        with nogil:
+            del dispatcher
+
+
+cdef int _wait_for_input(MidiInQueue *queue, timeout, token=None) except -2:
+    """Wait with the GIL released until a message is queued.
+
+    Returns 1 if messages are available, 0 if ``timeout`` expired and -1 if the
+    wait was interrupted by closing the port, since ``token`` was obtained
+    with ``interrupt_token``, if given. Wakes up periodically to let signal
+    handlers run, so waiting can be aborted with Control-C.
+
+    """
+    cdef double remaining = -1.0 if timeout is None else timeout
+    cdef double interval
+    cdef unsigned long interrupts = queue.interrupt_token() if token is None else token
+    cdef int result
+
+    while True:
+        interval = _SIGNAL_CHECK_INTERVAL
+
+        if 0 <= remaining < interval:
+            interval = remaining
+
+        with nogil:
+            result = queue.wait_for(interval, interrupts)
+
+        if result != 0:
+            return result
+
+        PyErr_CheckSignals()
+
+        if remaining >= 0:
+            remaining -= interval
+
+            if remaining <= 0:
+                return 0
+
+
+def _wait_for_input_timeout(MidiIn midiin, timeout):
+    """Wait with the GIL released until a message is queued or timeout expires.
+
+    Used by ``MidiIn.receive`` where the notification file descriptor is not
+    supported.
+
+    """
+    _wait_for_input(midiin._queue, timeout)
+
+
+cdef inline tuple _event_to_tuple(_InputContext *ctx, MidiEvent &event):
+    """Convert a queued MIDI event into a tuple as returned by get_message."""
+    return _make_event(ctx, event.message, event.delta_time, event.timestamp)
+
+
+cdef tuple _make_event(_InputContext *ctx, vector[unsigned char] &msg_v,
+                       double delta_time, int64_t timestamp):
+    """Return a (message, delta_time[, timestamp]) tuple for a MIDI event."""
+    if ctx.decoder.enabled and msg_v.size() == 7 and msg_v[0] == _PARAM_CHANGE:
+        message = ParamChange(msg_v[1], msg_v[2], msg_v[3] << 7 | msg_v[4],
+                              msg_v[5] << 7 | msg_v[6])
+    elif ctx.as_bytes:
+        message = PyBytes_FromStringAndSize(<char *>msg_v.data(), msg_v.size())
+    else:
+        message = [msg_v[i] for i in range(msg_v.size())]
+
+    if ctx.timestamps:
+        return (message, delta_time, timestamp)
+
+    return (message, delta_time)
+
+
+cdef bint _get_byte_buffer(obj, Py_buffer *view) except -1:
+    """Get a contiguous buffer of unsigned bytes exported by ``obj``.
+
+    Returns ``False`` if ``obj`` does not support the buffer protocol or the
+    buffer has another item format, e.g. ``array('H')``, or is not contiguous.
+    Otherwise the buffer must be released with ``PyBuffer_Release``.
+
+    """
+    cdef const char *fmt
+
+    if not PyObject_CheckBuffer(obj):
+        return False
+
+    try:
+        PyObject_GetBuffer(obj, view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT)
+    except (BufferError, ValueError, TypeError):
+        # e.g. NumPy raises ValueError for arrays, which are not contiguous
+        return False
+
+    fmt = view.format
+
+    if fmt != NULL and fmt[0] in b'@=<>!':
+        fmt += 1
+
+    if view.itemsize != 1 or (fmt != NULL and strcmp(fmt, b'B') != 0 and
+                              strcmp(fmt, b'c') != 0):
+        PyBuffer_Release(view)
+        return False
+
+    return True
+
+
+cdef int _append_message(vector[unsigned char] &data, message) except -1:
+    """Append the bytes of a MIDI message given as a buffer or iterable."""
+    cdef Py_buffer view
+    cdef size_t size = data.size()
+
+    if _get_byte_buffer(message, &view):
+        try:
+            data.resize(size + view.len)
+
+            if view.len:
+                memcpy(&data[size], view.buf, view.len)
+        finally:
+            PyBuffer_Release(&view)
+
+        return 0
+
+    try:
+        data.reserve(size + len(message))
+    except TypeError:
+        pass
+
+    for c in message:
+        data.push_back(c)
+
+    return 0
+
+
+cdef int _split_sysex(const unsigned char *data, size_t size, vector[size_t] &offsets,
+                      vector[size_t] &sizes) except -1:
+    """Find the System Exclusive messages in ``data``.
+
+    Stores the offset and size of each sequence from 0xF0 up to the next 0xF7.
+    Bytes outside of these are skipped.
+
+    """
+    cdef size_t start = 0
+    cdef size_t i
+    cdef bint in_sysex = False
+
+    for i in range(size):
+        if data[i] == 0xF7 and in_sysex:
+            offsets.push_back(start)
+            sizes.push_back(i - start + 1)
+            in_sysex = False
+        elif data[i] == 0xF0 or (in_sysex and data[i] & 0x80):
+            if in_sysex:
+                raise ValueError("System Exclusive message at offset %i is not "
+                                 "terminated by 0xF7." % start)
+
+            start = i
+            in_sysex = True
+
+    if in_sysex:
+        raise ValueError("System Exclusive message at offset %i is not terminated "
+                         "by 0xF7." % start)
+
+    return 0
+
+
+cdef int _check_message(const unsigned char *message, size_t size) except -1:
+    """Raise ValueError if a MIDI message can not be sent."""
+    if size == 0:
+        raise ValueError("'message' must not be empty.")
+    elif size > 3 and message[0] != 0xF0:
+        raise ValueError("'message' longer than 3 bytes but does not "
+                         "start with 0xF0.")
+
+    return 0
 
 
 def _to_bytes(name):
@@ -232,6 +1060,9 @@ def _to_bytes(name):
 
 # Public API
 
+# interval in seconds, in which blocking calls check for pending signals
+cdef double _SIGNAL_CHECK_INTERVAL = 0.1
+
 # export Api enum values to Python
 
 API_UNSPECIFIED = UNSPECIFIED
@@ -257,6 +1088,42 @@ ERRORTYPE_SYSTEM_ERROR = ERR_SYSTEM_ERROR
 ERRORTYPE_THREAD_ERROR = ERR_THREAD_ERROR
 
 
+# description of the records written by MidiIn.readinto
+
+MIDI_RECORD_SIZE = sizeof(_MidiRecord)
+MIDI_RECORD_FORMAT = '=qIIBBB5x'
+MIDI_RECORD_DTYPE = {
+    'names': ['timestamp', 'length', 'offset', 'status', 'data1', 'data2'],
+    'formats': ['=i8', '=u4', '=u4', 'u1', 'u1', 'u1'],
+    'offsets': [0, 8, 12, 16, 17, 18],
+    'itemsize': MIDI_RECORD_SIZE,
+}
+
+# Size and NumPy dtype specification of MidiStateTracker.snapshot() data
+MIDI_STATE_SIZE = sizeof(MidiStateData)
+MIDI_STATE_DTYPE = {
+    'names': ['cc', 'notes', 'pitch_bend', 'bank', 'channel_pressure', 'program'],
+    'formats': [('u1', (16, 128)), ('u1', (16, 128)), ('=u2', 16), ('=u2', 16),
+                ('u1', 16), ('u1', 16)],
+    'offsets': [0, 2048, 4096, 4128, 4160, 4176],
+    'itemsize': MIDI_STATE_SIZE,
+}
+
+
+# decoded parameter changes returned by MidiIn when set_param_decoding is used
+
+PARAM_CONTROLLER = _PARAM_CONTROLLER
+PARAM_RPN = _PARAM_RPN
+PARAM_NRPN = _PARAM_NRPN
+
+# bytes per second transmitted by a DIN MIDI connection (31250 baud with ten
+# bits per byte), for MidiOut.set_output_rate
+
+DIN_MIDI_BYTE_RATE = 3125
+
+ParamChange = namedtuple('ParamChange', 'type channel param value')
+
+
 # custom exceptions
 
 class RtMidiError(Exception):
@@ -424,107 +1291,369 @@ def _default_error_handler(etype, msg, data=None):
     raise RtMidiError(msg, type=etype)
 
 
-cdef class MidiBase:
-    cdef object _port
-    cdef object _error_callback
-    cdef object _deleted
-
-    cdef RtMidi* baseptr(self):
-        return NULL
+cdef int _check_channel(int channel) except -1:
+    if not 0 <= channel < 16:
+        raise ValueError("MIDI channel must be in range 0..15.")
 
-    # context management
-    def __enter__(self):
-        """Support context manager protocol.
+    return 0
 
-        This means you can use ``MidiIn`` / ``MidiOut`` instances like this:
 
-        :
+cdef int _check_data_byte(int value, name) except -1:
+    if not 0 <= value < 128:
+        raise ValueError("%s must be in range 0..127." % name)
 
-            midiout = MidiIn()
-            midiout.open_port(0)
+    return 0
 
-            with midiout:
-                midiout.send_message([...])
 
-        and ``midiout.close_port()`` will be called automatically when exiting
-        the ``with`` block.
+cdef int _check_14bit(int value, name) except -1:
+    if not 0 <= value < 16384:
+        raise ValueError("%s must be in range 0..16383." % name)
 
-        Since ``open_port()`` also returns the instance, you can even do:
+    return 0
 
-        :
 
-            midiout = MidiIn()
+cdef class MidiStateTracker:
+    """Current per-channel state of a MIDI input stream.
 
-            with midiout.open_port(0):
-                midiout.send_message([...])
+    ``rtmidi.MidiStateTracker()``
 
-        """
-        return self
+    Keeps the last value of all controllers, the held notes and their
+    velocities, the pitch bend and channel pressure value, the selected
+    program and bank for all 16 MIDI channels.
 
-    def __exit__(self, *exc_info):
-        """Support context manager protocol.
+    A tracker is usually obtained with ``MidiIn.track_state``, which updates
+    it natively with every received MIDI message, without the overhead of
+    calling a Python function for each message. A stand-alone tracker can be
+    updated by passing messages to the ``update`` method.
 
-        This method is called when using a ``MidiIn`` / ``MidiOut`` instance as
-        a context manager and closes open ports when exiting the ``with`` block.
+    All methods take a zero-based MIDI channel number (0-15) and raise a
+    ``ValueError`` for a channel, controller or note number out of range.
 
-        """
-        self.close_port()
+    """
 
-    def _check_port(self):
-        inout = "input" if isinstance(self, MidiIn) else "output"
-        if self._port == -1:
-            raise InvalidUseError("%r already opened virtual %s port." %
-                                  (self, inout))
-        elif self._port is not None:
-            raise InvalidUseError("%r already opened %s port %i." %
-                                  (self, inout, self._port))
-        return inout
+    cdef MidiState *_state
 
-    def _decode_string(self, s, encoding='auto'):
-        """Decode given byte string with given encoding."""
-        if encoding == 'auto':
-            if sys.platform.startswith('win'):
-                encoding = 'latin1'
-            elif (self.get_current_api() == API_MACOSX_CORE and
-                  sys.platform == 'darwin'):
-                encoding = 'macroman'
-            else:
-                encoding = 'utf-8'
+    def __cinit__(self):
+        self._state = new MidiState()
 
-        return s.decode(encoding, "ignore")
+    def __dealloc__(self):
+        del self._state
 
-    def get_port_count(self):
-        """Return the number of available MIDI input or output ports."""
-        return self.baseptr().getPortCount()
+    def update(self, message):
+        """Update the state with a MIDI message (a sequence of integers)."""
+        cdef vector[unsigned char] msg_v = message
+        self._state.update(msg_v.data(), msg_v.size())
 
-    def get_port_name(self, unsigned int port, encoding='auto'):
-        """Return the name of the MIDI input or output port with given number.
+    def reset(self):
+        """Reset the state to its initial values.
 
-        Ports are numbered from zero, separately for input and output ports.
-        The number of available ports is returned by the ``get_port_count``
-        method.
+        All controllers, pressure, program and bank are set to 0, the pitch
+        bend to 8192 (center) and all notes to not held.
 
-        The port name is decoded to a (unicode) string with the encoding given
-        by ``encoding``. If ``encoding`` is ``"auto"`` (the default), then an
-        appropriate encoding is chosen based on the system and the used backend
-        API. If ``encoding`` is ``None``, the name is returned un-decoded, i.e.
-        as type ``bytes``.
+        """
+        self._state.reset()
+
+    def cc(self, int channel, int number):
+        """Return the last value of controller ``number`` on ``channel``."""
+        _check_channel(channel)
+        _check_data_byte(number, "Controller number")
+        return self._state.data().cc[channel][number]
+
+    def note(self, int channel, int note):
+        """Return the velocity of a held note or 0 if the note is not held."""
+        _check_channel(channel)
+        _check_data_byte(note, "Note number")
+        return self._state.data().notes[channel][note]
+
+    def held_notes(self, int channel):
+        """Return a list of (note, velocity) tuples of held notes on ``channel``."""
+        cdef MidiStateData state
+        cdef int note
+        _check_channel(channel)
+        self._state.snapshot(state)
+        return [(note, state.notes[channel][note]) for note in range(128)
+                if state.notes[channel][note]]
+
+    def pitch_bend(self, int channel):
+        """Return the pitch bend value (0-16383, center is 8192) of ``channel``."""
+        _check_channel(channel)
+        return self._state.data().pitch_bend[channel]
+
+    def channel_pressure(self, int channel):
+        """Return the channel pressure (aftertouch) value of ``channel``."""
+        _check_channel(channel)
+        return self._state.data().channel_pressure[channel]
+
+    def program(self, int channel):
+        """Return the last selected program number of ``channel``."""
+        _check_channel(channel)
+        return self._state.data().program[channel]
+
+    def bank(self, int channel):
+        """Return the bank (MSB * 128 + LSB) selected with the last program change.
+
+        The bank is set from the last values of the Bank Select MSB and LSB
+        controllers (0 and 32), when a program change message is received.
 
         """
-        cdef string name = self.baseptr().getPortName(port)
+        _check_channel(channel)
+        return self._state.data().bank[channel]
 
-        if len(name):
-            return self._decode_string(name, encoding) if encoding else name
+    def snapshot(self):
+        """Return a consistent copy of the whole state as a bytes object.
 
-    def get_ports(self, encoding='auto'):
-        """Return a list of names of available MIDI input or output ports.
+        The data is ``MIDI_STATE_SIZE`` bytes long and has the following fields
+        in native byte order:
 
-        The list index of each port name corresponds to its port number.
+        ``cc`` (16 x 128 uint8)
+            Controller values by channel and controller number.
+        ``notes`` (16 x 128 uint8)
+            Velocities of held notes by channel and note number.
+        ``pitch_bend`` (16 uint16)
+            Pitch bend values by channel.
+        ``bank`` (16 uint16)
+            Selected banks by channel.
+        ``channel_pressure`` (16 uint8)
+            Channel pressure values by channel.
+        ``program`` (16 uint8)
+            Selected programs by channel.
 
-        The port names are decoded to (unicode) strings with the encoding given
-        by ``encoding``. If ``encoding`` is ``"auto"`` (the default), then an
-        appropriate encoding is chosen based on the system and the used backend
-        API. If ``encoding`` is ``None``, the names are returned un-decoded,
+        ``MIDI_STATE_DTYPE`` is a NumPy dtype specification for this data::
+
+            state = numpy.frombuffer(tracker.snapshot(), dtype=rtmidi.MIDI_STATE_DTYPE)[0]
+            volume = state['cc'][:, 7]
+
+        """
+        cdef MidiStateData state
+        self._state.snapshot(state)
+        return PyBytes_FromStringAndSize(<char *>&state, sizeof(state))
+
+
+cdef class MidiClockTracker:
+    """Tempo and position of a received MIDI clock.
+
+    ``rtmidi.MidiClockTracker(beats_per_bar=4)``
+
+    A tracker is usually obtained with ``MidiIn.track_clock``, which updates
+    it natively with every received MIDI clock tick (24 per quarter note),
+    Start, Continue, Stop and Song Position Pointer message, so the clock
+    ticks never have to be handled in Python. A stand-alone tracker can be
+    updated by passing messages to the ``update`` method.
+
+    The tempo is estimated from the average interval of the last 48 clock
+    ticks, which filters out the jitter of the individual ticks. The song
+    position advances with each clock tick while the clock is running. The
+    first tick after a Start or Continue message marks the start position.
+
+    The ``beats_per_bar`` attribute sets the number of quarter notes per bar
+    used for ``bar`` and ``bar_phase``.
+
+    """
+
+    cdef MidiClock *_clock
+    cdef public int beats_per_bar
+
+    def __cinit__(self, int beats_per_bar=4):
+        self._clock = new MidiClock()
+        self.beats_per_bar = beats_per_bar
+
+    def __dealloc__(self):
+        del self._clock
+
+    def update(self, message, timestamp=None):
+        """Update the state with a MIDI message (a sequence of integers).
+
+        ``timestamp`` is the time the message was received in nanoseconds as
+        returned by ``time.monotonic_ns``, which is used if it is ``None``.
+
+        """
+        cdef vector[unsigned char] msg_v = message
+        self._clock.update(msg_v.data(), msg_v.size(),
+                           monotonic_ns() if timestamp is None else timestamp)
+
+    def reset(self):
+        """Reset the tempo estimate, song position and running state."""
+        self._clock.reset()
+
+    cdef MidiClockState _state(self):
+        cdef MidiClockState state
+        self._clock.snapshot(state)
+        return state
+
+    @property
+    def bpm(self):
+        """Estimated tempo in quarter notes per minute or ``None`` if unknown."""
+        cdef MidiClockState state = self._state()
+        return 2.5e9 / state.interval if state.interval else None
+
+    @property
+    def sync(self):
+        """``True`` if clock ticks are received and the tempo is known."""
+        cdef MidiClockState state = self._state()
+        return (state.interval != 0 and
+                monotonic_ns() - state.last_tick <= MIDI_CLOCK_TIMEOUT)
+
+    @property
+    def running(self):
+        """``True`` after a Start or Continue until a Stop message is received."""
+        return self._state().running
+
+    @property
+    def ticks(self):
+        """Song position in clock ticks (24 per quarter note)."""
+        return self._state().position
+
+    @property
+    def song_position(self):
+        """Song position in sixteenth notes as in Song Position Pointer messages."""
+        return self._state().position // 6
+
+    @property
+    def beat(self):
+        """Number of quarter notes since the song start."""
+        return self._state().position // 24
+
+    @property
+    def bar(self):
+        """Number of bars since the song start."""
+        return self._state().position // (24 * self.beats_per_bar)
+
+    cdef double _position(self):
+        """Return the song position in ticks interpolated to the current time."""
+        cdef MidiClockState state = self._state()
+        cdef double fraction = 0.0
+
+        if state.running and state.interval:
+            fraction = min(1.0, (monotonic_ns() - state.last_tick) /
+                           <double>state.interval)
+
+        return state.position + fraction
+
+    @property
+    def beat_phase(self):
+        """Position within the current quarter note (0.0 <= phase < 1.0).
+
+        While the clock is running, the phase is interpolated between clock
+        ticks using the tempo estimate.
+
+        """
+        return self._position() % 24 / 24
+
+    @property
+    def bar_phase(self):
+        """Position within the current bar (0.0 <= phase < 1.0).
+
+        While the clock is running, the phase is interpolated between clock
+        ticks using the tempo estimate.
+
+        """
+        cdef int ticks_per_bar = 24 * self.beats_per_bar
+        return self._position() % ticks_per_bar / ticks_per_bar
+
+
+cdef class MidiBase:
+    # serializes opening / closing ports, (un)registering callbacks etc.
+    cdef cython.pymutex _lock
+    # guards the callback info read by the backend and dispatcher threads
+    cdef cython.pymutex _callback_lock
+    cdef object _port
+    cdef object _error_callback
+    cdef _ErrorContext _error_ctx
+    cdef object _deleted
+
+    def __cinit__(self, *args, **kwargs):
+        self._error_ctx.lock = &self._callback_lock
+
+    cdef RtMidi* baseptr(self):
+        return NULL
+
+    # context management
+    def __enter__(self):
+        """Support context manager protocol.
+
+        This means you can use ``MidiIn`` / ``MidiOut`` instances like this:
+
+        :
+
+            midiout = MidiIn()
+            midiout.open_port(0)
+
+            with midiout:
+                midiout.send_message([...])
+
+        and ``midiout.close_port()`` will be called automatically when exiting
+        the ``with`` block.
+
+        Since ``open_port()`` also returns the instance, you can even do:
+
+        :
+
+            midiout = MidiIn()
+
+            with midiout.open_port(0):
+                midiout.send_message([...])
+
+        """
+        return self
+
+    def __exit__(self, *exc_info):
+        """Support context manager protocol.
+
+        This method is called when using a ``MidiIn`` / ``MidiOut`` instance as
+        a context manager and closes open ports when exiting the ``with`` block.
+
+        """
+        self.close_port()
+
+    def _check_port(self):
+        inout = "input" if isinstance(self, MidiIn) else "output"
+        if self._port == -1:
+            raise InvalidUseError("%r already opened virtual %s port." %
+                                  (self, inout))
+        elif self._port is not None:
+            raise InvalidUseError("%r already opened %s port %i." %
+                                  (self, inout, self._port))
+        return inout
+
+    def _decode_string(self, s, encoding='auto'):
+        """Decode given byte string with given encoding."""
+        if encoding == 'auto':
+            encoding = _auto_encoding(self.get_current_api())
+
+        return s.decode(encoding, "ignore")
+
+    def get_port_count(self):
+        """Return the number of available MIDI input or output ports."""
+        return self.baseptr().getPortCount()
+
+    def get_port_name(self, unsigned int port, encoding='auto'):
+        """Return the name of the MIDI input or output port with given number.
+
+        Ports are numbered from zero, separately for input and output ports.
+        The number of available ports is returned by the ``get_port_count``
+        method.
+
+        The port name is decoded to a (unicode) string with the encoding given
+        by ``encoding``. If ``encoding`` is ``"auto"`` (the default), then an
+        appropriate encoding is chosen based on the system and the used backend
+        API. If ``encoding`` is ``None``, the name is returned un-decoded, i.e.
+        as type ``bytes``.
+
+        """
+        cdef string name = self.baseptr().getPortName(port)
+
+        if len(name):
+            return self._decode_string(name, encoding) if encoding else name
+
+    def get_ports(self, encoding='auto'):
+        """Return a list of names of available MIDI input or output ports.
+
+        The list index of each port name corresponds to its port number.
+
+        The port names are decoded to (unicode) strings with the encoding given
+        by ``encoding``. If ``encoding`` is ``"auto"`` (the default), then an
+        appropriate encoding is chosen based on the system and the used backend
+        API. If ``encoding`` is ``None``, the names are returned un-decoded,
         i.e. as type ``bytes``.
 
         """
@@ -574,13 +1703,15 @@ cdef class MidiBase:
             or ``name`` parameter.
 
         """
-        inout = self._check_port()
+        with self._lock:
+            inout = self._check_port()
 
-        if name is None:
-            name = "RtMidi %s" % inout
+            if name is None:
+                name = "RtMidi %s" % inout
+
+            self.baseptr().openPort(port, _to_bytes(name))
+            self._port = port
 
-        self.baseptr().openPort(port, _to_bytes(name))
-        self._port = port
         return self
 
     def open_virtual_port(self, name=None):
@@ -638,10 +1769,12 @@ cdef class MidiBase:
             raise NotImplementedError("Virtual ports are not supported "
                                       "by the Windows MultiMedia API.")
 
-        inout = self._check_port()
-        self.baseptr().openVirtualPort(_to_bytes(("RtMidi virtual %s" % inout)
-                                                if name is None else name))
-        self._port = -1
+        with self._lock:
+            inout = self._check_port()
+            self.baseptr().openVirtualPort(_to_bytes(("RtMidi virtual %s" % inout)
+                                                    if name is None else name))
+            self._port = -1
+
         return self
 
     def close_port(self):
@@ -656,9 +1789,10 @@ cdef class MidiBase:
         delete its ``MidiIn`` or ``MidiOut`` instance.
 
         """
-        if self._port != -1:
-            self._port = None
-        self.baseptr().closePort()
+        with self._lock:
+            if self._port != -1:
+                self._port = None
+            self.baseptr().closePort()
 
     def set_client_name(self, name):
         """Set the name of the MIDI client.
@@ -682,7 +1816,8 @@ cdef class MidiBase:
             raise NotImplementedError(
                 "API backend does not support changing the client name.")
 
-        self.baseptr().setClientName(_to_bytes(name))
+        with self._lock:
+            self.baseptr().setClientName(_to_bytes(name))
 
     def set_port_name(self, name):
         """Set the name of the currently opened port.
@@ -708,10 +1843,11 @@ cdef class MidiBase:
             raise UnsupportedOperationError(
                 "API backend does not support changing the port name.")
 
-        if self._port is None:
-            raise InvalidUseError("No port currently opened.")
+        with self._lock:
+            if self._port is None:
+                raise InvalidUseError("No port currently opened.")
 
-        self.baseptr().setPortName(_to_bytes(name))
+            self.baseptr().setPortName(_to_bytes(name))
 
     def set_error_callback(self, func, data=None):
         """Register a callback function for errors.
@@ -736,9 +1872,16 @@ cdef class MidiBase:
         handler.
 
         """
-        self._error_callback = (func, data, self._decode_string)
-        self.baseptr().setErrorCallback(&_cb_error_func,
-                                        <void *>self._error_callback)
+        callback = (func, data)
+
+        with self._callback_lock:
+            # released after the lock, since this may run arbitrary code
+            old_callback = self._error_callback
+            self._error_callback = callback
+            self._error_ctx.callback = <void *>callback
+            self._error_ctx.api = self.get_current_api()
+
+        self.baseptr().setErrorCallback(&_cb_error_func, <void *>&self._error_ctx)
 
     def cancel_error_callback(self):
         """Remove the registered callback function for errors.
@@ -792,7 +1935,25 @@ cdef class MidiIn(MidiBase):
     """
 
     cdef RtMidiIn *thisptr
+    cdef MidiInQueue *_queue
+    cdef InputRoute *_route
+    cdef bint _grouped
+    # id of this instance with shared callback dispatch or 0
+    cdef int _shared_id
+    cdef bint _shared_batch
+    cdef _InputContext _ctx
+    cdef BatchDispatcher *_dispatcher
     cdef object _callback
+    cdef object _handlers
+    cdef object _received
+    # Owned reference to the MidiStateTracker or NULL. Not visible to the
+    # garbage collector, so it is released only after the backend thread,
+    # which updates the tracker, has stopped.
+    cdef PyObject *_state_tracker
+    # Same for the MidiClockTracker
+    cdef PyObject *_clock_tracker
+    cdef object _ignore_types
+    cdef object __weakref__
 
     cdef RtMidi* baseptr(self):
         return self.thisptr
@@ -812,8 +1973,20 @@ cdef class MidiIn(MidiBase):
         except RuntimeError as exc:
             raise SystemError(str(exc), type=ERR_DRIVER_ERROR)
 
+        self._queue = new MidiInQueue(queue_size_limit)
+        self._route = new InputRoute(self._queue)
+        self._ctx.interp = current_interpreter()
+        self._ctx.route = self._route
+        self._ctx.lock = &self._callback_lock
+        self._ctx.stats = new InputStats()
+        self.set_filter()
+        self._ctx.drop_timing = True
+        self._ignore_types = (True, True, True)
         self.set_error_callback(_default_error_handler)
+        self.thisptr.setCallback(&_cb_func, <void *>&self._ctx)
         self._callback = None
+        self._handlers = [None] * 256
+        self._received = deque()
         self._port = None
         self._deleted = False
 
@@ -832,9 +2005,23 @@ cdef class MidiIn(MidiBase):
         return self.thisptr.getCurrentApi()
 
     def __dealloc__(self):
-        """De-allocate pointer to C++ class instance."""
-        if hasattr(self, "thisptr"):
-            del self.thisptr
+        """De-allocate pointers to C++ class instances."""
+        with self._callback_lock:
+            self._ctx.callback = NULL
+            memset(self._ctx.handlers, 0, sizeof(self._ctx.handlers))
+
+        if self.thisptr != NULL:
+            # The backend thread may be waiting for the GIL in the input
+            # callback, so it must be released while RtMidi joins the thread.
+            with nogil:
+                del self.thisptr
+
+        self._stop_dispatcher()
+        del self._route
+        del self._queue
+        del self._ctx.stats
+        Py_XDECREF(self._state_tracker)
+        Py_XDECREF(self._clock_tracker)
 
     def delete(self):
         """De-allocate pointer to C++ class instance.
@@ -853,14 +2040,58 @@ cdef class MidiIn(MidiBase):
             instance.
 
         """
-        if not self._deleted:
-            del self.thisptr
+        cdef RtMidiIn *thisptr
+
+        with self._lock:
+            if self._deleted:
+                return
+
+            thisptr = self.thisptr
+            self.thisptr = NULL
             self._deleted = True
 
+        # The backend thread may be waiting for the GIL or a lock in a callback
+        with nogil:
+            del thisptr
+
+        self._queue.interrupt()
+
     @property
     def is_deleted(self):
         return self._deleted
 
+    cdef void _set_route(self, MidiInQueue *queue, int source) noexcept:
+        """Redirect received messages to ``queue`` (of a MidiInGroup)."""
+        with nogil:
+            self._route.set(queue, source)
+
+        self._grouped = queue != self._queue
+
+    cdef void _stop_dispatcher(self) noexcept:
+        """Stop the thread calling the callback function with batches."""
+        _delete_dispatcher(self._detach_dispatcher())
+
+    cdef BatchDispatcher *_detach_dispatcher(self) noexcept:
+        cdef BatchDispatcher *dispatcher = self._dispatcher
+        self._dispatcher = NULL
+        return dispatcher
+
+    cdef BatchDispatcher *_detach_callback(self) noexcept:
+        """Unregister the callback function. Needs the lock.
+
+        Returns the dispatcher thread of the callback or NULL, which must be
+        stopped with ``_delete_dispatcher`` after releasing the lock.
+
+        """
+        if self._shared_id:
+            (<_SharedDispatch> _shared).remove(self)
+
+        with self._callback_lock:
+            self._ctx.callback = NULL
+            self._ctx.batch = False
+
+        return self._detach_dispatcher()
+
     def cancel_callback(self):
         """Remove the registered callback function for MIDI input.
 
@@ -868,17 +2099,164 @@ cdef class MidiIn(MidiBase):
         registered.
 
         """
-        if self._callback:
-            self.thisptr.cancelCallback()
+        cdef BatchDispatcher *dispatcher
+
+        with self._lock:
+            # released after the lock, since this may run arbitrary code
+            callback = self._callback
             self._callback = None
+            dispatcher = self._detach_callback()
+
+        _delete_dispatcher(dispatcher)
 
     def close_port(self):
         self.cancel_callback()
+        self.cancel_callbacks_for()
         MidiBase.close_port(self)
+        # after the port is marked as closed, see _wait_while_open
+        self._queue.interrupt()
+        # a MidiInGroup waiting for input checks its inputs again
+        self._route.interrupt()
 
     close_port.__doc__ == MidiBase.close_port.__doc__
 
-    def get_message(self):
+    def __iter__(self):
+        """Support the iterator protocol.
+
+        Iterating over a ``MidiIn`` instance yields the received MIDI events,
+        waiting for each one with the GIL released, like ``get_message`` with
+        ``timeout=None``. The iteration stops when the port is closed (from
+        another thread) or the instance is deleted, or right away if no port
+        is open and no events are queued::
+
+            for message, delta_time in midiin:
+                ...
+
+        """
+        return self
+
+    def __next__(self):
+        cdef vector[MidiEvent] events
+
+        self._wait_while_open(None)
+
+        if not self._queue.pop(events, 1):
+            raise StopIteration
+
+        return _event_to_tuple(&self._ctx, events[0])
+
+    cdef int _wait_while_open(self, timeout) except -2:
+        """Wait like ``_wait_for_input``, unless no port is open.
+
+        Returns -1 right away if no messages are queued and no port is open.
+
+        """
+        # The token is taken before checking the port, so closing the port
+        # after the check still interrupts the wait.
+        cdef unsigned long token = self._queue.interrupt_token()
+
+        if self._queue.size():
+            return 1
+        elif not self.is_port_open():
+            return -1
+
+        return _wait_for_input(self._queue, timeout, token)
+
+    def __aiter__(self):
+        """Support asynchronous iteration.
+
+        Iterating over a ``MidiIn`` instance with ``async for`` in an asyncio
+        coroutine yields the received MIDI events, retrieving them in batches
+        with the ``receive`` method. The iteration stops when the port is
+        closed or the instance is deleted, or right away if no port is open
+        and no events are queued::
+
+            async for message, delta_time in midiin:
+                ...
+
+        """
+        return self
+
+    async def __anext__(self):
+        if not self._received:
+            self._received.extend(await self.receive())
+
+            if not self._received:
+                raise StopAsyncIteration
+
+        return self._received.popleft()
+
+    def fileno(self):
+        """Return a file descriptor signalling available MIDI input.
+
+        The file descriptor becomes readable when MIDI events are placed in the
+        input queue and stays readable until the queue is emptied by
+        ``get_message``, ``get_messages`` or ``receive``. Do not read from or
+        close the file descriptor, just watch it for readability, e.g. with
+        ``select`` or ``loop.add_reader`` of an asyncio event loop.
+
+        It is only available on POSIX systems. On Linux it is an eventfd,
+        otherwise the read end of a pipe.
+
+        Exceptions:
+
+        ``UnsupportedOperationError``
+            Raised if the platform does not support creating the file
+            descriptor.
+
+        """
+        cdef int fd = self._queue.notify_fd()
+
+        if fd == -1:
+            raise UnsupportedOperationError(
+                "Input notification file descriptor is not supported on this platform.")
+
+        return fd
+
+    async def receive(self, max_count=None):
+        """Wait asynchronously for MIDI input and retrieve all queued events.
+
+        This coroutine method is meant to be used in an asyncio event loop. It
+        waits until MIDI events are available and then returns a list of all
+        or at most ``max_count`` of them, like ``get_messages``. The event loop
+        is thus only woken up once per burst of incoming messages.
+
+        Where supported, the file descriptor returned by ``fileno`` is watched
+        by the event loop, so no extra thread is needed. Otherwise the waiting
+        is done in the default executor of the event loop.
+
+        When the port is closed or the instance is deleted while waiting, an
+        empty list is returned. If no port is open, it does not wait.
+
+        """
+        import asyncio
+
+        cdef unsigned long token = self._queue.interrupt_token()
+        loop = asyncio.get_running_loop()
+        events = self.get_messages(max_count)
+
+        # closing the port after the check changes the token, see _wait_while_open
+        while (not events and self.is_port_open()
+               and self._queue.interrupt_token() == token):
+            ready = loop.create_future()
+
+            try:
+                fd = self.fileno()
+                loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+            except (NotImplementedError, UnsupportedOperationError):
+                await loop.run_in_executor(None, _wait_for_input_timeout, self,
+                                           _SIGNAL_CHECK_INTERVAL)
+            else:
+                try:
+                    await ready
+                finally:
+                    loop.remove_reader(fd)
+
+            events = self.get_messages(max_count)
+
+        return events
+
+    def get_message(self, timeout=0):
         """Poll for MIDI input.
 
         Checks whether a MIDI event is available in the input buffer and
@@ -887,16 +2265,169 @@ cdef class MidiIn(MidiBase):
         message, the delta time is a float representing the time in seconds
         elapsed since the reception of the previous MIDI event.
 
+        By default, the function does not block. When no MIDI message is
+        available, it returns ``None``.
+
+        If ``timeout`` is a positive number, the function waits at most
+        ``timeout`` seconds for a MIDI message to arrive. If ``timeout`` is
+        ``None``, it waits until a message arrives or the port is closed. While
+        waiting, the GIL is released, so other Python threads can run, and the
+        function returns as soon as a message is received. If no port is open,
+        it does not wait.
+
+        Exceptions:
+
+        ``ValueError``
+            Raised if ``timeout`` is negative.
+
+        """
+        cdef vector[MidiEvent] events
+
+        if timeout is not None and timeout < 0:
+            raise ValueError("'timeout' must not be negative.")
+
+        if timeout != 0:
+            self._wait_while_open(timeout)
+
+        if self._queue.pop(events, 1):
+            return _event_to_tuple(&self._ctx, events[0])
+
+    def get_messages(self, max_count=None):
+        """Retrieve all or up to ``max_count`` queued MIDI events at once.
+
+        Returns a list of two-element tuples with the MIDI message and delta
+        time of each event in the order they were received, like the ones
+        returned by the ``get_message`` method.
+
+        The queue is emptied in one native call, so draining a batch of events
+        is considerably cheaper than calling ``get_message`` repeatedly.
+
         The function does not block. When no MIDI message is available, it
-        returns ``None``.
+        returns an empty list.
 
         """
-        cdef vector[unsigned char] msg_v
-        cdef double delta_time = self.thisptr.getMessage(&msg_v)
+        cdef vector[MidiEvent] events
+        cdef size_t i
+
+        if max_count is not None and max_count < 1:
+            raise ValueError("'max_count' must be a positive integer or None.")
+
+        self._queue.pop(events, 0 if max_count is None else max_count)
+        return [_event_to_tuple(&self._ctx, events[i]) for i in range(events.size())]
+
+    def readinto(self, buf, sysex_buf=None):
+        """Retrieve queued MIDI events into pre-allocated buffers.
+
+        Writes one fixed-size record for each queued MIDI event into ``buf``,
+        which can be any writable, C-contiguous object supporting the buffer
+        protocol, e.g. a ``bytearray`` or a NumPy array, and returns the number
+        of records written. No Python objects are created for the events.
+
+        Each record is ``MIDI_RECORD_SIZE`` (24) bytes long and has the
+        following fields in native byte order, as described by the ``struct``
+        format string ``MIDI_RECORD_FORMAT``:
+
+        ``timestamp`` (int64)
+            The time the event was received in nanoseconds of the monotonic
+            clock used by ``time.monotonic_ns()`` (see ``set_timestamps``).
+        ``length`` (uint32)
+            The length of the MIDI message in bytes.
+        ``offset`` (uint32)
+            For messages longer than three bytes (i.e. sysex messages), the
+            offset of the message data in ``sysex_buf``, else zero.
+        ``status``, ``data1``, ``data2`` (uint8)
+            The status byte and up to two data bytes of the MIDI message.
+            Unused data bytes are set to zero. For longer messages, only the
+            status byte is set.
+
+        ``MIDI_RECORD_DTYPE`` is a NumPy dtype specification for these
+        records, so a NumPy structured array can be used directly as the
+        buffer::
+
+            records = numpy.zeros(1024, dtype=rtmidi.MIDI_RECORD_DTYPE)
+            count = midiin.readinto(records)
+            controllers = records[:count][records['status'][:count] & 0xF0 == 0xB0]
+
+        The data of messages longer than three bytes is copied to the writable
+        buffer ``sysex_buf`` one after another. When there is not enough space
+        left in ``buf`` or ``sysex_buf``, the remaining events are left in the
+        input queue.
+
+        The function does not block. When no MIDI message is available, it
+        returns ``0``.
+
+        Exceptions:
+
+        ``ValueError``
+            Raised if the next queued message is longer than three bytes and
+            does not fit into ``sysex_buf`` or no ``sysex_buf`` was given. The
+            message can be retrieved with ``get_message`` instead.
+
+        """
+        cdef Py_buffer view
+        cdef Py_buffer sysex_view
+        cdef vector[MidiEvent] events
+        cdef _MidiRecord record
+        cdef vector[unsigned char] *msg_v
+        cdef unsigned char *records
+        cdef unsigned char *sysex = NULL
+        cdef size_t sysex_len = 0
+        cdef size_t sysex_pos = 0
+        cdef size_t count = 0
+        cdef size_t size
+
+        PyObject_GetBuffer(buf, &view, PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS)
 
-        if not msg_v.empty():
-            message = [msg_v.at(i) for i in range(msg_v.size())]
-            return (message, delta_time)
+        try:
+            if sysex_buf is not None:
+                PyObject_GetBuffer(sysex_buf, &sysex_view, PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS)
+                sysex = <unsigned char *>sysex_view.buf
+                sysex_len = sysex_view.len
+
+            if <size_t>view.len >= sizeof(_MidiRecord):
+                self._queue.pop(events, <size_t>view.len // sizeof(_MidiRecord))
+
+            records = <unsigned char *>view.buf
+            memset(&record, 0, sizeof(_MidiRecord))
+
+            with nogil:
+                for count in range(events.size()):
+                    msg_v = &events[count].message
+                    size = msg_v.size()
+                    record.timestamp = events[count].timestamp
+                    record.length = size
+                    record.offset = 0
+                    record.status = deref(msg_v)[0]
+                    record.data1 = deref(msg_v)[1] if 1 < size <= 3 else 0
+                    record.data2 = deref(msg_v)[2] if size == 3 else 0
+
+                    if size > 3:
+                        if sysex_pos + size > sysex_len:
+                            break
+
+                        memcpy(sysex + sysex_pos, msg_v.data(), size)
+                        record.offset = sysex_pos
+                        sysex_pos += size
+
+                    memcpy(records + count * sizeof(_MidiRecord), &record,
+                           sizeof(_MidiRecord))
+                else:
+                    count = events.size()
+
+            if count < events.size():
+                size = events[count].message.size()
+                self._queue.unpop(events, count)
+
+                if count == 0:
+                    raise ValueError("Next message (%i bytes) does not fit into 'sysex_buf'." %
+                                     size)
+        finally:
+            PyBuffer_Release(&view)
+
+            if sysex != NULL:
+                PyBuffer_Release(&sysex_view)
+
+        return count
 
     def ignore_types(self, sysex=True, timing=True, active_sense=True):
         """Enable/Disable input filtering of certain types of MIDI events.
@@ -927,39 +2458,945 @@ cdef class MidiIn(MidiBase):
         for the reception of sysex messages. You can change the number and
         size of the buffers with the ``set_buffer_size`` method.
 
+        MIDI Clock messages are still received by a clock tracker enabled with
+        ``track_clock``, even when they are filtered.
+
         """
-        self.thisptr.ignoreTypes(sysex, timing, active_sense)
+        self._ignore_types = (sysex, timing, active_sense)
+        self._ctx.drop_timing = timing
+        self.thisptr.ignoreTypes(sysex, timing and self._ctx.clock == NULL,
+                                 active_sense)
 
-    def set_callback(self, func, data=None):
-        """Register a callback function for MIDI input.
+    def set_timestamps(self, enable=True):
+        """Enable/Disable absolute timestamps for received MIDI events.
 
-        The callback function is called whenever a MIDI message is received and
-        must take two arguments. The first argument is a two-element tuple with
-        the MIDI message and a delta time, like the one returned by the
-        ``get_message`` method. The second argument is value of the ``data``
-        argument passed to ``set_callback`` when the callback is registered.
-        The value of ``data`` can be any Python object. It can be used inside
-        the callback function to access data that would not be in scope
-        otherwise.
+        When enabled, the tuples returned by ``get_message`` and the other
+        methods for retrieving MIDI input, or passed to the callback function,
+        have a third element: the time when the MIDI event was received from
+        the backend API, as an integer number of nanoseconds of the same
+        monotonic clock used by ``time.monotonic_ns()`` [#]_.
 
-        Registering a callback function replaces any previously registered
-        callback.
+        Unlike summing up delta times, these timestamps don't accumulate
+        rounding errors and are still correct when events were filtered or
+        dropped, so they can also be used to correlate events received on
+        different ports.
 
-        The callback function is safely removed when the input port is closed
-        or the ``MidiIn`` instance is deleted.
+        .. [#] On Windows with Python versions older than 3.13, which use a
+           low-resolution clock for ``time.monotonic_ns()``, the timestamps
+           are taken from the high-resolution performance counter instead.
 
         """
-        if self._callback:
-            self.cancel_callback()
+        self._ctx.timestamps = enable
 
-        self._callback = (func, data)
-        self.thisptr.setCallback(&_cb_func, <void *>self._callback)
+    def set_bytes_messages(self, enable=True):
+        """Enable/Disable returning received MIDI messages as bytes.
 
-    def set_buffer_size(self, size, count):
-        """Set the size and number of MIDI input buffers."""
+        When enabled, the MIDI message in the tuples returned by
+        ``get_message`` and the other methods for retrieving MIDI input, or
+        passed to the callback function, is a ``bytes`` object instead of a list
+        of integers. Indexing it still returns integers, but it is created with
+        a single memory copy, which is much faster and uses a lot less memory
+        for long (sysex) messages.
+
+        """
+        self._ctx.as_bytes = enable
+
+    def track_state(self, enable=True):
+        """Enable/Disable tracking the per-channel MIDI state of the input.
+
+        When enabled, each received MIDI channel message updates the state of
+        a ``MidiStateTracker`` in the backend thread, before the message is
+        filtered, queued or passed to a callback function. The tracker can be
+        queried for the last controller values, held notes etc. at any time,
+        so there is no need to handle each message in Python just for that.
+
+        Returns the ``MidiStateTracker`` instance (the same one every time),
+        or ``None`` when tracking is disabled. Disabling tracking leaves the
+        state of the tracker unchanged.
+
+        """
+        if not enable:
+            with self._callback_lock:
+                self._ctx.state = NULL
+
+            return None
+
+        cdef MidiStateTracker tracker
+
+        with self._lock:
+            if self._state_tracker == NULL:
+                tracker = MidiStateTracker()
+                Py_INCREF(tracker)
+                self._state_tracker = <PyObject *>tracker
+
+        tracker = <MidiStateTracker>self._state_tracker
+
+        with self._callback_lock:
+            self._ctx.state = tracker._state
+
+        return tracker
+
+    def set_param_decoding(self, rpn=True, nrpn=True, controllers=None):
+        """Enable/Disable decoding of RPN, NRPN and 14-bit controller messages.
+
+        RPNs and NRPNs (registered / non-registered parameter numbers) are
+        set with a sequence of control change messages: the parameter is
+        selected with CC #101 / #100 (RPN MSB / LSB) or CC #99 / #98 (NRPN
+        MSB / LSB) and its value set with Data Entry CC #6 (MSB) and #38 (LSB)
+        or Data Increment / Decrement CC #96 / #97. High-resolution controllers
+        send their value with two control changes, the MSB with a controller
+        number 0-31 and the LSB with the controller number + 32.
+
+        When decoding is enabled, these messages are decoded natively and only
+        a single ``ParamChange`` named tuple with the fields ``type``
+        (``PARAM_RPN``, ``PARAM_NRPN`` or ``PARAM_CONTROLLER``), ``channel``
+        (0-15), ``param`` (the 14-bit parameter or MSB controller number) and
+        ``value`` (the 14-bit value) is returned or passed to the callback in
+        place of the MIDI message, each time a value is completed:
+
+        * RPNs and NRPNs: on every Data Entry MSB (which resets the LSB to 0),
+          Data Entry LSB, Data Increment or Data Decrement message for a
+          selected parameter. The parameter selection messages are consumed.
+          Data Entry messages while no parameter (or the null parameter
+          127/127) is selected are passed on unchanged.
+        * 14-bit controllers: on every MSB message (which resets the LSB to
+          0, so devices sending only the MSB work as well) and LSB message.
+
+        Pass ``rpn=False`` or ``nrpn=False`` to not decode RPNs or NRPNs and
+        an iterable of MSB controller numbers (0-31) as ``controllers`` to
+        decode these as 14-bit controllers. All other MIDI messages are passed
+        on unchanged. Decoding applies to messages passing the filter set with
+        ``set_filter``.
+
+        Calling this method resets the decoder state. ``MidiIn.readinto``
+        returns decoded parameter changes as 7-byte messages with the
+        undefined status byte 0xF5, followed by type, channel, parameter MSB
+        and LSB and value MSB and LSB.
+
+        Exceptions:
+
+        ``ValueError``
+            Raised if a controller number is out of range.
+
+        """
+        cdef _ParamDecoder decoder
+        memset(&decoder, 0, sizeof(decoder))
+
+        for cc in controllers or ():
+            if not 0 <= cc < 32:
+                raise ValueError("14-bit controller numbers must be in range 0..31.")
+
+            decoder.controllers[cc] = 1
+
+        if controllers:
+            decoder.enabled = True
+
+        decoder.rpn = rpn
+        decoder.nrpn = nrpn
+        decoder.enabled |= decoder.rpn or decoder.nrpn
+
+        with self._callback_lock:
+            self._ctx.decoder = decoder
+
+    def track_clock(self, enable=True):
+        """Enable/Disable tracking the tempo and position of a received MIDI clock.
+
+        When enabled, each received MIDI clock tick, Start, Continue, Stop and
+        Song Position Pointer message updates a ``MidiClockTracker`` in the
+        backend thread, which can be queried for the tempo, running state and
+        song position at any time. Clock messages still are not passed on to
+        Python, unless their reception is enabled with ``ignore_types``.
+
+        Returns the ``MidiClockTracker`` instance (the same one every time),
+        or ``None`` when tracking is disabled. Disabling tracking leaves the
+        state of the tracker unchanged.
+
+        """
+        cdef MidiClockTracker tracker
+
+        if not enable:
+            with self._callback_lock:
+                self._ctx.clock = NULL
+
+            self.ignore_types(*self._ignore_types)
+            return None
+
+        with self._lock:
+            if self._clock_tracker == NULL:
+                tracker = MidiClockTracker()
+                Py_INCREF(tracker)
+                self._clock_tracker = <PyObject *>tracker
+
+        tracker = <MidiClockTracker>self._clock_tracker
+
+        with self._callback_lock:
+            self._ctx.clock = tracker._clock
+
+        self.ignore_types(*self._ignore_types)
+        return tracker
+
+    def set_coalescing(self, enable=True):
+        """Enable/Disable coalescing of queued continuous controller messages.
+
+        When enabled, a control change, pitch bend, channel pressure or
+        polyphonic pressure message, which is received while a message of the
+        same type for the same channel (and controller number or note) is
+        still waiting in the input queue, replaces the value of the queued
+        message instead of being appended to the queue. The queued message
+        keeps its position in the queue, its delta time and timestamp. The
+        order of all other messages is preserved.
+
+        This way, a consumer which can not keep up with a stream of controller
+        messages only gets the latest value of each controller and the input
+        queue does not overflow.
+
+        Coalescing only applies to messages retrieved with ``get_message``,
+        ``get_messages`` etc. or passed to a callback registered with
+        ``batch=True``.
+
+        """
+        self._queue.set_coalescing(enable)
+
+    def set_filter(self, types=None, channels=None, controllers=None):
+        """Set which types of MIDI messages are passed on from the MIDI input.
+
+        Messages are filtered in the native MIDI input handler before the GIL
+        is acquired, so messages rejected by the filter never reach the input
+        queue or the callback function and cost no Python processing at all.
+
+        ``types`` is an iterable of accepted status bytes. For channel messages
+        pass the status byte with the channel bits cleared, e.g. ``0xB0`` for
+        control change messages, for system messages the full status byte,
+        e.g. ``0xF2`` for song position pointer messages.
+
+        ``channels`` is an iterable of accepted MIDI channels (0-15) and
+        applies only to channel messages.
+
+        ``controllers`` is an iterable of accepted controller numbers (0-127)
+        and applies only to control change messages.
+
+        Passing ``None`` (the default) for any of these arguments accepts all
+        values, so calling this method without arguments turns off filtering.
+
+        For example, to only receive control changes for volume and pan on
+        MIDI channel 1::
+
+            midiin.set_filter(types=[CONTROL_CHANGE], channels=[0],
+                              controllers=[CHANNEL_VOLUME, PAN])
+
+        This filter is applied to messages passing the filtering set with the
+        ``ignore_types`` method, which still determines whether sysex, MIDI
+        Clock and Active Sensing messages are received at all.
+
+        Exceptions:
+
+        ``ValueError``
+            Raised if a status byte, channel or controller number is invalid.
+
+        """
+        cdef unsigned char accept_types[256]
+        cdef unsigned char accept_channels[16]
+        cdef unsigned char status[256]
+        cdef unsigned char accept_controllers[128]
+        cdef int i
+
+        for i in range(256):
+            accept_types[i] = types is None
+
+        for i in range(16):
+            accept_channels[i] = channels is None
+
+        for i in range(128):
+            accept_controllers[i] = controllers is None
+
+        for value in types or ():
+            if not 0x80 <= value <= 0xFF or (value < 0xF0 and value & 0x0F):
+                raise ValueError("Invalid status byte for message type: %r" % value)
+
+            accept_types[value] = True
+
+        for value in channels or ():
+            if not 0 <= value <= 15:
+                raise ValueError("Invalid MIDI channel: %r" % value)
+
+            accept_channels[value] = True
+
+        for value in controllers or ():
+            if not 0 <= value <= 127:
+                raise ValueError("Invalid controller number: %r" % value)
+
+            accept_controllers[value] = True
+
+        for i in range(256):
+            if i < 0xF0:
+                status[i] = accept_types[i & 0xF0] and accept_channels[i & 0x0F]
+            else:
+                status[i] = accept_types[i]
+
+        with self._callback_lock:
+            self._ctx.filter.status = status
+            self._ctx.filter.controllers = accept_controllers
+
+    def set_callback(self, func, data=None, batch=False, max_latency=0.005,
+                     shared=False, raw=False):
+        """Register a callback function for MIDI input.
+
+        The callback function is called whenever a MIDI message is received and
+        must take two arguments. The first argument is a two-element tuple with
+        the MIDI message and a delta time, like the one returned by the
+        ``get_message`` method. The second argument is value of the ``data``
+        argument passed to ``set_callback`` when the callback is registered.
+        The value of ``data`` can be any Python object. It can be used inside
+        the callback function to access data that would not be in scope
+        otherwise.
+
+        If ``batch`` is ``True``, incoming messages are collected in the native
+        input queue instead and the callback function is called from a separate
+        thread with a list of all messages received within a time window of at
+        most ``max_latency`` seconds after the first one, like the one returned
+        by the ``get_messages`` method. This trades a bounded delay for
+        acquiring the GIL only once per batch instead of once per message.
+
+        If ``shared`` is ``True``, the callback function is called from a
+        single thread, which is shared by all ``MidiIn`` instances registering
+        their callback with ``shared=True``, instead of from the thread of the
+        MIDI backend. The backend threads then only put received messages into
+        a native queue and never acquire the GIL, so with many inputs only
+        one thread competes for the GIL and the callbacks of all inputs are
+        called in the order the messages were received. With ``batch=True``,
+        the callback is called with all messages received by the instance
+        since the shared thread last woke up, ``max_latency`` is ignored.
+
+        If ``raw`` is ``True``, the callback function is called with the
+        status byte, the two data bytes and the delta time of each message as
+        separate arguments, i.e. ``func(status, data1, data2, delta_time)``,
+        plus the timestamp, if enabled with ``set_timestamps``. Missing data
+        bytes are passed as 0. This avoids creating a message and a tuple for
+        every message. For ``ParamChange`` events and for messages longer than
+        three bytes, e.g. System Exclusive messages, which are passed as
+        ``bytes``, the first argument is the whole message and both data bytes
+        are 0. The ``data`` argument is not passed to the callback function. With
+        ``batch=True`` or ``shared=True``, the callback function is still
+        called once per message, but all messages of a batch are passed within
+        a single acquisition of the GIL.
+
+        Registering a callback function replaces any previously registered
+        callback.
+
+        The callback function is safely removed when the input port is closed
+        or the ``MidiIn`` instance is deleted.
+
+        Exceptions:
+
+        ``ValueError``
+            Raised if ``max_latency`` is negative.
+
+        ``InvalidUseError``
+            Raised if ``shared`` is ``True`` and the instance is a member of a
+            ``MidiInGroup``.
+
+        """
+        cdef BatchDispatcher *dispatcher
+
+        if batch and max_latency < 0:
+            raise ValueError("'max_latency' must not be negative.")
+
+        callback = (func, data, raw)
+
+        with self._lock:
+            if shared and self._grouped and not self._shared_id:
+                raise InvalidUseError("MidiIn instance is a member of a MidiInGroup.")
+
+            old_callback = self._callback
+            dispatcher = self._detach_callback()
+            self._callback = callback
+
+            with self._callback_lock:
+                self._ctx.callback = <void *>callback
+                # with a shared dispatcher, the backend thread queues all messages
+                self._ctx.batch = batch or shared
+
+            if shared:
+                self._shared_batch = batch
+                (<_SharedDispatch> _shared).add(self)
+            elif batch:
+                self._dispatcher = new BatchDispatcher(self._queue, max_latency,
+                                                       &_deliver_batch,
+                                                       <void *>&self._ctx)
+
+        _delete_dispatcher(dispatcher)
+
+    def stats(self):
+        """Return statistics about the MIDI input received by this instance.
+
+        Returns a dictionary with the following keys:
+
+        ``received``
+            Number of MIDI messages received from the backend.
+        ``filtered``
+            Number of messages discarded by the filter set with ``set_filter``.
+        ``dropped``
+            Number of messages discarded because the input queue already held
+            ``queue_size_limit`` messages.
+        ``queued``
+            Number of messages currently in the input queue.
+        ``max_queued``
+            Highest number of messages held in the input queue at once.
+        ``bytes``
+            Total size of all received messages in bytes.
+        ``callbacks``
+            Number of calls of the callback function(s).
+        ``callback_time``
+            Total time spent in the callback function(s) in seconds.
+        ``max_callback_time``
+            Longest time a single callback function call took in seconds.
+        ``gil_wait_time``
+            Total time spent waiting to acquire the GIL before calling the
+            callback function in seconds.
+
+        The counters are updated for every received message and can be reset
+        with ``reset_stats``.
+
+        """
+        cdef InputStats *stats = self._ctx.stats
+        return {
+            'received': stats.received(),
+            'filtered': stats.filtered(),
+            'dropped': self._queue.dropped(),
+            'queued': self._queue.size(),
+            'max_queued': self._queue.max_size(),
+            'bytes': stats.bytes(),
+            'callbacks': stats.callbacks(),
+            'callback_time': stats.callback_time() * 1e-9,
+            'max_callback_time': stats.max_callback_time() * 1e-9,
+            'gil_wait_time': stats.gil_wait_time() * 1e-9,
+        }
+
+    def reset_stats(self):
+        """Reset the counters returned by ``stats`` to zero."""
+        self._ctx.stats.reset()
+        self._queue.reset_stats()
+
+    def set_callback_for(self, status_or_type, func, channel=None, data=None):
+        """Register a callback function for MIDI input of one message type.
+
+        ``status_or_type`` is either a full status byte, e.g. ``0x93`` (Note On
+        on channel 4) or ``0xF8`` (Timing Clock), or the status byte of a
+        channel message type with the channel bits set to zero, e.g.
+        ``NOTE_ON`` (``0x90``). For a message type, the callback is registered
+        for all 16 channels, unless a zero-based ``channel`` number is given.
+
+        The callback function is called with the same arguments as a callback
+        registered with ``set_callback``, but only for messages of the given
+        type. The callbacks for all message types are looked up in a table by
+        the status byte of each received message, so there is no need to
+        dispatch messages by type in Python. Messages for which no callback is
+        registered are passed to the callback registered with ``set_callback``
+        or queued for ``get_message`` etc. as usual.
+
+        Pass ``None`` as ``func`` to remove the callback for the given message
+        type and channel(s). Registering a callback replaces any previously
+        registered callback for the same status byte(s). All these callbacks
+        are removed when the input port is closed.
+
+        Exceptions:
+
+        ``ValueError``
+            Raised if ``status_or_type`` is not a status byte (0x80-0xFF) or
+            if ``channel`` is out of range or given for a system message or
+            a status byte for a different channel.
+
+        """
+        cdef int status = status_or_type
+
+        if not 0x80 <= status <= 0xFF:
+            raise ValueError("Status byte must be in range 0x80..0xFF.")
+
+        if status >= 0xF0 or status & 0x0F:
+            if channel is not None and (status >= 0xF0 or status & 0x0F != channel):
+                raise ValueError("'channel' does not match status byte 0x%02X." % status)
+
+            statuses = [status]
+        elif channel is None:
+            statuses = range(status, status + 16)
+        else:
+            _check_channel(channel)
+            statuses = [status | channel]
+
+        handler = (func, data) if func is not None else None
+        self._set_handlers(statuses, handler)
+
+    def cancel_callbacks_for(self):
+        """Remove all callback functions registered with ``set_callback_for``."""
+        self._set_handlers(range(256), None)
+
+    cdef _set_handlers(self, statuses, handler):
+        cdef int status
+
+        with self._callback_lock:
+            # released after the lock, since this may run arbitrary code
+            old_handlers = list(self._handlers)
+
+            for status in statuses:
+                self._handlers[status] = handler
+                self._ctx.handlers[status] = (<void *>handler if handler is not None
+                                              else NULL)
+
+    def set_buffer_size(self, size, count):
+        """Set the size and number of MIDI input buffers."""
         self.thisptr.setBufferSize(size, count)
 
 
+# Shared dispatching of MidiIn callbacks registered with shared=True
+
+cdef class _SharedDispatch:
+    """Dispatcher thread shared by the MidiIn instances of an interpreter."""
+
+    # guards the queue, dispatcher and id counter
+    cdef cython.pymutex _lock
+    cdef MidiInQueue *_queue
+    cdef BatchDispatcher *_dispatcher
+    cdef _DispatchTarget _target
+    cdef int _last_id
+    # weak references to the MidiIn instances by id
+    cdef dict _inputs
+
+    def __cinit__(self):
+        self._target.owner = <void *>self
+        self._target.interp = current_interpreter()
+        self._inputs = {}
+
+    def __dealloc__(self):
+        self.stop()
+        del self._queue
+
+    cdef int add(self, MidiIn midiin) except -1:
+        """Redirect the messages of ``midiin`` to the shared dispatcher thread."""
+        with self._lock:
+            if self._queue == NULL:
+                self._queue = new MidiInQueue(65536)
+
+            if self._dispatcher == NULL:
+                self._dispatcher = new BatchDispatcher(self._queue, 0.0, &_deliver_shared,
+                                                       <void *>&self._target)
+
+            self._last_id += 1
+            midiin._shared_id = self._last_id
+
+        self._inputs[midiin._shared_id] = weakref.ref(midiin)
+        midiin._set_route(self._queue, midiin._shared_id)
+        return 0
+
+    cdef void remove(self, MidiIn midiin) noexcept:
+        """Stop dispatching the messages of ``midiin`` by the shared thread."""
+        # Messages of this instance still in the shared queue are discarded
+        self._inputs.pop(midiin._shared_id, None)
+        midiin._shared_id = 0
+        midiin._set_route(midiin._queue, 0)
+
+    def stop(self):
+        """Stop the dispatcher thread (at interpreter exit)."""
+        cdef BatchDispatcher *dispatcher
+
+        with self._lock:
+            dispatcher = self._dispatcher
+            self._dispatcher = NULL
+
+        _delete_dispatcher(dispatcher)
+
+    cdef void call_callbacks(self, vector[MidiEvent] &events, int64_t waiting) noexcept:
+        """Call the callback functions of the MidiIn instances."""
+        cdef MidiIn midiin
+        cdef int64_t start
+        cdef size_t i
+        batches = {}
+
+        for i in range(events.size()):
+            ref = self._inputs.get(events[i].source)
+            midiin = ref() if ref is not None else None
+
+            if midiin is None:
+                # the instance was deleted without cancelling the callback
+                if ref is not None:
+                    self._inputs.pop(events[i].source, None)
+
+                continue
+
+            callback = _get_callback(&midiin._ctx, &midiin._ctx.callback)
+
+            if callback is None:
+                continue
+
+            func, data, raw = callback
+
+            if raw:
+                start = monotonic_ns()
+                _call_raw(&midiin._ctx, func, events[i].message, events[i].delta_time,
+                          events[i].timestamp)
+                midiin._ctx.stats.add_callback(monotonic_ns() - start, start - waiting)
+            elif midiin._shared_batch:
+                batches.setdefault(midiin, []).append(_event_to_tuple(&midiin._ctx, events[i]))
+            else:
+                start = monotonic_ns()
+                _call_event(&midiin._ctx, func, data, events[i].message,
+                            events[i].delta_time, events[i].timestamp)
+                midiin._ctx.stats.add_callback(monotonic_ns() - start, start - waiting)
+
+        for midiin, batch in batches.items():
+            callback = _get_callback(&midiin._ctx, &midiin._ctx.callback)
+
+            if callback is not None:
+                start = monotonic_ns()
+                func, data, raw = callback
+                _call_shared_batch(func, batch, data)
+                midiin._ctx.stats.add_callback(monotonic_ns() - start, start - waiting)
+
+
+cdef void _call_shared_batch(func, list batch, data) noexcept:
+    """Call a callback function using shared dispatch with a batch of events.
+
+    An exception raised by the callback is reported as unraisable, so the
+    callbacks of the other MidiIn instances are still called.
+
+    """
+    func(batch, data)
+
+
+# The shared dispatcher of this interpreter
+_shared = _SharedDispatch()
+atexit.register(_shared.stop)
+
+
+cdef void _deliver_shared(vector[MidiEvent] &events, void *data) noexcept nogil:
+    """Pass MIDI input from the shared dispatcher thread to Python."""
+    cdef _DispatchTarget *target = <_DispatchTarget *> data
+    cdef int64_t waiting = monotonic_ns()
+    cdef PyThreadState *tstate = interpreter_attach(target.interp)
+    _call_shared_callbacks(target.owner, events, waiting)
+    interpreter_detach(tstate)
+
+
+cdef void _call_shared_callbacks(void *shared, vector[MidiEvent] &events,
+                                 int64_t waiting) noexcept with gil:
+    """Wrapper for the callback functions of MidiIn instances using shared dispatch."""
+    (<_SharedDispatch> shared).call_callbacks(events, waiting)
+
+
+cdef void _deliver_group_batch(vector[MidiEvent] &events, void *data) noexcept nogil:
+    """Pass MIDI input from the dispatcher thread of a MidiInGroup to Python."""
+    cdef _GroupContext *ctx = <_GroupContext *> data
+    cdef PyThreadState *tstate = interpreter_attach(ctx.interp)
+    _call_group_callback(ctx, events)
+    interpreter_detach(tstate)
+
+
+cdef void _call_group_callback(_GroupContext *ctx, vector[MidiEvent] &events) noexcept with gil:
+    """Wrapper for the Python callback function of a MidiInGroup.
+
+    The callback is cancelled before the dispatcher thread is stopped, so it
+    is not called while the group is being deleted.
+
+    """
+    cdef size_t i
+
+    with ctx.lock[0]:
+        if ctx.callback == NULL:
+            return
+
+        callback = <object> ctx.callback
+        inputs = <tuple> ctx.inputs
+
+    func, data, batch = callback
+
+    # The callback may cancel itself or close the group, after which ctx must
+    # not be used and the remaining events are dropped, see _delete_dispatcher.
+    if batch:
+        func([_group_event_to_tuple(inputs, events[i]) for i in range(events.size())], data)
+    else:
+        for i in range(events.size()):
+            _call_group_event(func, data, inputs, events[i])
+
+            if dispatcher_released():
+                return
+
+
+cdef void _call_group_event(func, data, tuple inputs, MidiEvent &event) noexcept:
+    """Call the callback function of a MidiInGroup for one event.
+
+    An exception raised by the callback is reported as unraisable, so the
+    remaining events are still passed to the callback.
+
+    """
+    func(_group_event_to_tuple(inputs, event), data)
+
+
+cdef inline tuple _group_event_to_tuple(tuple inputs, MidiEvent &event):
+    """Convert an event queued by a MidiInGroup into a (source, event) tuple."""
+    cdef MidiIn midiin = inputs[event.source]
+    return (event.source, _event_to_tuple(&midiin._ctx, event))
+
+
+@cython.no_gc_clear
+cdef class MidiInGroup:
+    """Merged MIDI input of several ``MidiIn`` instances.
+
+    ``rtmidi.MidiInGroup(inputs, queue_size_limit=1024)``
+
+    All MIDI messages received by the ``MidiIn`` instances in the ``inputs``
+    sequence, which would otherwise be queued by each instance, are put into a
+    single native queue of the group instead, ordered by the time they were
+    received. So messages from any number of inputs can be consumed by one
+    thread with ``get_message``, ``get_messages``, by iterating over the group
+    or by a single callback function registered with ``set_callback``.
+
+    Each event is returned as a two-element tuple ``(source, event)``, where
+    ``source`` is the index of the input in ``inputs`` and ``event`` the MIDI
+    event tuple as returned by the ``get_message`` method of that input, so it
+    is affected by its settings, e.g. with ``set_timestamps``. The delta time
+    is relative to the previous message received by the same input.
+
+    Filters and other processing set on the inputs apply as usual. Messages
+    handled by a callback function registered on an input are not passed to
+    the group.
+
+    The inputs are released when the group is closed with ``close`` or
+    deleted and then queue received messages themselves again.
+
+    Exceptions:
+
+    ``TypeError``
+        Raised if an item of ``inputs`` is not a ``MidiIn`` instance.
+
+    ``InvalidUseError``
+        Raised if an input is already a member of another group.
+
+    """
+
+    # guards the callback, which is read by the dispatcher thread
+    cdef cython.pymutex _lock
+    cdef MidiInQueue *_queue
+    cdef BatchDispatcher *_dispatcher
+    cdef _GroupContext _ctx
+    # not changed after initialization, so events can always be converted
+    cdef tuple _inputs
+    cdef bint _closed
+    cdef object _callback
+
+    def __cinit__(self, inputs, unsigned int queue_size_limit=1024):
+        cdef MidiIn midiin
+        cdef int i
+
+        inputs = tuple(inputs)
+
+        for midiin in inputs:
+            if midiin._grouped:
+                raise InvalidUseError("MidiIn instance is already in a group or uses "
+                                      "shared callback dispatch.")
+
+            if inputs.count(midiin) > 1:
+                raise InvalidUseError("MidiIn instance given more than once.")
+
+        self._queue = new MidiInQueue(queue_size_limit)
+        self._inputs = inputs
+        self._ctx.interp = current_interpreter()
+        self._ctx.lock = &self._lock
+        self._ctx.inputs = <void *>inputs
+
+        for i, midiin in enumerate(inputs):
+            midiin._set_route(self._queue, i)
+
+    def __dealloc__(self):
+        self.close()
+        del self._queue
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def inputs(self):
+        """Tuple of the ``MidiIn`` instances of the group."""
+        return () if self._closed else self._inputs
+
+    cdef tuple _event_to_tuple(self, MidiEvent &event):
+        return _group_event_to_tuple(self._inputs, event)
+
+    def close(self):
+        """Release the inputs and stop the callback thread.
+
+        Waiting calls of ``get_message`` return and iterating over the group
+        stops.
+
+        """
+        cdef MidiIn midiin
+        cdef bint closed
+
+        with self._lock:
+            closed = self._closed
+            self._closed = True
+
+        if not closed:
+            for midiin in self._inputs:
+                midiin._set_route(midiin._queue, 0)
+
+        self.cancel_callback()
+
+        if self._queue != NULL:
+            self._queue.interrupt()
+
+    def __iter__(self):
+        """Support the iterator protocol.
+
+        Iterating over the group yields the received events, waiting for each
+        one with the GIL released. The iteration stops when the group is
+        closed (from another thread) or no input has an open port anymore.
+
+        """
+        return self
+
+    def __next__(self):
+        event = self.get_message(timeout=None)
+
+        if event is None:
+            raise StopIteration
+
+        return event
+
+    def get_message(self, timeout=0):
+        """Return the next ``(source, event)`` tuple received by any input.
+
+        Returns ``None`` if no event is available. If ``timeout`` is a
+        positive number, waits at most ``timeout`` seconds for an event to
+        arrive, if ``timeout`` is ``None``, until one arrives, the group is
+        closed or no input has an open port anymore. See
+        ``MidiIn.get_message``.
+
+        Exceptions:
+
+        ``ValueError``
+            Raised if ``timeout`` is negative.
+
+        """
+        cdef vector[MidiEvent] events
+
+        if timeout is not None and timeout < 0:
+            raise ValueError("'timeout' must not be negative.")
+
+        if timeout != 0:
+            self._wait_while_open(timeout)
+
+        if self._queue.pop(events, 1):
+            return self._event_to_tuple(events[0])
+
+    cdef int _wait_while_open(self, timeout) except -2:
+        """Wait like ``_wait_for_input``, while an input has an open port.
+
+        Returns -1 right away if no messages are queued and the group is
+        closed or no input has an open port.
+
+        """
+        cdef unsigned long token
+        cdef int result
+
+        while True:
+            # taken before checking the inputs, whose close_port interrupts
+            # the wait, see MidiIn._wait_while_open
+            token = self._queue.interrupt_token()
+
+            if self._queue.size():
+                return 1
+            elif self._closed or not any(midiin.is_port_open() for midiin in self._inputs):
+                return -1
+
+            result = _wait_for_input(self._queue, timeout, token)
+
+            # interrupted by closing an input, while others may still be open
+            if result != -1 or timeout is not None:
+                return result
+
+    def get_messages(self, max_count=None):
+        """Retrieve all or up to ``max_count`` queued events at once.
+
+        Returns a list of ``(source, event)`` tuples in the order the events
+        were received. The function does not block.
+
+        """
+        cdef vector[MidiEvent] events
+        cdef size_t i
+
+        if max_count is not None and max_count < 1:
+            raise ValueError("'max_count' must be a positive integer or None.")
+
+        self._queue.pop(events, 0 if max_count is None else max_count)
+        return [self._event_to_tuple(events[i]) for i in range(events.size())]
+
+    def set_callback(self, func, data=None, batch=False, max_latency=0.005):
+        """Register a callback function for the MIDI input of the group.
+
+        The callback function is called from a single thread for all inputs
+        with a ``(source, event)`` tuple and the value of ``data`` as
+        arguments. If ``batch`` is ``True``, it is called with a list of all
+        events received within at most ``max_latency`` seconds instead, like
+        the one returned by ``get_messages``.
+
+        Registering a callback function replaces any previously registered
+        callback.
+
+        Exceptions:
+
+        ``ValueError``
+            Raised if ``max_latency`` is negative.
+
+        """
+        cdef BatchDispatcher *dispatcher
+
+        if max_latency < 0:
+            raise ValueError("'max_latency' must not be negative.")
+
+        callback = (func, data, batch)
+
+        with self._lock:
+            # released after the lock, since this may run arbitrary code
+            old_callback = self._callback
+            dispatcher = self._dispatcher
+            self._callback = callback
+            self._ctx.callback = <void *>callback
+            self._dispatcher = new BatchDispatcher(self._queue,
+                                                   max_latency if batch else 0.0,
+                                                   &_deliver_group_batch,
+                                                   <void *>&self._ctx)
+
+        _delete_dispatcher(dispatcher)
+
+    def cancel_callback(self):
+        """Remove the registered callback function."""
+        cdef BatchDispatcher *dispatcher
+
+        with self._lock:
+            callback = self._callback
+            self._callback = None
+            self._ctx.callback = NULL
+            dispatcher = self._dispatcher
+            self._dispatcher = NULL
+
+        _delete_dispatcher(dispatcher)
+
+    def stats(self):
+        """Return statistics about the queue of the group.
+
+        Returns a dictionary with the keys ``dropped``, ``queued`` and
+        ``max_queued``, see ``MidiIn.stats``.
+
+        """
+        return {
+            'dropped': self._queue.dropped(),
+            'queued': self._queue.size(),
+            'max_queued': self._queue.max_size(),
+        }
+
+
 cdef class MidiOut(MidiBase):
     """Midi output client interface.
 
@@ -996,6 +3433,12 @@ cdef class MidiOut(MidiBase):
     """
 
     cdef RtMidiOut *thisptr
+    # sends scheduled messages or NULL, created on demand
+    cdef OutputScheduler *_scheduler
+    # whether messages sent without a time are queued by the scheduler
+    cdef bint _shaped
+    cdef _OutputContext _out_ctx
+    cdef object __weakref__
 
     cdef RtMidi* baseptr(self):
         return self.thisptr
@@ -1014,12 +3457,23 @@ cdef class MidiOut(MidiBase):
         except RuntimeError as exc:
             raise SystemError(str(exc), type=ERR_DRIVER_ERROR)
 
+        self._out_ctx.out = self.thisptr
+        self._out_ctx.lock = &self._lock
+        _outputs.add(self)
         self.set_error_callback(_default_error_handler)
         self._port = None
         self._deleted = False
 
     def __dealloc__(self):
         """De-allocate pointer to C++ class instance."""
+        # The scheduler thread may be waiting for the GIL in the error
+        # callback, which must not be called anymore.
+        with self._callback_lock:
+            self._error_ctx.callback = NULL
+
+        # the scheduler thread uses thisptr
+        _delete_scheduler(self._scheduler)
+
         if hasattr(self, "thisptr"):
             del self.thisptr
 
@@ -1040,10 +3494,20 @@ cdef class MidiOut(MidiBase):
             instance.
 
         """
-        if not self._deleted:
-            del self.thisptr
+        cdef RtMidiOut *thisptr
+
+        self._stop_scheduler()
+
+        with self._lock:
+            if self._deleted:
+                return
+
+            thisptr = self.thisptr
+            self.thisptr = NULL
             self._deleted = True
 
+        del thisptr
+
     @property
     def is_deleted(self):
         return self._deleted
@@ -1062,11 +3526,25 @@ cdef class MidiOut(MidiBase):
         """
         return self.thisptr.getCurrentApi()
 
-    def send_message(self, message):
+    def close_port(self):
+        """Close the MIDI output port opened via ``open_port``.
+
+        Also drops all scheduled and queued messages, which have not been sent
+        yet, see ``cancel_scheduled``.
+
+        """
+        self.cancel_scheduled()
+        MidiBase.close_port(self)
+
+    def send_message(self, message, at=None):
         """Send a MIDI message to the output port.
 
         The message must be passed as an iterable yielding integers, each
-        element representing one byte of the MIDI message.
+        element representing one byte of the MIDI message, or as an object
+        supporting the buffer protocol with unsigned bytes, e.g. ``bytes``,
+        ``bytearray``, ``memoryview`` or ``array('B')``. The latter are copied
+        in one step instead of element by element, which makes sending long
+        System Exclusive messages much faster.
 
         Normal MIDI messages have a length of one to three bytes, but you can
         also send System Exclusive messages, which can be arbitrarily long, via
@@ -1077,7 +3555,25 @@ cdef class MidiOut(MidiBase):
         must be a start-of-sysex status byte, i.e. 0xF0.
 
         .. note:: with some backend APIs (notably ```WINDOWS_MM``) this function
-            blocks until the whole message is sent.
+            blocks until the whole message is sent. The GIL is released while
+            the message is sent, so other Python threads keep running, but
+            other threads sending with the same instance wait until the
+            message is sent.
+
+        If ``at`` is given, the message is not sent right away, but queued and
+        sent by a native scheduler thread at the given time, which must be a
+        value of the monotonic clock in nanoseconds as returned by
+        ``time.monotonic_ns()``. The thread sleeps until the exact time with
+        the GIL released, so queueing messages ahead of time, e.g. a bar in
+        advance, makes the timing independent of Python's thread scheduling
+        and garbage collection. Messages with a time in the past are sent as
+        soon as possible and messages with the same time in the order they
+        were queued. Messages sent without ``at`` are not delayed by scheduled
+        messages.
+
+        Errors occurring when a scheduled message is sent are passed to the
+        error callback in the scheduler thread, but exceptions raised by it
+        can not be propagated and are printed instead.
 
         Exceptions:
 
@@ -1085,21 +3581,550 @@ cdef class MidiOut(MidiBase):
             Raised if ``message`` argument is empty or more than 3 bytes long
             and not a SysEx message.
 
+        ``TypeError``
+            Raised if ``at`` is not an integer.
+
         """
+        cdef Py_buffer view
         cdef vector[unsigned char] msg_v
 
+        if _get_byte_buffer(message, &view):
+            try:
+                self._send(<const unsigned char *>view.buf, view.len, at)
+            finally:
+                PyBuffer_Release(&view)
+
+            return
+
+        _append_message(msg_v, message)
+        self._send(msg_v.data(), msg_v.size(), at)
+
+    cdef _send(self, const unsigned char *message, size_t size, at):
+        """Check and send or schedule a MIDI message given as a byte array."""
+        _check_message(message, size)
+        self._send_checked(message, size, 1, at)
+
+    cdef _send_checked(self, const unsigned char *messages, size_t size, size_t count, at):
+        """Send or schedule ``count`` checked messages of ``size`` bytes each.
+
+        The messages are stored one after another in ``messages``.
+
+        """
+        cdef OutputScheduler *scheduler
+        cdef int64_t time
+        cdef size_t i
+
+        if at is not None:
+            # no float, which is most likely a time in seconds
+            time = PyNumber_Index(at)
+
+        # RtMidi does not support sending from several threads at once
+        with self._lock:
+            if at is None and not self._shaped:
+                self._error_ctx.raised = False
+
+                # see send_messages
+                with nogil:
+                    for i in range(count):
+                        self.thisptr.sendMessageNoexcept(messages + i * size, size)
+
+                        if self._error_ctx.raised:
+                            break
+
+                _check_raised(&self._error_ctx)
+                return
+
+            scheduler = self._get_scheduler()
+
+            for i in range(count):
+                if at is None:
+                    scheduler.push_next(messages + i * size, size)
+                else:
+                    scheduler.push(time, messages + i * size, size)
+
+    cdef OutputScheduler *_get_scheduler(self) except NULL:
+        """Return the scheduler, which is created on first use. Needs the lock."""
+        if self._scheduler == NULL:
+            self._scheduler = new OutputScheduler(&_send_scheduled, <void *>&self._out_ctx,
+                                                  current_interpreter())
+
+        return self._scheduler
+
+    cdef _send_channel_message(self, int status, int channel, int data1, int data2,
+                               size_t size, at):
+        """Send a checked channel message of two or three bytes."""
+        cdef unsigned char message[3]
+        message[0] = status | channel
+        message[1] = data1
+        message[2] = data2
+        self._send_checked(message, size, 1, at)
+
+    cdef _send_parameter(self, int select_msb, int channel, int param, int value, at):
+        """Send a checked RPN or NRPN change as four control changes."""
+        cdef unsigned char messages[12]
+        cdef int controllers[4]
+        cdef int values[4]
+        cdef int i
+
+        # parameter number MSB and LSB, data entry MSB and LSB
+        controllers[:] = [select_msb, select_msb - 1, 6, 38]
+        values[:] = [param >> 7, param & 0x7F, value >> 7, value & 0x7F]
+
+        for i in range(4):
+            messages[i * 3] = 0xB0 | channel
+            messages[i * 3 + 1] = controllers[i]
+            messages[i * 3 + 2] = values[i]
+
+        self._send_checked(messages, 3, 4, at)
+
+    def send_note_on(self, int channel, int note, int velocity=127, at=None):
+        """Send a Note On message.
+
+        The typed ``send_*`` methods take a zero-based MIDI channel number
+        (0-15) and send the message without creating any Python objects, which
+        is faster than building a message for ``send_message``. Like with
+        ``send_message``, the message is scheduled for the time ``at``, if
+        given.
+
+        Exceptions:
+
+        ``ValueError``
+            Raised if the channel or a data value is out of range.
+
+        """
+        _check_channel(channel)
+        _check_data_byte(note, "Note number")
+        _check_data_byte(velocity, "Velocity")
+        self._send_channel_message(0x90, channel, note, velocity, 3, at)
+
+    def send_note_off(self, int channel, int note, int velocity=0, at=None):
+        """Send a Note Off message, see ``send_note_on``."""
+        _check_channel(channel)
+        _check_data_byte(note, "Note number")
+        _check_data_byte(velocity, "Velocity")
+        self._send_channel_message(0x80, channel, note, velocity, 3, at)
+
+    def send_poly_pressure(self, int channel, int note, int value, at=None):
+        """Send a Polyphonic Key Pressure message, see ``send_note_on``."""
+        _check_channel(channel)
+        _check_data_byte(note, "Note number")
+        _check_data_byte(value, "Pressure value")
+        self._send_channel_message(0xA0, channel, note, value, 3, at)
+
+    def send_cc(self, int channel, int number, int value, at=None):
+        """Send a Control Change message, see ``send_note_on``."""
+        _check_channel(channel)
+        _check_data_byte(number, "Controller number")
+        _check_data_byte(value, "Controller value")
+        self._send_channel_message(0xB0, channel, number, value, 3, at)
+
+    def send_program_change(self, int channel, int program, at=None):
+        """Send a Program Change message, see ``send_note_on``."""
+        _check_channel(channel)
+        _check_data_byte(program, "Program number")
+        self._send_channel_message(0xC0, channel, program, 0, 2, at)
+
+    def send_channel_pressure(self, int channel, int value, at=None):
+        """Send a Channel Pressure message, see ``send_note_on``."""
+        _check_channel(channel)
+        _check_data_byte(value, "Pressure value")
+        self._send_channel_message(0xD0, channel, value, 0, 2, at)
+
+    def send_pitch_bend(self, int channel, int value=8192, at=None):
+        """Send a Pitch Bend message with a value of 0-16383 (center is 8192).
+
+        See ``send_note_on``.
+
+        """
+        _check_channel(channel)
+        _check_14bit(value, "Pitch bend value")
+        self._send_channel_message(0xE0, channel, value & 0x7F, value >> 7, 3, at)
+
+    def send_rpn(self, int channel, int param, int value, at=None):
+        """Set a Registered Parameter Number (RPN) to a 14-bit value.
+
+        Sends four Control Change messages, selecting the parameter with
+        controllers 101 and 100 and setting the value with the data entry
+        controllers 6 and 38, without messages sent by other threads in
+        between. ``param`` and ``value`` must be in range 0-16383, see
+        ``send_note_on``.
+
+        """
+        _check_channel(channel)
+        _check_14bit(param, "Parameter number")
+        _check_14bit(value, "Parameter value")
+        self._send_parameter(101, channel, param, value, at)
+
+    def send_nrpn(self, int channel, int param, int value, at=None):
+        """Set a Non-Registered Parameter Number (NRPN) to a 14-bit value.
+
+        Like ``send_rpn``, but selects the parameter with controllers 99 and
+        98.
+
+        """
+        _check_channel(channel)
+        _check_14bit(param, "Parameter number")
+        _check_14bit(value, "Parameter value")
+        self._send_parameter(99, channel, param, value, at)
+
+    def cancel_scheduled(self):
+        """Drop all scheduled messages, which have not been sent yet.
+
+        This includes the messages queued by the output shaper, see
+        ``set_output_rate``. Returns the number of dropped messages.
+
+        """
+        with self._lock:
+            if self._scheduler == NULL:
+                return 0
+
+            return self._scheduler.clear()
+
+    def get_scheduled_count(self):
+        """Return the number of scheduled and queued messages not sent yet."""
+        with self._lock:
+            if self._scheduler == NULL:
+                return 0
+
+            return self._scheduler.size()
+
+    cdef _stop_scheduler(self):
+        """Stop the scheduler thread, dropping all pending messages."""
+        cdef OutputScheduler *scheduler
+
+        with self._lock:
+            scheduler = self._scheduler
+            self._scheduler = NULL
+            self._shaped = False
+
+        _delete_scheduler(scheduler)
+
+    def set_output_rate(self, bytes_per_second=None, sysex_gap=0.0):
+        """Limit the rate of the MIDI output to the bandwidth of the connection.
+
+        If ``bytes_per_second`` is given, all messages sent without a time
+        are not sent right away, but put into a queue, from which a native
+        background thread sends them in order, but never faster than the given
+        number of bytes per second. The send methods then return immediately
+        and messages are never lost, even when sending in bursts faster than
+        a hardware MIDI connection can transmit. ``DIN_MIDI_BYTE_RATE`` is the
+        rate of a DIN MIDI connection. Messages scheduled for a time with
+        ``at`` are delayed as needed to keep the rate as well.
+
+        If ``sysex_gap`` is given, the thread additionally waits this number
+        of seconds after each System Exclusive message, which some devices
+        need to process a message before they can receive the next one.
+
+        Calling the method without arguments sends messages right away again.
+        Messages still queued are sent at the previous rate, so call
+        ``flush_output`` before, if messages must not overtake them.
+
+        Exceptions:
+
+        ``ValueError``
+            Raised if ``bytes_per_second`` is not positive or ``sysex_gap`` is
+            negative.
+
+        """
+        if bytes_per_second is not None and bytes_per_second <= 0:
+            raise ValueError("'bytes_per_second' must be positive.")
+        elif sysex_gap < 0:
+            raise ValueError("'sysex_gap' must not be negative.")
+
+        shaped = bytes_per_second is not None or sysex_gap > 0
+
+        with self._lock:
+            if shaped or self._scheduler != NULL:
+                self._get_scheduler().set_rate(bytes_per_second or 0,
+                                               <int64_t>(sysex_gap * 1e9))
+
+            self._shaped = shaped
+
+    def flush_output(self, timeout=None):
+        """Wait until all messages queued by the output shaper are sent.
+
+        Waits with the GIL released for at most ``timeout`` seconds (forever
+        if ``None``) until all messages sent before the call, which were
+        queued because of ``set_output_rate``, are sent. Messages scheduled
+        for a time with ``at`` are not waited for.
+
+        Returns ``True`` if all messages were sent and ``False``, if the
+        timeout expired or the messages were dropped by ``cancel_scheduled``
+        or ``close_port`` in another thread.
+
+        """
+        cdef OutputScheduler *scheduler
+        cdef uint64_t position
+        cdef unsigned long token
+
+        with self._lock:
+            scheduler = self._scheduler
+
+            if scheduler == NULL:
+                return True
+
+            position = scheduler.next_position()
+            token = scheduler.clear_token()
+
+        return position == 0 or self._wait_sent(scheduler, position - 1, token, timeout) == 1
+
+    def send_sysex_stream(self, source, progress_cb=None):
+        """Send all System Exclusive messages in a file or buffer.
+
+        ``source`` can be a binary file object, e.g. of a ``.syx`` file, or
+        an object supporting the buffer protocol with unsigned bytes, e.g.
+        ``bytes``. Each sequence from a 0xF0 byte up to the next 0xF7 byte is
+        sent as one message, other bytes between the messages are ignored.
+
+        The messages are sent in order by the background thread of the output
+        shaper, so they go out as fast as the rate set with
+        ``set_output_rate`` allows, with the optional gap after each message.
+        Messages sent by other threads in the meantime are sent in between
+        the System Exclusive messages. The method blocks with the GIL released
+        until the last message is sent and calls
+        ``progress_cb(sent_bytes, total_bytes)`` after each message, if given.
+
+        Returns the number of messages sent, which is less than the number of
+        messages in ``source`` only if they were dropped by
+        ``cancel_scheduled`` or ``close_port`` in another thread.
+
+        Exceptions:
+
+        ``ValueError``
+            Raised if a message in ``source`` is not terminated by 0xF7 or
+            contains another status byte. Nothing is sent in this case.
+
+        ``TypeError``
+            Raised if ``source`` is not a binary file or a buffer of unsigned
+            bytes.
+
+        """
+        cdef Py_buffer view
+        cdef vector[size_t] offsets
+        cdef vector[size_t] sizes
+        cdef vector[uint64_t] positions
+        cdef const unsigned char *data
+        cdef OutputScheduler *scheduler = NULL
+        cdef unsigned long token = 0
+        cdef size_t total_bytes = 0
+        cdef size_t sent_bytes = 0
+        cdef size_t sent = 0
+        cdef size_t i
+
+        if hasattr(source, 'read'):
+            source = source.read()
+
+        if not _get_byte_buffer(source, &view):
+            raise TypeError("'source' must be a binary file or a buffer of unsigned bytes.")
+
         try:
-            msg_v.reserve(len(message))
-        except TypeError:
-            pass
+            data = <const unsigned char *>view.buf
+            _split_sysex(data, view.len, offsets, sizes)
+
+            for i in range(sizes.size()):
+                total_bytes += sizes[i]
+
+            while sent < sizes.size():
+                # keep the next message queued, so the output does not pause
+                # while this thread wakes up to queue it
+                while positions.size() < sizes.size() and positions.size() <= sent + 1:
+                    i = positions.size()
+
+                    with self._lock:
+                        if scheduler == NULL:
+                            scheduler = self._get_scheduler()
+                            token = scheduler.clear_token()
+                        elif self._scheduler != scheduler:
+                            return sent
+
+                        positions.push_back(scheduler.push_next(data + offsets[i], sizes[i]))
+
+                if self._wait_sent(scheduler, positions[sent], token, None) != 1:
+                    break
+
+                sent_bytes += sizes[sent]
+                sent += 1
+
+                if progress_cb is not None:
+                    progress_cb(sent_bytes, total_bytes)
+        finally:
+            PyBuffer_Release(&view)
+
+        return sent
+
+    cdef int _wait_sent(self, OutputScheduler *scheduler, uint64_t position,
+                        unsigned long token, timeout) except -2:
+        """Wait with the GIL released until a message queued with push_next is sent.
+
+        Returns 1 if the message was sent, 0 if ``timeout`` expired and -1 if
+        it may have been dropped. Wakes up periodically to let signal handlers
+        run, like ``_wait_for_input``.
+
+        """
+        cdef double remaining = -1.0 if timeout is None else timeout
+        cdef double interval
+        cdef int result
+
+        while True:
+            interval = _SIGNAL_CHECK_INTERVAL
+
+            if 0 <= remaining < interval:
+                interval = remaining
+
+            # the scheduler is not deleted before this thread stops waiting
+            with self._lock:
+                if self._scheduler != scheduler:
+                    return -1
+
+                scheduler.add_waiter()
+
+            with nogil:
+                result = scheduler.wait_sent(position, interval, token)
+
+            if result != 0:
+                return result
+
+            PyErr_CheckSignals()
+
+            if remaining >= 0:
+                remaining -= interval
+
+                if remaining <= 0:
+                    return 0
+
+    def send_messages(self, messages, lengths=None):
+        """Send several MIDI messages to the output port at once.
+
+        The messages can be passed in one of these forms:
+
+        * an iterable of messages, each of which can be anything accepted by
+          ``send_message``.
+        * a buffer of unsigned bytes, e.g. ``bytes`` or ``array('B')``, with
+          all messages one after another and an iterable with the length of
+          each message as ``lengths``.
+        * a two-dimensional C-contiguous buffer of unsigned bytes, e.g. a NumPy
+          ``uint8`` array, with one message per row. If ``lengths`` is given,
+          only the first ``lengths[i]`` bytes of row ``i`` are sent, so
+          messages of different lengths can be packed into one array.
+
+        All messages are checked before the first one is sent. Then they are
+        sent in order with the GIL released, without messages sent by other
+        threads in between. This is much faster than calling ``send_message``
+        for each message, so the first and the last message go out closer
+        together.
+
+        Returns the number of messages sent.
+
+        Exceptions:
+
+        ``ValueError``
+            Raised if any message is empty or more than 3 bytes long and not a
+            SysEx message, or if ``lengths`` does not match the buffer.
+
+        ``TypeError``
+            Raised if ``lengths`` is given, but ``messages`` is not a buffer of
+            unsigned bytes.
+
+        """
+        cdef Py_buffer view
+        cdef bint have_view
+        cdef vector[unsigned char] data
+        cdef vector[size_t] offsets
+        cdef vector[size_t] sizes
+        cdef const unsigned char *base
+        cdef OutputScheduler *scheduler
+        cdef Py_ssize_t count
+        cdef size_t offset = 0
+        cdef size_t width, size, i
+
+        have_view = _get_byte_buffer(messages, &view)
+
+        try:
+            if have_view and view.ndim == 2:
+                count = view.shape[0]
+                width = view.shape[1]
+
+                if lengths is None:
+                    lengths = [width] * count
+                elif len(lengths) != count:
+                    raise ValueError("'lengths' must have one element per row of "
+                                     "'messages'.")
+
+                for size in lengths:
+                    if size > width:
+                        raise ValueError("Element of 'lengths' is larger than the "
+                                         "rows of 'messages'.")
+
+                    offsets.push_back(offsets.size() * width)
+                    sizes.push_back(size)
+
+                base = <const unsigned char *>view.buf
+            elif have_view and view.ndim <= 1:
+                if lengths is None:
+                    raise ValueError("'lengths' is required for a one-dimensional buffer.")
+
+                for size in lengths:
+                    offsets.push_back(offset)
+                    sizes.push_back(size)
+                    offset += size
+
+                if offset != <size_t>view.len:
+                    raise ValueError("Sum of 'lengths' does not match the size of "
+                                     "'messages'.")
+
+                base = <const unsigned char *>view.buf
+            elif have_view:
+                raise ValueError("'messages' must not have more than two dimensions.")
+            elif lengths is not None:
+                raise TypeError("'lengths' requires 'messages' to be a buffer of "
+                                "unsigned bytes.")
+            else:
+                for message in messages:
+                    offsets.push_back(data.size())
+                    _append_message(data, message)
+                    sizes.push_back(data.size() - offsets.back())
+
+                base = data.data()
+
+            for i in range(sizes.size()):
+                try:
+                    _check_message(base + offsets[i], sizes[i])
+                except ValueError as exc:
+                    raise ValueError("Message #%i: %s" % (i, exc)) from None
+
+            # RtMidi does not support sending from several threads at once
+            with self._lock:
+                if self._shaped:
+                    scheduler = self._get_scheduler()
+
+                    for i in range(sizes.size()):
+                        scheduler.push_next(base + offsets[i], sizes[i])
+                else:
+                    self._error_ctx.raised = False
+
+                    with nogil:
+                        for i in range(sizes.size()):
+                            self.thisptr.sendMessageNoexcept(base + offsets[i], sizes[i])
+
+                            if self._error_ctx.raised:
+                                break
+
+                    _check_raised(&self._error_ctx)
+        finally:
+            if have_view:
+                PyBuffer_Release(&view)
+
+        return sizes.size()
+
+
+# MidiOut instances, whose scheduler threads have to be stopped before the
+# interpreter is finalized
+_outputs = weakref.WeakSet()
+
 
-        for c in message:
-            msg_v.push_back(c)
+def _stop_schedulers():
+    for midiout in list(_outputs):
+        (<MidiOut> midiout)._stop_scheduler()
 
-        if msg_v.size() == 0:
-            raise ValueError("'message' must not be empty.")
-        elif msg_v.size() > 3 and msg_v.at(0) != 0xF0:
-            raise ValueError("'message' longer than 3 bytes but does not "
-                             "start with 0xF0.")
 
-        self.thisptr.sendMessage(&msg_v)
+atexit.register(_stop_schedulers)
@@ -0,0 +1,604 @@
+#ifndef INPUT_QUEUE_H
+#define INPUT_QUEUE_H
+/*
+ * Native queue for incoming MIDI messages.
+ *
+ * The ``MidiIn`` class registers a C-level input callback with RtMidi, which
+ * pushes received messages into this queue from the backend thread without
+ * acquiring the Python GIL. The Python side then retrieves queued messages
+ * with ``MidiIn.get_message`` or ``MidiIn.get_messages``, which only needs to
+ * lock the queue once for a whole batch of messages, and can wait for new
+ * messages on a condition variable with the GIL released.
+ *
+ * In coalescing mode, a continuous controller message (control change, pitch
+ * bend, channel or polyphonic pressure) replaces the value of a still queued
+ * message of the same type for the same channel and controller or note, so a
+ * slow consumer only sees the latest value and the queue does not overflow.
+ *
+ * The ``InputStats`` class holds counters describing the load of the input
+ * pipeline, which are cheap enough to update for every received message.
+ *
+ * Optionally, the queue provides a file descriptor (an eventfd on Linux, a
+ * pipe on other POSIX systems), which is readable while the queue is not
+ * empty, so it can be watched by ``select``-based event loops like asyncio.
+ */
+
+#include <atomic>
+#include <chrono>
+#include <condition_variable>
+#include <cstddef>
+#include <cstdint>
+#include <deque>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+#if defined(__linux__)
+#include <sys/eventfd.h>
+#include <unistd.h>
+#elif !defined(_WIN32)
+#include <fcntl.h>
+#include <unistd.h>
+#endif
+
+struct MidiEvent {
+    double delta_time;
+    int64_t timestamp;
+    // index of the input in a MidiInGroup
+    int source;
+    std::vector<unsigned char> message;
+};
+
+class MidiInQueue {
+public:
+    explicit MidiInQueue(size_t size_limit) :
+        interrupts_(0), size_limit_(size_limit), max_size_(0), dropped_(0),
+        first_seq_(0), pending_delta_(0.0),
+        read_fd_(-1), write_fd_(-1), signalled_(false) {}
+
+    ~MidiInQueue() {
+#if !defined(_WIN32)
+        if (read_fd_ != -1)
+            close(read_fd_);
+
+        if (write_fd_ != -1 && write_fd_ != read_fd_)
+            close(write_fd_);
+#endif
+    }
+
+    /*
+     * Append a message to the queue.
+     *
+     * Messages are kept sorted by timestamp, so messages pushed by several
+     * threads, i.e. from several inputs, are queued in the order they were
+     * received. Returns false and drops the message, if the queue already
+     * holds ``size_limit`` messages.
+     */
+    bool push(double delta_time, int64_t timestamp,
+              const std::vector<unsigned char> &message, int source = 0) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        long key = coalesce_key(message);
+
+        if (key != -1 && coalesce(key, delta_time, message, source))
+            return true;
+
+        if (events_.size() >= size_limit_) {
+            dropped_++;
+            return false;
+        }
+
+        // usually the message is the newest one and is just appended
+        std::deque<MidiEvent>::iterator pos = events_.end();
+
+        while (pos != events_.begin() && (pos - 1)->timestamp > timestamp)
+            --pos;
+
+        pos = events_.insert(pos, MidiEvent());
+        pos->delta_time = delta_time + pending_delta_;
+        pending_delta_ = 0.0;
+        pos->timestamp = timestamp;
+        pos->source = source;
+        pos->message = message;
+
+        if (key != -1)
+            seqs_[key] = first_seq_ + (pos - events_.begin()) + 1;
+
+        if (events_.size() > max_size_)
+            max_size_ = events_.size();
+
+        cond_.notify_all();
+        signal_fd();
+        return true;
+    }
+
+    /*
+     * Move up to ``max_count`` messages from the queue to ``out``.
+     *
+     * If ``max_count`` is 0, all queued messages are moved. Returns the number
+     * of messages moved.
+     */
+    size_t pop(std::vector<MidiEvent> &out, size_t max_count) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        size_t count = events_.size();
+
+        if (max_count && max_count < count)
+            count = max_count;
+
+        out.reserve(out.size() + count);
+
+        for (size_t i = 0; i < count; i++) {
+            out.push_back(MidiEvent());
+            out.back().delta_time = events_.front().delta_time;
+            out.back().timestamp = events_.front().timestamp;
+            out.back().source = events_.front().source;
+            out.back().message.swap(events_.front().message);
+            events_.pop_front();
+        }
+
+        first_seq_ += count;
+
+        if (events_.empty())
+            reset_fd();
+
+        return count;
+    }
+
+    /*
+     * Put ``events[start:]`` back at the front of the queue, e.g. messages
+     * popped with ``pop``, which could not be handled by the caller.
+     */
+    void unpop(std::vector<MidiEvent> &events, size_t start) {
+        std::lock_guard<std::mutex> lock(mutex_);
+
+        for (size_t i = events.size(); i > start; i--) {
+            events_.push_front(MidiEvent());
+            events_.front().delta_time = events[i - 1].delta_time;
+            events_.front().timestamp = events[i - 1].timestamp;
+            events_.front().source = events[i - 1].source;
+            events_.front().message.swap(events[i - 1].message);
+            first_seq_--;
+        }
+
+        if (!events_.empty()) {
+            cond_.notify_all();
+            signal_fd();
+        }
+    }
+
+    size_t size() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return events_.size();
+    }
+
+    /* Return the highest number of messages queued at the same time. */
+    size_t max_size() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return max_size_;
+    }
+
+    /* Return the number of messages dropped because the queue was full. */
+    uint64_t dropped() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return dropped_;
+    }
+
+    /*
+     * Enable or disable coalescing of continuous controller messages.
+     */
+    void set_coalescing(bool enable) {
+        std::lock_guard<std::mutex> lock(mutex_);
+
+        if (!enable)
+            seqs_.clear();
+        else if (seqs_.empty())
+            seqs_.resize(COALESCE_KEYS, 0);
+    }
+
+    /* Reset the counters returned by ``max_size`` and ``dropped``. */
+    void reset_stats() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        max_size_ = events_.size();
+        dropped_ = 0;
+    }
+
+    /*
+     * Return a token to pass to ``wait_for``, which identifies the calls to
+     * ``interrupt`` made so far.
+     */
+    unsigned long interrupt_token() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return interrupts_;
+    }
+
+    /*
+     * Wait for at most ``timeout`` seconds until a message is queued.
+     *
+     * Returns 1 if messages are available, 0 if the timeout expired and -1
+     * if ``interrupt`` was called since ``token`` was obtained.
+     */
+    int wait_for(double timeout, unsigned long token) {
+        std::unique_lock<std::mutex> lock(mutex_);
+        cond_.wait_for(lock, std::chrono::duration<double>(timeout), [&] {
+            return !events_.empty() || interrupts_ != token;
+        });
+
+        if (!events_.empty())
+            return 1;
+
+        return interrupts_ != token ? -1 : 0;
+    }
+
+    /*
+     * Wake up all threads waiting in ``wait_for`` and make the notification
+     * file descriptor readable.
+     */
+    void interrupt() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        interrupts_++;
+        cond_.notify_all();
+        signal_fd();
+    }
+
+    /*
+     * Return a file descriptor, which is readable while messages are queued
+     * or after ``interrupt`` was called, until the queue is next emptied.
+     *
+     * The descriptor is created on the first call. Returns -1 if it could not
+     * be created or the platform does not support it.
+     */
+    int notify_fd() {
+        std::lock_guard<std::mutex> lock(mutex_);
+
+#if defined(__linux__)
+        if (read_fd_ == -1)
+            read_fd_ = write_fd_ = eventfd(0, EFD_CLOEXEC | EFD_NONBLOCK);
+#elif !defined(_WIN32)
+        int fds[2];
+
+        if (read_fd_ == -1 && pipe(fds) == 0) {
+            for (int i = 0; i < 2; i++) {
+                fcntl(fds[i], F_SETFL, fcntl(fds[i], F_GETFL) | O_NONBLOCK);
+                fcntl(fds[i], F_SETFD, FD_CLOEXEC);
+            }
+
+            read_fd_ = fds[0];
+            write_fd_ = fds[1];
+        }
+#endif
+        if (!events_.empty())
+            signal_fd();
+
+        return read_fd_;
+    }
+
+    /*
+     * Wait until a message is queued or ``*cancel`` is set via ``cancel``.
+     *
+     * Returns false if the wait was cancelled.
+     */
+    bool wait(const bool *cancel) {
+        std::unique_lock<std::mutex> lock(mutex_);
+        cond_.wait(lock, [&] { return !events_.empty() || *cancel; });
+        return !*cancel;
+    }
+
+    /*
+     * Sleep for ``seconds`` or until ``*cancel`` is set via ``cancel``.
+     *
+     * Returns false if the sleep was cancelled.
+     */
+    bool sleep(double seconds, const bool *cancel) {
+        std::unique_lock<std::mutex> lock(mutex_);
+        return !cond_.wait_for(lock, std::chrono::duration<double>(seconds),
+                               [&] { return *cancel; });
+    }
+
+    /* Set ``*flag`` and wake up all threads waiting on the queue. */
+    void cancel(bool *flag) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        *flag = true;
+        cond_.notify_all();
+    }
+
+private:
+    /* Number of keys: 4 message types x 16 channels x 128 controllers/notes */
+    static const size_t COALESCE_KEYS = 4 * 16 * 128;
+
+    /*
+     * Return the coalescing key for a message, or -1 if coalescing is disabled
+     * or the message is not a continuous controller message.
+     */
+    long coalesce_key(const std::vector<unsigned char> &message) const {
+        if (seqs_.empty() || message.empty())
+            return -1;
+
+        unsigned char status = message[0];
+        long type;
+
+        switch (status & 0xF0) {
+            case 0xA0:  // polyphonic pressure
+                type = 0;
+                break;
+            case 0xB0:  // control change
+                type = 1;
+                break;
+            case 0xD0:  // channel pressure
+                type = 2;
+                break;
+            case 0xE0:  // pitch bend
+                type = 3;
+                break;
+            default:
+                return -1;
+        }
+
+        if (message.size() != (type == 2 ? 2u : 3u))
+            return -1;
+
+        // only polyphonic pressure and control change have a second key byte
+        long param = type < 2 ? message[1] & 0x7F : 0;
+        return (type * 16 + (status & 0x0F)) * 128 + param;
+    }
+
+    /*
+     * Replace the message of a queued event with the same key by ``message``.
+     *
+     * The queued event keeps its position and timing, the delta time of the
+     * new message is added to the next appended event instead. Returns false
+     * if no message with this key is queued. The index may be off for events
+     * queued after an out-of-order event was inserted, so the key is checked
+     * again. Needs the lock.
+     */
+    bool coalesce(long key, double delta_time,
+                  const std::vector<unsigned char> &message, int source) {
+        uint64_t seq = seqs_[key];
+
+        // sequence numbers in the index are stored incremented by one
+        if (seq <= first_seq_ || seq > first_seq_ + events_.size())
+            return false;
+
+        MidiEvent &event = events_[seq - first_seq_ - 1];
+
+        if (event.source != source || event.message.size() != message.size() ||
+                event.message[0] != message[0] ||
+                ((message[0] & 0xF0) < 0xC0 && event.message[1] != message[1]))
+            return false;
+
+        event.message = message;
+        pending_delta_ += delta_time;
+        return true;
+    }
+
+    /* Make the notification file descriptor readable. Needs the lock. */
+    void signal_fd() {
+        if (signalled_ || write_fd_ == -1)
+            return;
+
+#if defined(__linux__)
+        uint64_t value = 1;
+        signalled_ = write(write_fd_, &value, sizeof(value)) == sizeof(value);
+#elif !defined(_WIN32)
+        char value = 1;
+        signalled_ = write(write_fd_, &value, 1) == 1;
+#endif
+    }
+
+    /* Make the notification file descriptor unreadable. Needs the lock. */
+    void reset_fd() {
+        if (!signalled_)
+            return;
+
+#if defined(__linux__)
+        uint64_t value;
+        signalled_ = read(read_fd_, &value, sizeof(value)) != sizeof(value);
+#elif !defined(_WIN32)
+        char value;
+        signalled_ = read(read_fd_, &value, 1) != 1;
+#endif
+    }
+
+    std::condition_variable cond_;
+    std::mutex mutex_;
+    std::deque<MidiEvent> events_;
+    unsigned long interrupts_;
+    size_t size_limit_;
+    size_t max_size_;
+    uint64_t dropped_;
+    // sequence number of the first queued event, counting all pushed events
+    uint64_t first_seq_;
+    // sequence number + 1 of the latest queued event for each coalescing key
+    std::vector<uint64_t> seqs_;
+    double pending_delta_;
+    int read_fd_;
+    int write_fd_;
+    bool signalled_;
+};
+
+
+/*
+ * Destination of the messages received by a ``MidiIn`` instance.
+ *
+ * Normally this is the instance's own queue, but it can be redirected to the
+ * queue of a ``MidiInGroup``. The lock guarantees that no message is pushed to
+ * the previous queue anymore, once ``set`` returns, so it can be destroyed.
+ */
+class InputRoute {
+public:
+    explicit InputRoute(MidiInQueue *queue) : queue_(queue), source_(0) {}
+
+    bool push(double delta_time, int64_t timestamp,
+              const std::vector<unsigned char> &message) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return queue_->push(delta_time, timestamp, message, source_);
+    }
+
+    void set(MidiInQueue *queue, int source) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        queue_ = queue;
+        source_ = source;
+    }
+
+    /* Interrupt the threads waiting for input on the current queue. */
+    void interrupt() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        queue_->interrupt();
+    }
+
+private:
+    std::mutex mutex_;
+    MidiInQueue *queue_;
+    int source_;
+};
+
+
+/*
+ * Counters for the MIDI input pipeline.
+ *
+ * Updated from the backend thread and the threads calling the Python callback
+ * function, so all counters are atomic. Times are in nanoseconds.
+ */
+class InputStats {
+public:
+    InputStats() { reset(); }
+
+    /* Count a message received from the backend of ``size`` bytes. */
+    void add_received(size_t size) {
+        received_.fetch_add(1, std::memory_order_relaxed);
+        bytes_.fetch_add(size, std::memory_order_relaxed);
+    }
+
+    /* Count a message discarded by the input filter. */
+    void add_filtered() {
+        filtered_.fetch_add(1, std::memory_order_relaxed);
+    }
+
+    /*
+     * Count a call of the Python callback function, which took ``duration``
+     * after waiting ``gil_wait`` to acquire the GIL.
+     */
+    void add_callback(int64_t duration, int64_t gil_wait) {
+        int64_t max = max_callback_time_.load(std::memory_order_relaxed);
+
+        callbacks_.fetch_add(1, std::memory_order_relaxed);
+        callback_time_.fetch_add(duration, std::memory_order_relaxed);
+        gil_wait_time_.fetch_add(gil_wait, std::memory_order_relaxed);
+
+        while (duration > max && !max_callback_time_.compare_exchange_weak(
+                   max, duration, std::memory_order_relaxed)) {}
+    }
+
+    void reset() {
+        received_.store(0);
+        filtered_.store(0);
+        bytes_.store(0);
+        callbacks_.store(0);
+        callback_time_.store(0);
+        max_callback_time_.store(0);
+        gil_wait_time_.store(0);
+    }
+
+    uint64_t received() const { return received_.load(); }
+    uint64_t filtered() const { return filtered_.load(); }
+    uint64_t bytes() const { return bytes_.load(); }
+    uint64_t callbacks() const { return callbacks_.load(); }
+    int64_t callback_time() const { return callback_time_.load(); }
+    int64_t max_callback_time() const { return max_callback_time_.load(); }
+    int64_t gil_wait_time() const { return gil_wait_time_.load(); }
+
+private:
+    std::atomic<uint64_t> received_;
+    std::atomic<uint64_t> filtered_;
+    std::atomic<uint64_t> bytes_;
+    std::atomic<uint64_t> callbacks_;
+    std::atomic<int64_t> callback_time_;
+    std::atomic<int64_t> max_callback_time_;
+    std::atomic<int64_t> gil_wait_time_;
+};
+
+
+/*
+ * Whether the calling thread is the thread of a BatchDispatcher, which was
+ * released by the callback it is calling, see ``BatchDispatcher::release``.
+ */
+static inline bool &dispatcher_released() {
+    static thread_local bool flag = false;
+    return flag;
+}
+
+
+/*
+ * Thread delivering queued messages in batches.
+ *
+ * Waits for messages to arrive in the queue, then waits for at most
+ * ``max_latency`` seconds to collect more messages before passing all queued
+ * messages at once to the ``deliver`` function, which is responsible for
+ * acquiring the GIL and calling the Python callback function.
+ */
+class BatchDispatcher {
+public:
+    typedef void (*DeliverFunc)(std::vector<MidiEvent> &events, void *data);
+
+    BatchDispatcher(MidiInQueue *queue, double max_latency,
+                    DeliverFunc deliver, void *data) :
+        queue_(queue), max_latency_(max_latency), deliver_(deliver),
+        data_(data), stopping_(false),
+        thread_(&BatchDispatcher::run, this) {}
+
+    /*
+     * Stop and join the thread. The GIL must not be held by the caller, which
+     * must not be the thread itself, see ``release``.
+     */
+    ~BatchDispatcher() {
+        if (thread_.joinable()) {
+            queue_->cancel(&stopping_);
+            thread_.join();
+        }
+    }
+
+    /* Whether the calling thread is the thread of this dispatcher. */
+    bool in_thread() const {
+        return std::this_thread::get_id() == thread_.get_id();
+    }
+
+    /*
+     * Stop the thread from within the callback it is calling, e.g. when the
+     * callback is cancelled by the callback itself, which can not join the
+     * thread. The thread deletes the dispatcher when ``deliver`` returns,
+     * without using the queue, the data or the dispatcher anymore, since they
+     * may be deleted by then. ``deliver`` must check ``dispatcher_released``
+     * after calling the callback for the same reason.
+     */
+    void release() {
+        dispatcher_released() = true;
+    }
+
+private:
+    void run() {
+        std::vector<MidiEvent> events;
+
+        while (queue_->wait(&stopping_)) {
+            if (max_latency_ > 0 && !queue_->sleep(max_latency_, &stopping_))
+                break;
+
+            if (queue_->pop(events, 0))
+                deliver_(events, data_);
+
+            if (dispatcher_released()) {
+                thread_.detach();
+                delete this;
+                return;
+            }
+
+            events.clear();
+        }
+    }
+
+    MidiInQueue *queue_;
+    double max_latency_;
+    DeliverFunc deliver_;
+    void *data_;
+    bool stopping_;
+    std::thread thread_;
+};
+
+#endif
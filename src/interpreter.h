@@ -0,0 +1,52 @@
+#ifndef INTERPRETER_H
+#define INTERPRETER_H
+/*
+ * Calling Python from native threads in the interpreter owning an object.
+ *
+ * ``PyGILState_Ensure``, which Cython uses for ``with gil``, attaches threads
+ * not created by Python to the main interpreter. So before the RtMidi backend
+ * threads or the dispatcher threads call a callback of an object created in a
+ * sub-interpreter, they attach to that interpreter with
+ * ``interpreter_attach``, whose thread state ``with gil`` then picks up.
+ */
+
+#include <Python.h>
+
+/* Return the interpreter of the calling thread, which must hold the GIL. */
+static inline PyInterpreterState *current_interpreter() {
+#if defined(PYPY_VERSION)
+    return NULL;
+#else
+    return PyThreadState_Get()->interp;
+#endif
+}
+
+/*
+ * Attach the calling thread to ``interp`` and acquire its GIL, unless it is
+ * the main interpreter or the thread already has a thread state. Returns the
+ * new thread state or NULL, to be passed to ``interpreter_detach``.
+ */
+static inline PyThreadState *interpreter_attach(PyInterpreterState *interp) {
+#if defined(PYPY_VERSION)
+    (void)interp;
+    return NULL;
+#else
+    if (interp == NULL || interp == PyInterpreterState_Main() ||
+            PyGILState_GetThisThreadState() != NULL)
+        return NULL;
+
+    PyThreadState *tstate = PyThreadState_New(interp);
+    PyEval_RestoreThread(tstate);
+    return tstate;
+#endif
+}
+
+/* Release the GIL and delete the thread state created by interpreter_attach. */
+static inline void interpreter_detach(PyThreadState *tstate) {
+    if (tstate != NULL) {
+        PyThreadState_Clear(tstate);
+        PyThreadState_DeleteCurrent();
+    }
+}
+
+#endif
@@ -0,0 +1,132 @@
+#ifndef MIDI_CLOCK_H
+#define MIDI_CLOCK_H
+/*
+ * Tempo and position tracking of received MIDI clock.
+ *
+ * ``MidiIn`` passes all received System Real-Time and Song Position Pointer
+ * messages to ``MidiClock::update`` in the backend thread, so clock ticks,
+ * which are sent 24 times per quarter note, don't have to be handled in
+ * Python to follow the tempo and song position of a clock source.
+ *
+ * The tempo is estimated from the average tick interval over a window of up
+ * to ``MIDI_CLOCK_WINDOW`` ticks, which is just the time between the first and
+ * the last tick in the window divided by the number of intervals, so the
+ * jitter of the individual ticks in between cancels out.
+ */
+
+#include <cstddef>
+#include <cstdint>
+#include <mutex>
+
+// number of tick timestamps for the tempo estimate (two quarter notes)
+#define MIDI_CLOCK_WINDOW 49
+// tick interval after which the tempo estimate is restarted (~5 bpm)
+#define MIDI_CLOCK_TIMEOUT 500000000LL
+
+struct MidiClockState {
+    // song position in clock ticks (6 ticks per Song Position Pointer unit)
+    int64_t position;
+    // time of the last clock tick
+    int64_t last_tick;
+    // estimated tick interval in nanoseconds or 0 if unknown
+    int64_t interval;
+    bool running;
+};
+
+
+class MidiClock {
+public:
+    MidiClock() { reset(); }
+
+    /*
+     * Update the state with a received MIDI message. Returns false if the
+     * message is not a clock related message.
+     */
+    bool update(const unsigned char *message, size_t size, int64_t timestamp) {
+        if (size == 0)
+            return false;
+
+        std::lock_guard<std::mutex> lock(mutex_);
+
+        switch (message[0]) {
+            case 0xF8:  // timing clock
+                tick(timestamp);
+                break;
+            case 0xFA:  // start
+                state_.position = 0;
+                state_.running = true;
+                first_tick_ = true;
+                break;
+            case 0xFB:  // continue
+                state_.running = true;
+                first_tick_ = true;
+                break;
+            case 0xFC:  // stop
+                state_.running = false;
+                break;
+            case 0xF2:  // song position pointer
+                if (size < 3)
+                    return false;
+
+                state_.position = ((message[2] & 0x7F) << 7 | (message[1] & 0x7F)) * 6;
+                break;
+            default:
+                return false;
+        }
+
+        return true;
+    }
+
+    void snapshot(MidiClockState &out) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        out = state_;
+    }
+
+    void reset() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        state_.position = 0;
+        state_.last_tick = 0;
+        state_.interval = 0;
+        state_.running = false;
+        first_tick_ = false;
+        count_ = 0;
+        start_ = 0;
+    }
+
+private:
+    /* Count a clock tick. Needs the lock. */
+    void tick(int64_t timestamp) {
+        if (count_ && timestamp - state_.last_tick > MIDI_CLOCK_TIMEOUT)
+            count_ = 0;
+
+        if (state_.running) {
+            // The first tick after start / continue is at the current position
+            if (first_tick_)
+                first_tick_ = false;
+            else
+                state_.position++;
+        }
+
+        window_[(start_ + count_) % MIDI_CLOCK_WINDOW] = timestamp;
+
+        if (count_ < MIDI_CLOCK_WINDOW)
+            count_++;
+        else
+            start_ = (start_ + 1) % MIDI_CLOCK_WINDOW;
+
+        if (count_ >= 2)
+            state_.interval = (timestamp - window_[start_]) / (int64_t)(count_ - 1);
+
+        state_.last_tick = timestamp;
+    }
+
+    std::mutex mutex_;
+    MidiClockState state_;
+    bool first_tick_;
+    // timestamps of the last ticks in a ring buffer
+    int64_t window_[MIDI_CLOCK_WINDOW];
+    size_t start_;
+    size_t count_;
+};
+
+#endif
@@ -0,0 +1,95 @@
+#ifndef MIDI_STATE_H
+#define MIDI_STATE_H
+/*
+ * Per-channel state of a MIDI input stream.
+ *
+ * ``MidiIn`` updates the state from the backend thread for every received
+ * channel message, before the message is filtered, queued or passed to a
+ * Python callback, so the current controller values, held notes etc. can be
+ * read at any time with ``MidiStateTracker`` without handling every message
+ * in Python.
+ */
+
+#include <cstddef>
+#include <cstdint>
+#include <cstring>
+#include <mutex>
+
+#define MIDI_STATE_PITCH_BEND_CENTER 8192
+
+struct MidiStateData {
+    unsigned char cc[16][128];
+    // velocity of held notes, 0 if the note is not held
+    unsigned char notes[16][128];
+    uint16_t pitch_bend[16];
+    // bank (MSB * 128 + LSB) selected at the last program change
+    uint16_t bank[16];
+    unsigned char channel_pressure[16];
+    unsigned char program[16];
+};
+
+
+class MidiState {
+public:
+    MidiState() { reset(); }
+
+    /* Update the state with a received MIDI message. */
+    void update(const unsigned char *message, size_t size) {
+        if (size < 2 || message[0] < 0x80 || message[0] >= 0xF0)
+            return;
+
+        std::lock_guard<std::mutex> lock(mutex_);
+        unsigned char ch = message[0] & 0x0F;
+        unsigned char data1 = message[1] & 0x7F;
+        unsigned char data2 = size > 2 ? message[2] & 0x7F : 0;
+
+        switch (message[0] & 0xF0) {
+            case 0x80:  // note off
+                data_.notes[ch][data1] = 0;
+                break;
+            case 0x90:  // note on, velocity 0 means note off
+                data_.notes[ch][data1] = data2;
+                break;
+            case 0xB0:
+                data_.cc[ch][data1] = data2;
+
+                // all sound off / all notes off
+                if (data1 == 120 || data1 == 123)
+                    memset(data_.notes[ch], 0, sizeof(data_.notes[ch]));
+                break;
+            case 0xC0:
+                data_.program[ch] = data1;
+                data_.bank[ch] = data_.cc[ch][0] << 7 | data_.cc[ch][32];
+                break;
+            case 0xD0:
+                data_.channel_pressure[ch] = data1;
+                break;
+            case 0xE0:
+                data_.pitch_bend[ch] = data2 << 7 | data1;
+                break;
+        }
+    }
+
+    /* Copy the current state to ``out``. */
+    void snapshot(MidiStateData &out) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        out = data_;
+    }
+
+    /* Return the current state. Single values can be read without a lock. */
+    const MidiStateData &data() const { return data_; }
+
+    void reset() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        memset(&data_, 0, sizeof(data_));
+
+        for (int ch = 0; ch < 16; ch++)
+            data_.pitch_bend[ch] = MIDI_STATE_PITCH_BEND_CENTER;
+    }
+
+private:
+    std::mutex mutex_;
+    MidiStateData data_;
+};
+
+#endif
@@ -0,0 +1,85 @@
+#ifndef MONOTONIC_CLOCK_H
+#define MONOTONIC_CLOCK_H
+/*
+ * Read the monotonic clock used by Python's ``time.monotonic_ns`` function.
+ *
+ * This can be called from threads not holding the GIL, e.g. the RtMidi
+ * backend thread receiving MIDI input. Python 3.13 exposes its monotonic
+ * clock as ``PyTime_MonotonicRaw``, for older versions we read the same clock
+ * directly (CLOCK_MONOTONIC on Linux and BSD, mach_absolute_time on macOS).
+ * On Windows, Python < 3.13 uses GetTickCount64 for ``time.monotonic``, which
+ * has a too low resolution for timestamping MIDI events, so we use the
+ * QueryPerformanceCounter like newer Python versions do.
+ *
+ * ``sleep_until_ns`` sleeps until an absolute time of the same clock, with the
+ * precision of the system timer, e.g. to send scheduled MIDI output.
+ */
+
+#include <Python.h>
+#include <cstdint>
+
+#if defined(_WIN32)
+#include <windows.h>
+#elif defined(__APPLE__)
+#include <mach/mach_time.h>
+#else
+#include <errno.h>
+#include <time.h>
+#endif
+
+static inline int64_t monotonic_ns() {
+#if !defined(PYPY_VERSION) && PY_VERSION_HEX >= 0x030D0000
+    PyTime_t t;
+
+    if (PyTime_MonotonicRaw(&t) == 0)
+        return t;
+#endif
+
+#if defined(_WIN32)
+    static LARGE_INTEGER freq = {{0, 0}};
+    LARGE_INTEGER count;
+
+    if (freq.QuadPart == 0)
+        QueryPerformanceFrequency(&freq);
+
+    QueryPerformanceCounter(&count);
+    return (int64_t)(count.QuadPart / freq.QuadPart * 1000000000 +
+                     count.QuadPart % freq.QuadPart * 1000000000 / freq.QuadPart);
+#elif defined(__APPLE__)
+    static mach_timebase_info_data_t timebase = {0, 0};
+
+    if (timebase.denom == 0)
+        mach_timebase_info(&timebase);
+
+    return (int64_t)(mach_absolute_time() * timebase.numer / timebase.denom);
+#else
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (int64_t)ts.tv_sec * 1000000000 + ts.tv_nsec;
+#endif
+}
+
+/* Sleep until ``monotonic_ns`` returns at least ``time``. */
+static inline void sleep_until_ns(int64_t time) {
+#if defined(_WIN32)
+    // Sleep has the resolution of the system timer (15.6 ms by default), so
+    // give up the time slice until the time has come.
+    while (monotonic_ns() < time)
+        SwitchToThread();
+#elif defined(__APPLE__)
+    static mach_timebase_info_data_t timebase = {0, 0};
+
+    if (timebase.denom == 0)
+        mach_timebase_info(&timebase);
+
+    mach_wait_until((uint64_t)time * timebase.denom / timebase.numer);
+#else
+    struct timespec ts;
+    ts.tv_sec = (time_t)(time / 1000000000);
+    ts.tv_nsec = (long)(time % 1000000000);
+
+    while (clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &ts, NULL) == EINTR) {}
+#endif
+}
+
+#endif
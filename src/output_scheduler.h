@@ -0,0 +1,322 @@
+#ifndef OUTPUT_SCHEDULER_H
+#define OUTPUT_SCHEDULER_H
+/*
+ * Native scheduler and rate limiter for MIDI output.
+ *
+ * ``MidiOut.send_message`` with a target time puts the message into a
+ * priority queue ordered by time, from which a native thread sends it when
+ * the time has come, so Python only has to queue messages ahead of time and
+ * the timing does not depend on the GIL or the garbage collector.
+ *
+ * The thread waits on a condition variable until shortly before the next
+ * message is due, so messages queued for an earlier time wake it up, and then
+ * sleeps until the exact target time with ``sleep_until_ns``, which is much
+ * more precise than the timeout of a condition variable.
+ *
+ * When an output rate is set, the thread also shapes the output to the
+ * bandwidth of the MIDI connection: it keeps track of the time until which
+ * the connection is busy transmitting the previous messages (plus an optional
+ * gap after System Exclusive messages) and delays the next message until
+ * then. Messages sent without a target time are then put into a FIFO queue,
+ * so they are sent in order, but never faster than the connection allows.
+ * Since the messages of this queue are sent in order, waiting for one of
+ * them to be sent with ``wait_sent`` only needs to compare its position with
+ * the number of messages sent so far.
+ */
+
+#include <algorithm>
+#include <chrono>
+#include <condition_variable>
+#include <cstddef>
+#include <cstdint>
+#include <deque>
+#include <mutex>
+#include <queue>
+#include <thread>
+#include <vector>
+
+#include "interpreter.h"
+#include "monotonic_clock.h"
+
+// time before a message is due, from which the thread sleeps until then
+// instead of waiting for new messages (2 ms)
+#define OUTPUT_SCHEDULER_SLACK 2000000LL
+
+struct ScheduledMessage {
+    int64_t time;
+    // queueing order, so messages with the same time are sent in order, or
+    // the position of a message queued with push_next
+    uint64_t seq;
+    std::vector<unsigned char> message;
+};
+
+struct ScheduledAfter {
+    bool operator()(const ScheduledMessage &a, const ScheduledMessage &b) const {
+        return a.time > b.time || (a.time == b.time && a.seq > b.seq);
+    }
+};
+
+/* Whether the calling thread is the thread of an OutputScheduler. */
+static inline bool &in_output_scheduler() {
+    static thread_local bool flag = false;
+    return flag;
+}
+
+
+class OutputScheduler {
+public:
+    typedef void (*SendFunc)(const unsigned char *message, size_t size, void *data);
+
+    /*
+     * Start the thread, which calls ``send`` for each message when it is due.
+     * The thread attaches to ``interp``, so the error callback called by
+     * ``send`` runs in the interpreter owning the ``MidiOut`` instance.
+     */
+    OutputScheduler(SendFunc send, void *data, PyInterpreterState *interp) :
+        send_(send), data_(data), interp_(interp), seq_(0), ns_per_byte_(0),
+        sysex_gap_(0), ready_(0), fifo_pushed_(0), fifo_done_(0), clears_(0),
+        waiters_(0), stopping_(false), thread_(&OutputScheduler::run, this) {}
+
+    /*
+     * Stop and join the thread, dropping all pending messages. Waits until
+     * all threads in ``wait_sent`` have returned. The GIL must not be held by
+     * the caller.
+     */
+    ~OutputScheduler() {
+        {
+            std::unique_lock<std::mutex> lock(mutex_);
+            stopping_ = true;
+            drop();
+            cond_.notify_one();
+            sent_cond_.wait(lock, [&] { return waiters_ == 0; });
+        }
+
+        thread_.join();
+    }
+
+    /* Queue a message to be sent at ``time``. */
+    void push(int64_t time, const unsigned char *message, size_t size) {
+        {
+            std::lock_guard<std::mutex> lock(mutex_);
+            ScheduledMessage scheduled = {time, seq_++,
+                                          std::vector<unsigned char>(message, message + size)};
+            queue_.push(std::move(scheduled));
+        }
+
+        cond_.notify_one();
+    }
+
+    /*
+     * Queue a message to be sent as soon as the output rate allows, after all
+     * messages queued with ``push_next`` before. Returns its position for
+     * ``wait_sent``.
+     */
+    uint64_t push_next(const unsigned char *message, size_t size) {
+        uint64_t position;
+
+        {
+            std::lock_guard<std::mutex> lock(mutex_);
+            position = fifo_pushed_++;
+            ScheduledMessage scheduled = {monotonic_ns(), position,
+                                          std::vector<unsigned char>(message, message + size)};
+            fifo_.push_back(std::move(scheduled));
+        }
+
+        cond_.notify_one();
+        return position;
+    }
+
+    /*
+     * Set the output rate in bytes per second (0 for no limit) and the gap
+     * after System Exclusive messages in nanoseconds.
+     */
+    void set_rate(double bytes_per_second, int64_t sysex_gap) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        ns_per_byte_ = bytes_per_second > 0 ? 1e9 / bytes_per_second : 0;
+        sysex_gap_ = sysex_gap;
+        cond_.notify_one();
+    }
+
+    /* Return the position, which the next message of ``push_next`` gets. */
+    uint64_t next_position() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return fifo_pushed_;
+    }
+
+    /*
+     * Return a token to pass to ``wait_sent``, which identifies the calls to
+     * ``clear`` made so far.
+     */
+    unsigned long clear_token() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return clears_;
+    }
+
+    /*
+     * Register a thread, which is going to call ``wait_sent``. Must be called
+     * while the caller ensures the scheduler is not deleted, so the
+     * destructor waits for the thread to return from ``wait_sent``.
+     */
+    void add_waiter() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        waiters_++;
+    }
+
+    /*
+     * Wait for at most ``timeout`` seconds until the message at ``position``
+     * of ``push_next`` has been sent, and unregister the thread registered
+     * with ``add_waiter``.
+     *
+     * Returns 1 if the message has been sent, 0 if the timeout expired and -1
+     * if ``clear`` was called since ``token`` was obtained, which may have
+     * dropped the message, or the scheduler is stopping.
+     */
+    int wait_sent(uint64_t position, double timeout, unsigned long token) {
+        std::unique_lock<std::mutex> lock(mutex_);
+        sent_cond_.wait_for(lock, std::chrono::duration<double>(timeout), [&] {
+            return fifo_done_ > position || clears_ != token || stopping_;
+        });
+
+        waiters_--;
+        sent_cond_.notify_all();
+
+        if (clears_ != token || stopping_)
+            return -1;
+
+        return fifo_done_ > position ? 1 : 0;
+    }
+
+    /* Drop all pending messages and return their number. */
+    size_t clear() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return drop();
+    }
+
+    size_t size() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return queue_.size() + fifo_.size();
+    }
+
+private:
+    typedef std::priority_queue<ScheduledMessage, std::vector<ScheduledMessage>,
+                                ScheduledAfter> queue_type;
+
+    /* Drop all pending messages. Needs the lock. */
+    size_t drop() {
+        size_t count = queue_.size() + fifo_.size();
+        queue_type().swap(queue_);
+        fifo_.clear();
+        fifo_done_ = fifo_pushed_;
+        clears_++;
+        sent_cond_.notify_all();
+        return count;
+    }
+
+    /*
+     * Return the queue with the next message, the FIFO on a tie, or NULL if
+     * both are empty. Needs the lock.
+     */
+    const ScheduledMessage *next(bool &from_fifo) {
+        from_fifo = !fifo_.empty() &&
+            (queue_.empty() || fifo_.front().time <= queue_.top().time);
+
+        if (from_fifo)
+            return &fifo_.front();
+
+        return queue_.empty() ? NULL : &queue_.top();
+    }
+
+    void run() {
+        // Keep a thread state of a sub-interpreter for the lifetime of the
+        // thread, which the error callback picks up.
+        PyThreadState *tstate = interpreter_attach(interp_);
+
+        if (tstate != NULL)
+            PyEval_SaveThread();
+
+        in_output_scheduler() = true;
+        std::vector<unsigned char> message;
+        std::unique_lock<std::mutex> lock(mutex_);
+        bool from_fifo;
+
+        while (!stopping_) {
+            const ScheduledMessage *scheduled = next(from_fifo);
+
+            if (scheduled == NULL) {
+                cond_.wait(lock);
+                continue;
+            }
+
+            // wait until the connection has transmitted the previous messages
+            int64_t time = std::max(scheduled->time, ready_);
+            int64_t now = monotonic_ns();
+
+            if (time - now > OUTPUT_SCHEDULER_SLACK) {
+                cond_.wait_for(lock, std::chrono::nanoseconds(time - now - OUTPUT_SCHEDULER_SLACK));
+                continue;
+            } else if (time > now) {
+                lock.unlock();
+                sleep_until_ns(time);
+                lock.lock();
+                continue;
+            }
+
+            // the message is moved out, since it is removed right away
+            message.swap(const_cast<ScheduledMessage *>(scheduled)->message);
+            uint64_t position = scheduled->seq;
+
+            if (from_fifo)
+                fifo_.pop_front();
+            else
+                queue_.pop();
+
+            // Transmission starts at the due time, unless the thread is late
+            // by more than the slack, which would allow a burst of messages.
+            ready_ = std::max(time, (int64_t)(now - OUTPUT_SCHEDULER_SLACK)) +
+                (int64_t)(message.size() * ns_per_byte_);
+
+            if (!message.empty() && message[0] == 0xF0)
+                ready_ += sysex_gap_;
+
+            lock.unlock();
+            send_(message.data(), message.size(), data_);
+            lock.lock();
+
+            if (from_fifo) {
+                // clear may have skipped past the message in the meantime
+                fifo_done_ = std::max(fifo_done_, position + 1);
+                sent_cond_.notify_all();
+            }
+        }
+
+        lock.unlock();
+
+        if (tstate != NULL) {
+            PyEval_RestoreThread(tstate);
+            interpreter_detach(tstate);
+        }
+    }
+
+    SendFunc send_;
+    void *data_;
+    PyInterpreterState *interp_;
+    uint64_t seq_;
+    double ns_per_byte_;
+    int64_t sysex_gap_;
+    // time until which the connection is busy with the messages sent so far
+    int64_t ready_;
+    // number of messages queued with push_next and of those sent or dropped
+    uint64_t fifo_pushed_;
+    uint64_t fifo_done_;
+    unsigned long clears_;
+    int waiters_;
+    bool stopping_;
+    queue_type queue_;
+    std::deque<ScheduledMessage> fifo_;
+    std::mutex mutex_;
+    std::condition_variable cond_;
+    std::condition_variable sent_cond_;
+    std::thread thread_;
+};
+
+#endif
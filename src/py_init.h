@@ -1,12 +1,14 @@
 #include <Python.h>
  /*
-  * This code initializes Python threads and GIL, because RtMidi calls Python
-  * from native threads.
+  * This code initializes Python threads and GIL on PyPy, because RtMidi calls
+  * Python from native threads.
   *
   * See http://permalink.gmane.org/gmane.comp.python.cython.user/5837
   *
-  * *PyEval_InitThreads* is a no-op since Python.37 and deprecated since
-  * Python 3.6. Now *Py_Initialize* initializes the GIL.
+  * On CPython, the GIL is always initialized by *Py_Initialize* since Python
+  * 3.7, which has been run by the interpreter importing the module, so there
+  * is nothing to do. In particular, nothing may be initialized globally here,
+  * since the module may be imported by several (sub-)interpreters.
   *
   * The calls are in this separate C file instead of in the main .pyx file so
   * that we can use pre-compiler conditionals and don't get a compiler
@@ -14,9 +16,7 @@
   */
 
  void py_init() {
-     #if !defined(PYPY_VERSION) and PY_MAJOR_VERSION >= 3 and PY_MINOR_VERSION >= 7
-         Py_Initialize();
-     #else
+     #if defined(PYPY_VERSION)
          PyEval_InitThreads();
      #endif
- } 
+ }
@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 """Unit tests for the rtmidi module."""
 
+import array
+import asyncio
+import select
+import struct
+import threading
 import time
 import unittest
 
@@ -9,6 +14,25 @@ import pytest
 import rtmidi
 
 
+# Run in a sub-interpreter by test_callback_in_subinterpreter
+SUBINTERPRETER_CODE = """
+import time
+import rtmidi
+
+received = []
+midi_in = rtmidi.MidiIn({api})
+midi_in.open_port(midi_in.get_ports().index({port!r}))
+midi_in.set_callback(lambda events, data: received.extend(events), batch=True)
+deadline = time.monotonic() + 1.0
+
+while not received and time.monotonic() < deadline:
+    time.sleep(0.01)
+
+midi_in.close_port()
+assert [event[0] for event in received] == [{message!r}], received
+"""
+
+
 class BaseTests:
     NOTE_ON = [0x90, 48, 100]
     NOTE_OFF = [0x80, 48, 16]
@@ -43,6 +67,20 @@ class BaseTests:
         self.midi_out.close_port()
         assert not self.midi_out.is_port_open()
 
+    def test_iterate_stops_if_port_not_open(self):
+        self.assertEqual(list(self.midi_in), [])
+        self.assertIsNone(self.midi_in.get_message(timeout=None))
+
+        with rtmidi.MidiInGroup([self.midi_in]) as group:
+            self.assertEqual(list(group), [])
+            self.assertIsNone(group.get_message(timeout=None))
+
+    def test_async_iterate_stops_if_port_not_open(self):
+        async def receive():
+            return await self.midi_in.receive(), [event async for event in self.midi_in]
+
+        self.assertEqual(asyncio.run(receive()), ([], []))
+
     def test_get_current_api(self):
         assert self.midi_in.get_current_api() == self.API
         assert self.midi_out.get_current_api() == self.API
@@ -75,6 +113,399 @@ class VirtualPortsSupportedTests:
         self.assertEqual(event_1[0], self.NOTE_ON)
         self.assertEqual(event_2[0], self.NOTE_OFF)
 
+    def test_get_messages(self):
+        self.set_up_loopback()
+        self.assertEqual(self.midi_in.get_messages(), [])
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message(self.NOTE_OFF)
+        self.midi_out.send_message(self.NOTE_ON)
+        time.sleep(self.DELAY)
+        events = self.midi_in.get_messages(max_count=2)
+        self.assertEqual([event[0] for event in events], [self.NOTE_ON, self.NOTE_OFF])
+        events = self.midi_in.get_messages()
+        self.assertEqual([event[0] for event in events], [self.NOTE_ON])
+        self.assertTrue(isinstance(events[0][1], float))
+        self.assertEqual(self.midi_in.get_messages(), [])
+
+    def test_get_messages_invalid_max_count(self):
+        self.assertRaises(ValueError, self.midi_in.get_messages, 0)
+
+    def test_get_message_timeout(self):
+        self.set_up_loopback()
+        start = time.monotonic()
+        self.assertIsNone(self.midi_in.get_message(timeout=self.DELAY))
+        self.assertGreaterEqual(time.monotonic() - start, self.DELAY)
+
+        timer = threading.Timer(self.DELAY, self.midi_out.send_message, args=(self.NOTE_ON,))
+        timer.start()
+        event = self.midi_in.get_message(timeout=None)
+        timer.join()
+        self.assertEqual(event[0], self.NOTE_ON)
+
+    def test_get_message_invalid_timeout(self):
+        self.assertRaises(ValueError, self.midi_in.get_message, timeout=-1)
+
+    def test_iterate(self):
+        self.set_up_loopback()
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message(self.NOTE_OFF)
+        timer = threading.Timer(self.DELAY, self.midi_in.close_port)
+        timer.start()
+        events = list(self.midi_in)
+        timer.join()
+        self.assertEqual([event[0] for event in events], [self.NOTE_ON, self.NOTE_OFF])
+
+    def test_set_timestamps(self):
+        self.set_up_loopback()
+        self.midi_in.set_timestamps()
+        before = time.monotonic_ns()
+        self.midi_out.send_message(self.NOTE_ON)
+        event = self.midi_in.get_message(timeout=self.DELAY)
+        after = time.monotonic_ns()
+        self.assertEqual(len(event), 3)
+        self.assertEqual(event[0], self.NOTE_ON)
+        self.assertTrue(isinstance(event[2], int))
+        self.assertTrue(before <= event[2] <= after)
+
+        self.midi_in.set_timestamps(False)
+        self.midi_out.send_message(self.NOTE_OFF)
+        self.assertEqual(len(self.midi_in.get_message(timeout=self.DELAY)), 2)
+
+    def test_set_bytes_messages(self):
+        self.set_up_loopback()
+        self.midi_in.ignore_types(sysex=False)
+        self.midi_in.set_bytes_messages()
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message(self.SYSEX_IDENTITY_REQUEST)
+        time.sleep(self.DELAY)
+        message, delta = self.midi_in.get_message()
+        self.assertTrue(isinstance(message, bytes))
+        self.assertEqual(message, bytes(self.NOTE_ON))
+        message, delta = self.midi_in.get_message()
+        self.assertEqual(message, bytes(self.SYSEX_IDENTITY_REQUEST))
+
+        self.midi_in.set_bytes_messages(False)
+        self.midi_out.send_message(self.NOTE_OFF)
+        message, delta = self.midi_in.get_message(timeout=self.DELAY)
+        self.assertEqual(message, self.NOTE_OFF)
+
+    def test_track_state(self):
+        self.set_up_loopback()
+        tracker = self.midi_in.track_state()
+        self.assertTrue(isinstance(tracker, rtmidi.MidiStateTracker))
+        self.assertTrue(tracker is self.midi_in.track_state())
+        self.midi_out.send_message([0xB1, 7, 100])
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message([0xE0, 0, 0x50])
+        self.midi_out.send_message([0xC0, 5])
+        time.sleep(self.DELAY)
+        self.assertEqual(tracker.cc(1, 7), 100)
+        self.assertEqual(tracker.note(0, self.NOTE_ON[1]), self.NOTE_ON[2])
+        self.assertEqual(tracker.held_notes(0), [tuple(self.NOTE_ON[1:])])
+        self.assertEqual(tracker.pitch_bend(0), 0x50 << 7)
+        self.assertEqual(tracker.program(0), 5)
+        self.assertEqual(len(tracker.snapshot()), rtmidi.MIDI_STATE_SIZE)
+        self.assertRaises(ValueError, tracker.cc, 16, 7)
+
+        self.midi_out.send_message(self.NOTE_OFF)
+        time.sleep(self.DELAY)
+        self.assertEqual(tracker.held_notes(0), [])
+
+        self.assertTrue(self.midi_in.track_state(False) is None)
+        self.midi_out.send_message([0xB1, 7, 1])
+        time.sleep(self.DELAY)
+        self.assertEqual(tracker.cc(1, 7), 100)
+
+    def test_track_clock(self):
+        self.set_up_loopback()
+        clock = self.midi_in.track_clock()
+        self.assertTrue(isinstance(clock, rtmidi.MidiClockTracker))
+        self.assertTrue(clock is self.midi_in.track_clock())
+        self.assertTrue(clock.bpm is None)
+        self.assertFalse(clock.sync)
+        self.midi_out.send_message([0xFA])
+
+        for i in range(25):
+            self.midi_out.send_message([0xF8])
+            time.sleep(0.01)
+
+        time.sleep(self.DELAY)
+        self.assertTrue(clock.running)
+        self.assertTrue(clock.sync)
+        self.assertTrue(100 < clock.bpm < 300)
+        self.assertEqual(clock.ticks, 24)
+        self.assertEqual(clock.beat, 1)
+        self.assertEqual(clock.song_position, 4)
+        # clock ticks are still filtered by default
+        self.assertEqual([event[0] for event in self.midi_in.get_messages()], [[0xFA]])
+
+        self.midi_out.send_message([0xFC])
+        self.midi_out.send_message([0xF2, 8, 0])
+        time.sleep(self.DELAY)
+        self.assertFalse(clock.running)
+        self.assertEqual(clock.song_position, 8)
+
+        self.assertTrue(self.midi_in.track_clock(False) is None)
+
+    def test_set_param_decoding(self):
+        self.set_up_loopback()
+        self.midi_in.set_param_decoding(controllers=[1])
+        # RPN 0 (pitch bend sensitivity) = 2 semitones, 50 cents
+        for cc, value in ((101, 0), (100, 0), (6, 2), (38, 50), (96, 0)):
+            self.midi_out.send_message([0xB2, cc, value])
+        # NRPN 1/5 = 64 (MSB only)
+        for cc, value in ((99, 1), (98, 5), (6, 64)):
+            self.midi_out.send_message([0xB2, cc, value])
+        # 14-bit modulation
+        self.midi_out.send_message([0xB3, 1, 10])
+        self.midi_out.send_message([0xB3, 33, 3])
+        self.midi_out.send_message(self.NOTE_ON)
+        time.sleep(self.DELAY)
+        messages = [event[0] for event in self.midi_in.get_messages()]
+        self.assertEqual(messages, [
+            rtmidi.ParamChange(rtmidi.PARAM_RPN, 2, 0, 2 << 7),
+            rtmidi.ParamChange(rtmidi.PARAM_RPN, 2, 0, 2 << 7 | 50),
+            rtmidi.ParamChange(rtmidi.PARAM_RPN, 2, 0, 2 << 7 | 51),
+            rtmidi.ParamChange(rtmidi.PARAM_NRPN, 2, 1 << 7 | 5, 64 << 7),
+            rtmidi.ParamChange(rtmidi.PARAM_CONTROLLER, 3, 1, 10 << 7),
+            rtmidi.ParamChange(rtmidi.PARAM_CONTROLLER, 3, 1, 10 << 7 | 3),
+            self.NOTE_ON,
+        ])
+
+        self.midi_in.set_param_decoding(rpn=False, nrpn=False)
+        self.midi_out.send_message([0xB2, 101, 0])
+        time.sleep(self.DELAY)
+        self.assertEqual(self.midi_in.get_message()[0], [0xB2, 101, 0])
+        self.assertRaises(ValueError, self.midi_in.set_param_decoding, controllers=[32])
+
+    def test_set_coalescing(self):
+        self.set_up_loopback()
+        self.midi_in.set_coalescing()
+        self.midi_out.send_message([0xB0, 7, 1])
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message([0xB0, 7, 2])
+        self.midi_out.send_message([0xB0, 1, 3])
+        self.midi_out.send_message([0xE0, 0, 64])
+        self.midi_out.send_message([0xE0, 0, 65])
+        self.midi_out.send_message(self.NOTE_OFF)
+        time.sleep(self.DELAY)
+        messages = [event[0] for event in self.midi_in.get_messages()]
+        self.assertEqual(messages, [[0xB0, 7, 2], self.NOTE_ON, [0xB0, 1, 3],
+                                    [0xE0, 0, 65], self.NOTE_OFF])
+
+        self.midi_in.set_coalescing(False)
+        self.midi_out.send_message([0xB0, 7, 1])
+        self.midi_out.send_message([0xB0, 7, 2])
+        time.sleep(self.DELAY)
+        self.assertEqual(len(self.midi_in.get_messages()), 2)
+
+    def test_set_callback_for(self):
+        self.set_up_loopback()
+        note_on = []
+        cc = []
+        self.midi_in.set_callback_for(0x90, lambda event, data: note_on.append((event[0], data)),
+                                      data=42)
+        self.midi_in.set_callback_for(0xB0, lambda event, data: cc.append(event[0]), channel=1)
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message([0xB0, 7, 100])
+        self.midi_out.send_message([0xB1, 7, 100])
+        self.midi_out.send_message(self.NOTE_OFF)
+        time.sleep(self.DELAY)
+        self.assertEqual(note_on, [(self.NOTE_ON, 42)])
+        self.assertEqual(cc, [[0xB1, 7, 100]])
+        messages = [event[0] for event in self.midi_in.get_messages()]
+        self.assertEqual(messages, [[0xB0, 7, 100], self.NOTE_OFF])
+
+        self.midi_in.set_callback_for(0x90, None)
+        self.midi_out.send_message(self.NOTE_ON)
+        time.sleep(self.DELAY)
+        self.assertEqual(len(note_on), 1)
+        self.assertEqual(self.midi_in.get_message()[0], self.NOTE_ON)
+
+        self.assertRaises(ValueError, self.midi_in.set_callback_for, 0x40, None)
+        self.assertRaises(ValueError, self.midi_in.set_callback_for, 0x93, None, channel=2)
+        self.assertRaises(ValueError, self.midi_in.set_callback_for, 0x90, None, channel=16)
+
+    @pytest.mark.filterwarnings("ignore::pytest.PytestUnraisableExceptionWarning")
+    def test_callback_for_raising_does_not_pass_on_message(self):
+        def handler(event, data):
+            raise RuntimeError("handler failed")
+
+        self.set_up_loopback()
+        self.midi_in.set_callback_for(0x90, handler)
+        self.midi_out.send_message(self.NOTE_ON)
+        time.sleep(self.DELAY)
+        self.assertEqual(self.midi_in.get_messages(), [])
+
+    def test_midi_in_group(self):
+        self.set_up_loopback()
+        midi_in2 = rtmidi.MidiIn(self.API)
+        midi_in2.open_port(self.midi_in.get_ports().index(self.midi_out_port_name))
+
+        try:
+            group = rtmidi.MidiInGroup([self.midi_in, midi_in2])
+            self.assertEqual(group.inputs, (self.midi_in, midi_in2))
+            self.assertRaises(rtmidi.InvalidUseError, rtmidi.MidiInGroup, [midi_in2])
+            self.midi_out.send_message(self.NOTE_ON)
+            time.sleep(self.DELAY)
+            events = group.get_messages()
+            self.assertEqual(sorted(event[0] for event in events), [0, 1])
+            self.assertEqual([event[1][0] for event in events], [self.NOTE_ON] * 2)
+            self.assertTrue(self.midi_in.get_message() is None)
+
+            received = []
+            group.set_callback(lambda event, data: received.append(event))
+            self.midi_out.send_message(self.NOTE_OFF)
+            time.sleep(self.DELAY)
+            self.assertEqual(len(received), 2)
+
+            group.close()
+            self.assertEqual(group.inputs, ())
+            self.midi_out.send_message(self.NOTE_ON)
+            time.sleep(self.DELAY)
+            self.assertEqual(self.midi_in.get_message()[0], self.NOTE_ON)
+            self.assertTrue(group.get_message() is None)
+        finally:
+            midi_in2.close_port()
+            del midi_in2
+
+    @pytest.mark.filterwarnings("ignore::pytest.PytestUnraisableExceptionWarning")
+    def test_midi_in_group_callback_raising_or_closing(self):
+        self.set_up_loopback()
+        midi_in2 = rtmidi.MidiIn(self.API)
+        midi_in2.open_port(self.midi_in.get_ports().index(self.midi_out_port_name))
+        received = []
+
+        def raising(event, data):
+            received.append(event)
+            raise RuntimeError("callback failed")
+
+        def closing(event, data):
+            received.append(event)
+            group.close()
+
+        try:
+            group = rtmidi.MidiInGroup([self.midi_in, midi_in2])
+            group.set_callback(raising)
+            self.midi_out.send_message(self.NOTE_ON)
+            time.sleep(self.DELAY)
+            self.assertEqual(len(received), 2)
+
+            del received[:]
+            group.set_callback(closing)
+            self.midi_out.send_message(self.NOTE_OFF)
+            time.sleep(self.DELAY)
+            self.assertEqual(len(received), 1)
+            self.assertEqual(group.inputs, ())
+        finally:
+            midi_in2.close_port()
+            del midi_in2
+
+    def test_stats(self):
+        self.set_up_loopback()
+        self.midi_in.set_filter(types=[0x90])
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message(self.NOTE_OFF)
+        time.sleep(self.DELAY)
+        stats = self.midi_in.stats()
+        self.assertEqual(stats['received'], 2)
+        self.assertEqual(stats['filtered'], 1)
+        self.assertEqual(stats['dropped'], 0)
+        self.assertEqual(stats['queued'], 1)
+        self.assertEqual(stats['max_queued'], 1)
+        self.assertEqual(stats['bytes'], 6)
+
+        self.midi_in.get_message()
+        self.midi_in.set_callback(lambda event, data: None)
+        self.midi_out.send_message(self.NOTE_ON)
+        time.sleep(self.DELAY)
+        stats = self.midi_in.stats()
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['callbacks'], 1)
+        self.assertTrue(stats['callback_time'] >= stats['max_callback_time'] > 0)
+
+        self.midi_in.reset_stats()
+        stats = self.midi_in.stats()
+        self.assertEqual(stats['received'], 0)
+        self.assertEqual(stats['callbacks'], 0)
+        self.assertEqual(stats['max_queued'], 0)
+
+    def test_readinto(self):
+        self.set_up_loopback()
+        self.midi_in.ignore_types(sysex=False)
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message(self.SYSEX_IDENTITY_REQUEST)
+        self.midi_out.send_message(self.NOTE_OFF)
+        time.sleep(self.DELAY)
+        buf = bytearray(rtmidi.MIDI_RECORD_SIZE * 4)
+        sysex_buf = bytearray(16)
+        count = self.midi_in.readinto(buf, sysex_buf)
+        self.assertEqual(count, 3)
+        records = list(struct.iter_unpack(rtmidi.MIDI_RECORD_FORMAT,
+                                          buf[:count * rtmidi.MIDI_RECORD_SIZE]))
+        self.assertEqual(records[0][1:], (3, 0) + tuple(self.NOTE_ON))
+        self.assertEqual(records[1][1:], (len(self.SYSEX_IDENTITY_REQUEST), 0, 0xF0, 0, 0))
+        self.assertEqual(records[2][1:], (3, 0) + tuple(self.NOTE_OFF))
+        self.assertTrue(records[0][0] <= records[1][0] <= records[2][0])
+        self.assertEqual(list(sysex_buf[:len(self.SYSEX_IDENTITY_REQUEST)]),
+                         self.SYSEX_IDENTITY_REQUEST)
+        self.assertEqual(self.midi_in.readinto(buf), 0)
+
+    def test_readinto_sysex_does_not_fit(self):
+        self.set_up_loopback()
+        self.midi_in.ignore_types(sysex=False)
+        self.midi_out.send_message(self.SYSEX_IDENTITY_REQUEST)
+        time.sleep(self.DELAY)
+        buf = bytearray(rtmidi.MIDI_RECORD_SIZE)
+        self.assertRaises(ValueError, self.midi_in.readinto, buf)
+        self.assertRaises(ValueError, self.midi_in.readinto, buf, bytearray(2))
+        self.assertEqual(self.midi_in.get_message()[0], self.SYSEX_IDENTITY_REQUEST)
+
+    def test_set_filter(self):
+        control_change = [0xB0, 7, 100]
+        self.set_up_loopback()
+        self.midi_in.set_filter(types=[0xB0], channels=[0], controllers=[7])
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message([0xB0, 10, 64])
+        self.midi_out.send_message([0xB1, 7, 64])
+        self.midi_out.send_message(control_change)
+        time.sleep(self.DELAY)
+        self.assertEqual([event[0] for event in self.midi_in.get_messages()], [control_change])
+
+        self.midi_in.set_filter()
+        self.midi_out.send_message(self.NOTE_ON)
+        time.sleep(self.DELAY)
+        self.assertEqual(self.midi_in.get_message()[0], self.NOTE_ON)
+
+    def test_set_filter_invalid_values(self):
+        self.assertRaises(ValueError, self.midi_in.set_filter, types=[0x91])
+        self.assertRaises(ValueError, self.midi_in.set_filter, types=[0x7F])
+        self.assertRaises(ValueError, self.midi_in.set_filter, channels=[16])
+        self.assertRaises(ValueError, self.midi_in.set_filter, controllers=[128])
+
+    def test_fileno(self):
+        self.set_up_loopback()
+        fd = self.midi_in.fileno()
+        self.assertEqual(select.select([fd], [], [], 0)[0], [])
+        self.midi_out.send_message(self.NOTE_ON)
+        self.assertEqual(select.select([fd], [], [], self.DELAY)[0], [fd])
+        self.midi_in.get_messages()
+        self.assertEqual(select.select([fd], [], [], 0)[0], [])
+
+    def test_receive(self):
+        async def receive():
+            loop = asyncio.get_running_loop()
+            loop.call_later(self.DELAY, self.midi_out.send_message, self.NOTE_ON)
+            events = await self.midi_in.receive()
+            loop.call_later(self.DELAY, self.midi_in.close_port)
+            self.midi_out.send_message(self.NOTE_OFF)
+            return events, [event async for event in self.midi_in]
+
+        self.set_up_loopback()
+        events, iterated = asyncio.run(receive())
+        self.assertEqual([event[0] for event in events], [self.NOTE_ON])
+        self.assertEqual([event[0] for event in iterated], [self.NOTE_OFF])
+
     def test_send_supports_iterator(self):
         self.set_up_loopback()
         self.midi_out.send_message(iter(self.NOTE_ON))
@@ -89,6 +520,26 @@ class VirtualPortsSupportedTests:
     def test_send_raises_if_message_empty(self):
         self.assertRaises(ValueError, self.midi_out.send_message, [])
         self.assertRaises(ValueError, self.midi_out.send_message, iter([]))
+        self.assertRaises(ValueError, self.midi_out.send_message, b'')
+
+    def test_typed_senders_raise_if_value_out_of_range(self):
+        self.assertRaises(ValueError, self.midi_out.send_note_on, 16, 60)
+        self.assertRaises(ValueError, self.midi_out.send_note_off, 0, 128)
+        self.assertRaises(ValueError, self.midi_out.send_cc, 0, 7, -1)
+        self.assertRaises(ValueError, self.midi_out.send_pitch_bend, 0, 16384)
+        self.assertRaises(ValueError, self.midi_out.send_nrpn, 0, 16384, 0)
+
+    def test_send_sysex_stream_raises_if_message_unterminated(self):
+        self.assertRaises(ValueError, self.midi_out.send_sysex_stream, b'\xF0\x7E\x7F')
+        self.assertRaises(ValueError, self.midi_out.send_sysex_stream, b'\xF0\x7E\x90\xF7')
+
+    def test_set_output_rate_raises_if_value_invalid(self):
+        self.assertRaises(ValueError, self.midi_out.set_output_rate, 0)
+        self.assertRaises(ValueError, self.midi_out.set_output_rate, sysex_gap=-1)
+
+    def test_send_buffer_raises_if_message_too_long(self):
+        self.assertRaises(ValueError, self.midi_out.send_message, b'\x01\x02\x03\x04')
+        self.assertRaises(ValueError, self.midi_out.send_message, bytearray([1, 2, 3, 4]))
 
     def test_send_accepts_sysex(self):
         self.set_up_loopback()
@@ -99,6 +550,125 @@ class VirtualPortsSupportedTests:
         self.assertTrue(isinstance(event, tuple))
         self.assertEqual(event[0], self.SYSEX_IDENTITY_REQUEST)
 
+    def test_send_accepts_buffers(self):
+        self.set_up_loopback()
+        self.midi_in.ignore_types(sysex=False)
+        self.midi_out.send_message(bytes(self.NOTE_ON))
+        self.midi_out.send_message(bytearray(self.NOTE_OFF))
+        self.midi_out.send_message(memoryview(bytes(self.SYSEX_IDENTITY_REQUEST)))
+        self.midi_out.send_message(array.array('B', self.NOTE_ON))
+        # not a buffer of unsigned bytes, sent element by element
+        self.midi_out.send_message(array.array('H', self.NOTE_OFF))
+        time.sleep(self.DELAY)
+        self.assertEqual([event[0] for event in self.midi_in.get_messages()],
+                         [self.NOTE_ON, self.NOTE_OFF, self.SYSEX_IDENTITY_REQUEST,
+                          self.NOTE_ON, self.NOTE_OFF])
+
+    def test_send_accepts_non_contiguous_arrays(self):
+        np = pytest.importorskip('numpy')
+        self.set_up_loopback()
+        # sent element by element
+        self.midi_out.send_message(np.array([0x90, 0, 48, 0, 100, 0], dtype=np.uint8)[::2])
+        time.sleep(self.DELAY)
+        self.assertEqual(self.midi_in.get_message()[0], self.NOTE_ON)
+
+    def test_typed_senders(self):
+        self.set_up_loopback()
+        self.midi_out.send_note_on(0, 48, 100)
+        self.midi_out.send_note_off(0, 48, 16)
+        self.midi_out.send_poly_pressure(1, 60, 20)
+        self.midi_out.send_cc(2, 7, 100)
+        self.midi_out.send_program_change(3, 5)
+        self.midi_out.send_channel_pressure(4, 30)
+        self.midi_out.send_pitch_bend(5, 0x2010)
+        self.midi_out.send_rpn(6, 0, 2 << 7)
+        self.midi_out.send_nrpn(7, 0x1234, 0x0FFF)
+        time.sleep(self.DELAY)
+        self.assertEqual([event[0] for event in self.midi_in.get_messages()], [
+            self.NOTE_ON, self.NOTE_OFF, [0xA1, 60, 20], [0xB2, 7, 100], [0xC3, 5],
+            [0xD4, 30], [0xE5, 0x10, 0x40],
+            [0xB6, 101, 0], [0xB6, 100, 0], [0xB6, 6, 2], [0xB6, 38, 0],
+            [0xB7, 99, 0x24], [0xB7, 98, 0x34], [0xB7, 6, 0x1F], [0xB7, 38, 0x7F],
+        ])
+
+    def test_send_message_at(self):
+        self.set_up_loopback()
+        self.midi_in.set_timestamps(True)
+        start = time.monotonic_ns()
+        self.midi_out.send_message(self.NOTE_OFF, at=start + 20_000_000)
+        self.midi_out.send_message(bytes(self.NOTE_ON), at=start + 10_000_000)
+        self.assertEqual(self.midi_out.get_scheduled_count(), 2)
+        time.sleep(self.DELAY + 0.02)
+        events = self.midi_in.get_messages()
+        self.assertEqual([event[0] for event in events], [self.NOTE_ON, self.NOTE_OFF])
+        self.assertGreaterEqual(events[0][2], start + 10_000_000)
+        self.assertGreaterEqual(events[1][2], start + 20_000_000)
+        self.assertEqual(self.midi_out.get_scheduled_count(), 0)
+
+    def test_cancel_scheduled(self):
+        self.set_up_loopback()
+        self.midi_out.send_message(self.NOTE_ON, at=time.monotonic_ns() + 10**9)
+        self.assertEqual(self.midi_out.cancel_scheduled(), 1)
+        self.midi_out.send_message(self.NOTE_ON, at=time.monotonic_ns() + 10**9)
+        self.midi_out.close_port()
+        self.assertEqual(self.midi_out.get_scheduled_count(), 0)
+        self.assertRaises(TypeError, self.midi_out.send_message, self.NOTE_ON,
+                          at=time.monotonic())
+        time.sleep(self.DELAY)
+        self.assertEqual(self.midi_in.get_messages(), [])
+
+    def test_set_output_rate(self):
+        self.set_up_loopback()
+        self.midi_out.set_output_rate(rtmidi.DIN_MIDI_BYTE_RATE)
+        start = time.perf_counter()
+
+        for _ in range(10):
+            self.midi_out.send_message(self.NOTE_ON)
+
+        self.assertTrue(self.midi_out.flush_output(timeout=1.0))
+        self.assertGreaterEqual(time.perf_counter() - start, 27 / rtmidi.DIN_MIDI_BYTE_RATE)
+        self.midi_out.set_output_rate()
+        time.sleep(self.DELAY)
+        self.assertEqual([event[0] for event in self.midi_in.get_messages()], [self.NOTE_ON] * 10)
+
+    def test_send_sysex_stream(self):
+        self.set_up_loopback()
+        self.midi_in.ignore_types(sysex=False)
+        self.midi_out.set_output_rate(sysex_gap=0.01)
+        progress = []
+        data = b'\x00' + bytes(self.SYSEX_IDENTITY_REQUEST) * 2 + b'\x00'
+        sent = self.midi_out.send_sysex_stream(data, lambda *args: progress.append(args))
+        self.assertEqual(sent, 2)
+        self.assertEqual(progress, [(6, 12), (12, 12)])
+        time.sleep(self.DELAY)
+        self.assertEqual([event[0] for event in self.midi_in.get_messages()],
+                         [self.SYSEX_IDENTITY_REQUEST] * 2)
+
+    def test_send_messages(self):
+        self.set_up_loopback()
+        self.midi_in.ignore_types(sysex=False)
+        messages = [self.NOTE_ON, bytes(self.SYSEX_IDENTITY_REQUEST), iter(self.NOTE_OFF)]
+        self.assertEqual(self.midi_out.send_messages(messages), 3)
+        self.assertEqual(self.midi_out.send_messages(bytes(self.NOTE_ON + [0xC0, 5]), [3, 2]), 2)
+        rows = memoryview(bytes(self.NOTE_ON + self.NOTE_OFF)).cast('B', (2, 3))
+        self.assertEqual(self.midi_out.send_messages(rows), 2)
+        rows = memoryview(bytes([0xC0, 5, 0] + self.NOTE_OFF)).cast('B', (2, 3))
+        self.assertEqual(self.midi_out.send_messages(rows, lengths=[2, 3]), 2)
+        time.sleep(self.DELAY)
+        self.assertEqual([event[0] for event in self.midi_in.get_messages()],
+                         [self.NOTE_ON, self.SYSEX_IDENTITY_REQUEST, self.NOTE_OFF,
+                          self.NOTE_ON, [0xC0, 5], self.NOTE_ON, self.NOTE_OFF,
+                          [0xC0, 5], self.NOTE_OFF])
+
+    def test_send_messages_checks_all_messages_first(self):
+        self.set_up_loopback()
+        self.assertRaises(ValueError, self.midi_out.send_messages, [self.NOTE_ON, []])
+        self.assertRaises(ValueError, self.midi_out.send_messages, bytes(self.NOTE_ON), [2])
+        self.assertRaises(ValueError, self.midi_out.send_messages, bytes(self.NOTE_ON))
+        self.assertRaises(TypeError, self.midi_out.send_messages, [self.NOTE_ON], [3])
+        time.sleep(self.DELAY)
+        self.assertEqual(self.midi_in.get_messages(), [])
+
     def test_callback(self):
         messages = []
 
@@ -120,6 +690,263 @@ class VirtualPortsSupportedTests:
         time.sleep(self.DELAY)
         self.assertEqual(messages, [])
 
+    @pytest.mark.filterwarnings("ignore::pytest.PytestUnraisableExceptionWarning")
+    def test_callback_raising_does_not_queue_message(self):
+        def callback(event, data):
+            raise RuntimeError("callback failed")
+
+        self.set_up_loopback()
+        self.midi_in.set_callback(callback)
+        self.midi_out.send_message(self.NOTE_ON)
+        time.sleep(self.DELAY)
+        self.midi_in.cancel_callback()
+        self.assertEqual(self.midi_in.get_messages(), [])
+
+    def test_callback_raw(self):
+        received = []
+
+        def callback(*args):
+            received.append(args)
+
+        self.set_up_loopback()
+        self.midi_in.ignore_types(sysex=False)
+        self.midi_in.set_callback(callback, raw=True)
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message([0xC0, 5])
+        self.midi_out.send_message(self.SYSEX_IDENTITY_REQUEST)
+        time.sleep(self.DELAY)
+        self.assertEqual([args[:3] for args in received],
+                         [tuple(self.NOTE_ON), (0xC0, 5, 0),
+                          (bytes(self.SYSEX_IDENTITY_REQUEST), 0, 0)])
+        self.assertTrue(all(isinstance(args[3], float) for args in received))
+
+        received = []
+        self.midi_in.set_callback(callback, batch=True, raw=True,
+                                  max_latency=self.DELAY / 2)
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message(self.NOTE_OFF)
+        time.sleep(self.DELAY)
+        self.assertEqual([args[:3] for args in received],
+                         [tuple(self.NOTE_ON), tuple(self.NOTE_OFF)])
+
+    @pytest.mark.filterwarnings("ignore::pytest.PytestUnraisableExceptionWarning")
+    def test_callback_raw_batch_continues_after_exception(self):
+        received = []
+
+        def callback(status, data1, data2, delta_time):
+            received.append(status)
+
+            if len(received) == 1:
+                raise RuntimeError("callback failed")
+
+        self.set_up_loopback()
+        self.midi_in.set_callback(callback, batch=True, raw=True,
+                                  max_latency=self.DELAY / 2)
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message(self.NOTE_OFF)
+        time.sleep(self.DELAY)
+        self.assertEqual(received, [self.NOTE_ON[0], self.NOTE_OFF[0]])
+
+    def test_callback_batch(self):
+        batches = []
+
+        def callback(events, data):
+            batches.append(([event[0] for event in events], data))
+
+        self.set_up_loopback()
+        self.midi_in.set_callback(callback, data=42, batch=True, max_latency=self.DELAY / 2)
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message(self.NOTE_OFF)
+        time.sleep(self.DELAY)
+        self.assertEqual(batches, [([self.NOTE_ON, self.NOTE_OFF], 42)])
+
+        self.midi_in.cancel_callback()
+        batches = []
+        self.midi_out.send_message(self.NOTE_ON)
+        time.sleep(self.DELAY)
+        self.assertEqual(batches, [])
+        self.assertEqual(self.midi_in.get_message()[0], self.NOTE_ON)
+
+    def test_cancel_callback_in_batch_callback(self):
+        batches = []
+
+        def callback(events, data):
+            batches.append([event[0] for event in events])
+            self.midi_in.cancel_callback()
+
+        self.set_up_loopback()
+        self.midi_in.set_callback(callback, batch=True, max_latency=self.DELAY / 4)
+        self.midi_out.send_message(self.NOTE_ON)
+        time.sleep(self.DELAY)
+        self.midi_out.send_message(self.NOTE_OFF)
+        time.sleep(self.DELAY)
+        self.assertEqual(batches, [[self.NOTE_ON]])
+        self.assertEqual(self.midi_in.get_message()[0], self.NOTE_OFF)
+
+    def test_callback_shared(self):
+        self.set_up_loopback()
+        received = []
+        self.midi_in.set_callback(lambda event, data: received.append((event[0], data)),
+                                  data=42, shared=True)
+        self.midi_out.send_message(self.NOTE_ON)
+        self.midi_out.send_message(self.NOTE_OFF)
+        time.sleep(self.DELAY)
+        self.assertEqual(received, [(self.NOTE_ON, 42), (self.NOTE_OFF, 42)])
+        self.assertRaises(rtmidi.InvalidUseError, rtmidi.MidiInGroup, [self.midi_in])
+
+        self.midi_in.cancel_callback()
+        self.midi_out.send_message(self.NOTE_ON)
+        time.sleep(self.DELAY)
+        self.assertEqual(len(received), 2)
+        self.assertEqual(self.midi_in.get_message()[0], self.NOTE_ON)
+
+    @pytest.mark.filterwarnings("ignore::pytest.PytestUnraisableExceptionWarning")
+    def test_callback_shared_raising(self):
+        self.set_up_loopback()
+        midi_in2 = rtmidi.MidiIn(self.API)
+        midi_in2.open_port(self.midi_in.get_ports().index(self.midi_out_port_name))
+        received = []
+
+        def raising(event, data):
+            raise RuntimeError("callback failed")
+
+        try:
+            self.midi_in.set_callback(raising, shared=True)
+            midi_in2.set_callback(lambda event, data: received.append(event[0]), shared=True)
+            self.midi_out.send_message(self.NOTE_ON)
+            self.midi_out.send_message(self.NOTE_OFF)
+            time.sleep(self.DELAY)
+            self.assertEqual(received, [self.NOTE_ON, self.NOTE_OFF])
+        finally:
+            midi_in2.close_port()
+            del midi_in2
+
+    def test_callback_batch_invalid_latency(self):
+        self.assertRaises(ValueError, self.midi_in.set_callback, print, batch=True,
+                          max_latency=-1)
+
+    def run_threads(self, *targets):
+        errors = []
+
+        def run(target):
+            try:
+                target()
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+    def test_concurrent_send_receive(self):
+        self.set_up_loopback()
+        received = []
+
+        def send():
+            for _ in range(100):
+                self.midi_out.send_message(self.NOTE_ON)
+
+        def receive():
+            deadline = time.monotonic() + 50 * self.DELAY
+
+            while len(received) < 800 and time.monotonic() < deadline:
+                received.extend(self.midi_in.get_messages())
+                time.sleep(0.001)
+
+        self.run_threads(receive, *[send] * 8)
+        self.assertEqual(len(received), 800)
+        self.assertTrue(all(event[0] == self.NOTE_ON for event in received))
+        self.assertEqual(self.midi_in.stats()['dropped'], 0)
+
+    def test_concurrent_sysex_and_notes(self):
+        self.set_up_loopback()
+        self.midi_in.ignore_types(sysex=False)
+        sysex = bytes([0xF0] + [i % 128 for i in range(1000)] + [0xF7])
+
+        def send_notes():
+            for _ in range(100):
+                self.midi_out.send_message(self.NOTE_ON)
+
+        def send_sysex():
+            for _ in range(5):
+                self.midi_out.send_message(sysex)
+
+        self.run_threads(send_sysex, send_notes)
+        time.sleep(self.DELAY)
+        received = [event[0] for event in self.midi_in.get_messages()]
+        self.assertEqual(received.count(self.NOTE_ON), 100)
+        self.assertEqual(received.count(list(sysex)), 5)
+
+    def test_concurrent_callback_registration(self):
+        self.set_up_loopback()
+        stop = threading.Event()
+
+        def send():
+            while not stop.is_set():
+                self.midi_out.send_message(self.NOTE_ON)
+                time.sleep(0.0001)
+
+        def register(batch, shared):
+            for _ in range(100):
+                self.midi_in.set_callback(lambda event, data: None, batch=batch,
+                                          shared=shared)
+                self.midi_in.set_callback_for(0x90, lambda event, data: None)
+                self.midi_in.cancel_callbacks_for()
+                self.midi_in.cancel_callback()
+                self.midi_in.set_error_callback(lambda etype, msg, data: None)
+                self.midi_in.cancel_error_callback()
+
+        sender = threading.Thread(target=send)
+        sender.start()
+
+        try:
+            self.run_threads(lambda: register(False, False), lambda: register(True, False),
+                             lambda: register(False, True))
+        finally:
+            stop.set()
+            sender.join()
+
+        time.sleep(self.DELAY)
+        self.midi_in.get_messages()
+        received = []
+        self.midi_in.set_callback(lambda event, data: received.append(event[0]))
+        self.midi_out.send_message(self.NOTE_OFF)
+        time.sleep(self.DELAY)
+        self.assertEqual(received, [self.NOTE_OFF])
+
+    def test_concurrent_delete(self):
+        midi_in = rtmidi.MidiIn(self.API)
+        midi_out = rtmidi.MidiOut(self.API)
+        midi_in.set_callback(lambda event, data: None, batch=True)
+        self.run_threads(*[midi_in.delete] * 4, *[midi_out.delete] * 4)
+        self.assertTrue(midi_in.is_deleted)
+        self.assertTrue(midi_out.is_deleted)
+
+    def test_callback_in_subinterpreter(self):
+        interpreters = pytest.importorskip('_interpreters')
+        self.set_up_loopback()
+        interp = interpreters.create('isolated')
+
+        try:
+            if interpreters.run_string(interp, 'import rtmidi') is not None:
+                pytest.skip("rtmidi was built without sub-interpreter support.")
+
+            timer = threading.Timer(self.DELAY, self.midi_out.send_message, args=(self.NOTE_ON,))
+            timer.start()
+            code = SUBINTERPRETER_CODE.format(api=self.API, port=self.midi_out_port_name,
+                                              message=self.NOTE_ON)
+            result = interpreters.run_string(interp, code)
+            timer.join()
+            self.assertIsNone(result)
+        finally:
+            interpreters.destroy(interp)
+
     def test_set_buffer_size(self):
         self.midi_in.set_buffer_size(1024, 4)
         self.test_callback()